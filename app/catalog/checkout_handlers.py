@@ -170,7 +170,8 @@ async def handle_checkout(
                     amount=-float(actual_total),
                     transaction_type=TransactionType.PURCHASE,
                     description=f"Оплата заказа #{order.id}",
-                    order_id=order.id
+                    order_id=order.id,
+                    user=user
                 )
                 
                 # Баланс обновляется автоматически при создании транзакции
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from os import getenv
 from typing import Optional
 from dotenv import load_dotenv
@@ -17,14 +18,32 @@ class Config:
         self.GROUP_ID = getenv("GROUP_ID")
         self.DATABASE_URL = getenv("DATABASE_URL", "sqlite+aiosqlite:///data/shop.db")
         self.DEBUG = getenv("DEBUG", "false")
+        self.ENVIRONMENT = getenv("ENVIRONMENT", "development")
         
         # Настройки сети и Telegram API
         self.TELEGRAM_TIMEOUT = int(getenv("TELEGRAM_TIMEOUT", "30"))  # Таймаут запросов к Telegram API
         self.TELEGRAM_RETRY_COUNT = int(getenv("TELEGRAM_RETRY_COUNT", "3"))  # Количество повторных попыток
-        self.TELEGRAM_RETRY_DELAY = float(getenv("TELEGRAM_RETRY_DELAY", "1.0"))  # Задержка между попытками
+        self.TELEGRAM_RETRY_DELAY = float(getenv("TELEGRAM_RETRY_DELAY", "1.0"))  # Базовая задержка между попытками (удваивается)
+        self.TELEGRAM_RETRY_MAX_DELAY = float(getenv("TELEGRAM_RETRY_MAX_DELAY", "30.0"))  # Потолок задержки между попытками
+        self.TELEGRAM_RETRY_JITTER = float(getenv("TELEGRAM_RETRY_JITTER", "0.5"))  # Случайная добавка к задержке (доля от нее)
+        self.TELEGRAM_GLOBAL_RPS = int(getenv("TELEGRAM_GLOBAL_RPS", "30"))  # Сообщений в секунду при рассылках (лимит Telegram ~30)
         self.AIOHTTP_POOL_SIZE = int(getenv("AIOHTTP_POOL_SIZE", "100"))  # Размер пула соединений
+        self.AIOHTTP_LIMIT_PER_HOST = int(getenv("AIOHTTP_LIMIT_PER_HOST", "64"))  # Соединений к одному хосту (api.telegram.org)
+        self.AIOHTTP_KEEPALIVE_TIMEOUT = float(getenv("AIOHTTP_KEEPALIVE_TIMEOUT", "75"))  # Сколько держать простаивающее соединение
         self.AIOHTTP_TIMEOUT = int(getenv("AIOHTTP_TIMEOUT", "60"))  # Таймаут aiohttp клиента
         
+        # Настройки пула соединений с БД
+        self.DB_POOL_SIZE = int(getenv("DB_POOL_SIZE", "20"))  # Постоянные соединения в пуле
+        self.DB_MAX_OVERFLOW = int(getenv("DB_MAX_OVERFLOW", "40"))  # Дополнительные соединения при пиковой нагрузке
+        self.DB_POOL_RECYCLE = int(getenv("DB_POOL_RECYCLE", "1800"))  # Пересоздание соединения через N секунд
+        self.DB_POOL_USE_LIFO = str(getenv("DB_POOL_USE_LIFO", "true")).lower() in ('true', '1', 'yes')  # Выдавать последнее использованное соединение
+        self.DB_QUERY_CACHE_SIZE = int(getenv("DB_QUERY_CACHE_SIZE", "1200"))  # Кэш скомпилированных SQL-выражений
+        self.DB_POOL_WARMUP = int(getenv("DB_POOL_WARMUP", "5"))  # Соединения, открываемые заранее при старте
+        # Вне продакшена ленивые загрузки связей логируются; true — падать с ошибкой (для тестов)
+        self.DB_LAZY_LOAD_RAISE = str(getenv("DB_LAZY_LOAD_RAISE", "false")).lower() in ('true', '1', 'yes')
+        # true — не создавать таблицы при старте (схемой управляют миграции)
+        self.DB_SKIP_CREATE_ALL = str(getenv("DB_SKIP_CREATE_ALL", "false")).lower() in ('true', '1', 'yes')
+        
         # Преобразуем GROUP_ID в int
         try:
             self.GROUP_ID = int(self.GROUP_ID) if self.GROUP_ID else None
@@ -32,4 +51,10 @@ class Config:
             self.GROUP_ID = None
             
         # Преобразуем DEBUG в bool
-        self.DEBUG = str(self.DEBUG).lower() in ('true', '1', 'yes')
\ No newline at end of file
+        self.DEBUG = str(self.DEBUG).lower() in ('true', '1', 'yes')
+
+
+@lru_cache(maxsize=1)
+def get_config() -> Config:
+    """Общий экземпляр конфигурации процесса (переменные окружения читаются один раз)"""
+    return Config()
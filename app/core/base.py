@@ -2,8 +2,16 @@
 Базовые классы для архитектуры
 """
 from abc import ABC
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
-from typing import Generic, TypeVar
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session, SessionTransaction
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from typing import Any, Callable, Generic, Tuple, Type, TypeVar, Union
+import functools
+import inspect
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,6 +19,88 @@ logger = logging.getLogger(__name__)
 # Generic типы для моделей
 ModelType = TypeVar('ModelType')
 
+def dialect_insert(bind: Union[AsyncSession, Session, AsyncConnection, Connection, str], model):
+    """
+    INSERT с поддержкой ON CONFLICT для диалекта PostgreSQL или SQLite
+    bind - сессия, соединение (например, в миграциях) или имя диалекта.
+    Для остальных диалектов возвращается обычный insert() без ON CONFLICT
+    """
+    if isinstance(bind, str):
+        dialect_name = bind
+    elif isinstance(bind, (AsyncSession, Session)):
+        dialect_name = bind.bind.dialect.name
+    else:
+        dialect_name = bind.dialect.name
+    
+    if dialect_name == 'postgresql':
+        return pg_insert(model)
+    if dialect_name == 'sqlite':
+        return sqlite_insert(model)
+    return insert(model)
+
+
+# Ключ session.info со списком действий, отложенных до конца транзакции
+_AFTER_TRANSACTION_KEY = 'after_transaction_callbacks'
+
+
+def run_after_transaction(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """
+    Выполнить callback, когда завершится внешняя транзакция сессии (commit или rollback)
+    Нужен для сброса кэшей: пока транзакция открыта, другие сессии видят старые данные
+    и могут снова закэшировать их, а после rollback в кэше не должно остаться незакоммиченного
+    """
+    session.info.setdefault(_AFTER_TRANSACTION_KEY, []).append(callback)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _run_after_transaction_callbacks(session: Session, transaction: SessionTransaction) -> None:
+    # SAVEPOINT (begin_nested) не завершает транзакцию - ждем внешнюю
+    if transaction.parent is not None:
+        return
+    for callback in session.info.pop(_AFTER_TRANSACTION_KEY, ()):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Error in after-transaction callback: {e}")
+
+
+def log_and_default(
+    default: Any,
+    message: str,
+    exceptions: Tuple[Type[BaseException], ...] = (SQLAlchemyError,)
+):
+    """
+    Декоратор async-методов сервиса: при ошибке БД пишет в лог message и возвращает default
+    
+    default - значение или фабрика (list, dict, lambda: {...}), чтобы изменяемый
+    результат не был общим между вызовами.
+    message форматируется аргументами метода: "Error getting user {telegram_id}"
+    exceptions - перехватываемые исключения; остальные (ошибки в коде) пробрасываются
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        func_logger = logging.getLogger(func.__module__)
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except exceptions as e:
+                # Сообщение собирается только на пути ошибки и только при включенном уровне ERROR
+                if func_logger.isEnabledFor(logging.ERROR):
+                    try:
+                        bound = signature.bind(*args, **kwargs)
+                        bound.apply_defaults()
+                        text = message.format(**bound.arguments)
+                    except (TypeError, KeyError, IndexError):
+                        text = message
+                    func_logger.error("%s: %s", text, e)
+                return default() if callable(default) else default
+        
+        return wrapper
+    return decorator
+
+
 class BaseRepository(ABC):
     """Базовый класс для всех репозиториев"""
     
@@ -27,7 +117,12 @@ class BaseRepository(ABC):
 
 
 class BaseService(ABC):
-    """Базовый класс для всех сервисов"""
+    """
+    Базовый класс для всех сервисов
+    
+    session должна быть сессией текущего запроса (создаётся в DatabaseMiddleware),
+    общей для всех сервисов обработчика — отдельные сессии держат лишние соединения пула
+    """
     
     def __init__(self, session: AsyncSession):
         self.session = session
@@ -12,17 +12,19 @@ class TransactionType:
     DEBIT = "debit"                # Списание (админом)
     EARNING = "earning"            # Начисление за активность
     
+    # Человекочитаемые названия (строятся один раз при импорте)
+    DISPLAY_NAMES = {
+        PURCHASE: "Покупка",
+        REFUND: "Возврат средств",
+        TOP_UP: "Пополнение",
+        DEBIT: "Списание",
+        EARNING: "Начисление"
+    }
+    
     @classmethod
     def get_display_name(cls, transaction_type: str) -> str:
         """Получить человекочитаемое название типа транзакции"""
-        display_names = {
-            cls.PURCHASE: "Покупка",
-            cls.REFUND: "Возврат средств",
-            cls.TOP_UP: "Пополнение",
-            cls.DEBIT: "Списание", 
-            cls.EARNING: "Начисление"
-        }
-        return display_names.get(transaction_type, transaction_type)
+        return cls.DISPLAY_NAMES.get(transaction_type, transaction_type)
     
     @classmethod
     def get_all_types(cls) -> list:
@@ -38,4 +40,12 @@ class TransactionType:
     @classmethod
     def is_valid_type(cls, transaction_type: str) -> bool:
         """Проверить, является ли тип транзакции валидным"""
-        return transaction_type in cls.get_all_types()
\ No newline at end of file
+        return transaction_type in cls.get_all_types()
+
+
+class BalanceOperationStatus:
+    """Результат атомарной операции с балансом T-Points"""
+    
+    OK = "ok"
+    USER_NOT_FOUND = "user_not_found"
+    INSUFFICIENT_FUNDS = "insufficient_funds"
@@ -1,23 +1,93 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from typing import AsyncGenerator
-from .config import Config
+from sqlalchemy import MetaData, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import AsyncGenerator, Optional
+from .config import Config, get_config
 
-config = Config()
 
-engine = create_async_engine(
-    config.DATABASE_URL,
-    echo=config.DEBUG
-)
+def is_memory_sqlite(database_url: str) -> bool:
+    """In-memory SQLite работает на StaticPool и не поддерживает настройки размера пула"""
+    return database_url.startswith("sqlite") and (":memory:" in database_url or database_url.rstrip("/").endswith(":"))
+
+
+def create_engine_from_config(config: Config, echo: bool = False) -> AsyncEngine:
+    """
+    Создать движок с явно настроенным пулом соединений
+    Размеры пула задаются через DB_POOL_SIZE / DB_MAX_OVERFLOW: постоянные соединения
+    переиспользуются между апдейтами вместо подключения на каждый запрос.
+    LIFO-выдача держит в работе недавно использованные (тёплые) соединения,
+    а лишние простаивают и закрываются по pool_recycle
+    """
+    pool_options = {}
+    if not is_memory_sqlite(config.DATABASE_URL):
+        pool_options = {
+            'poolclass': AsyncAdaptedQueuePool,
+            'pool_size': config.DB_POOL_SIZE,
+            'max_overflow': config.DB_MAX_OVERFLOW,
+            'pool_recycle': config.DB_POOL_RECYCLE,
+            'pool_use_lifo': config.DB_POOL_USE_LIFO,
+        }
+    
+    return create_async_engine(
+        config.DATABASE_URL,
+        echo=echo,
+        pool_pre_ping=True,  # Проверка соединения перед использованием
+        query_cache_size=config.DB_QUERY_CACHE_SIZE,  # Кэш скомпилированных запросов
+        **pool_options
+    )
+
+
+def _create_missing_tables(conn: Connection, metadata: MetaData) -> int:
+    """Создать только отсутствующие таблицы: список таблиц читается из БД одним запросом"""
+    existing = set(inspect(conn).get_table_names())
+    missing = [table for table in metadata.sorted_tables if table.name not in existing]
+    if missing:
+        metadata.create_all(conn, tables=missing, checkfirst=False)
+    return len(missing)
+
+
+async def create_missing_tables(engine: AsyncEngine, metadata: MetaData) -> int:
+    """
+    Создать недостающие таблицы схемы
+    На теплом старте (все таблицы уже есть) выполняется один запрос вместо проверки каждой таблицы в create_all.
+    Возвращает количество созданных таблиц
+    """
+    async with engine.begin() as conn:
+        return await conn.run_sync(_create_missing_tables, metadata)
+
+
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+
+
+def get_async_engine() -> AsyncEngine:
+    """
+    Общий движок процесса: создается при первом обращении, а не при импорте модуля.
+    Бот, скрипты и миграции, запущенные подряд, используют один пул соединений
+    """
+    global _engine
+    if _engine is None:
+        config = get_config()
+        _engine = create_engine_from_config(config, echo=config.DEBUG)
+    return _engine
+
+
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    """Фабрика сессий поверх общего движка процесса"""
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(
+            get_async_engine(),
+            class_=AsyncSession,
+            expire_on_commit=False
+        )
+    return _session_factory
 
-async_session_factory = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False
-)
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_factory() as session:
+    async with get_session_factory()() as session:
         try:
             yield session
         finally:
-            await session.close() 
\ No newline at end of file
+            await session.close() 
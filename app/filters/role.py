@@ -10,5 +10,4 @@ class IsAdmin(Filter):
         user_service = get_user_service()
         user_id = message_or_callback.from_user.id
         
-        user = await user_service.get_user_by_telegram_id(user_id)
-        return user and user.role == 'admin' 
\ No newline at end of file
+        return await user_service.get_user_role(user_id) == 'admin' 
\ No newline at end of file
@@ -7,6 +7,7 @@ from ..services.user import UserService
 from ..keyboards.main_menu import MainKeyboard
 from ..utils.message_editor import update_message
 from ..utils.callback_helpers import safe_callback_answer
+from ..utils.telegram_client import unblock_chat
 import logging
 from datetime import datetime, date, timedelta
 
@@ -42,6 +43,9 @@ async def cmd_start(message: Message, user_service: UserService, state: FSMConte
         
         logger.info(f"Start command called for user {message.from_user.id}")
         
+        # Пользователь пишет боту - значит, не блокирует его; рассылки снова доходят
+        unblock_chat(message.from_user.id)
+        
         # Проверяем, есть ли пользователь в БД
         user = await user_service.get_user(message.from_user.id)
         
@@ -54,7 +58,7 @@ async def cmd_start(message: Message, user_service: UserService, state: FSMConte
         logger.info(f"Existing user {user.telegram_id} role: {user.role}")
         
         # Существующий пользователь - показываем главное меню
-        welcome_text = await user_service.get_welcome_message(user)
+        welcome_text = user_service.get_welcome_message(user)
         keyboard = await MainKeyboard.get_main_keyboard(
             user_id=message.from_user.id,
             role=user.role
@@ -1,14 +1,14 @@
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, Message, FSInputFile
+from aiogram.types import CallbackQuery, Message, BufferedInputFile, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from ..services.user_manager_service import UserManagerService
+from ..utils.temp_file_manager import TempFileManager
 from ..utils.message_editor import update_message
 from ..utils.callback_helpers import safe_callback_answer
 from ..middlewares.access_control import HROrAdminAccess
 from ..keyboards.user_management_kb import UserManagementKeyboard
-import tempfile
 import os
 import logging
 
@@ -104,20 +104,12 @@ async def export_users(callback: CallbackQuery, user_manager_service: UserManage
         # Генерируем Excel файл
         excel_buffer = await user_manager_service.export_users_to_excel()
         
-        # Создаем временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-            temp_file.write(excel_buffer.getvalue())
-            temp_file_path = temp_file.name
-        
-        # Отправляем файл
+        # Отправляем файл прямо из памяти, без промежуточной записи на диск
         await callback.message.answer_document(
-            document=FSInputFile(temp_file_path, filename="employees.xlsx"),
+            document=BufferedInputFile(excel_buffer.getvalue(), filename="employees.xlsx"),
             caption="📤 <b>Экспорт сотрудников</b>\n\nДанные сотрудников по отделам"
         )
         
-        # Удаляем временный файл
-        os.remove(temp_file_path)
-        
         # Показываем меню
         keyboard = UserManagementKeyboard.get_users_export_menu()
         
@@ -176,20 +168,12 @@ async def export_tpoints_template(callback: CallbackQuery, user_manager_service:
         # Генерируем шаблон Excel файла
         excel_buffer = await user_manager_service.export_tpoints_template_to_excel()
         
-        # Создаем временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-            temp_file.write(excel_buffer.getvalue())
-            temp_file_path = temp_file.name
-        
-        # Отправляем файл
+        # Отправляем файл прямо из памяти, без промежуточной записи на диск
         await callback.message.answer_document(
-            document=FSInputFile(temp_file_path, filename="tpoints_template.xlsx"),
+            document=BufferedInputFile(excel_buffer.getvalue(), filename="tpoints_template.xlsx"),
             caption="📋 <b>Шаблон T-Points операций</b>\n\nЗаполните данные и отправьте обратно"
         )
         
-        # Удаляем временный файл
-        os.remove(temp_file_path)
-        
         # Показываем меню
         keyboard = UserManagementKeyboard.get_tpoints_export_menu()
         
@@ -233,7 +217,7 @@ async def request_tpoints_upload(callback: CallbackQuery, state: FSMContext):
 
 
 @user_management_router.message(F.document, StateFilter(UserManagementStates.awaiting_users_excel_upload))
-async def handle_users_excel_upload(message: Message, state: FSMContext, user_manager_service: UserManagerService):
+async def handle_users_excel_upload(message: Message, state: FSMContext, user_manager_service: UserManagerService, temp_file_manager: TempFileManager):
     """Обработка загрузки Excel файла с пользователями"""
     try:
         file = message.document
@@ -325,7 +309,6 @@ async def handle_users_excel_upload(message: Message, state: FSMContext, user_ma
             
             # Кнопки для подтверждения или отмены
             # Сохраняем файл через менеджер временных файлов
-            from ..utils.temp_file_manager import temp_file_manager
             file_id = temp_file_manager.store_file(file_path, ttl_minutes=30)
             
             keyboard = UserManagementKeyboard.get_users_confirm_import(file_id)
@@ -348,7 +331,7 @@ async def handle_users_excel_upload(message: Message, state: FSMContext, user_ma
 
 
 @user_management_router.message(F.document, StateFilter(UserManagementStates.awaiting_tpoints_excel_upload))
-async def handle_tpoints_excel_upload(message: Message, state: FSMContext, user_manager_service: UserManagerService):
+async def handle_tpoints_excel_upload(message: Message, state: FSMContext, user_manager_service: UserManagerService, temp_file_manager: TempFileManager):
     """Обработка загрузки Excel файла с T-Points операциями"""
     try:
         file = message.document
@@ -440,7 +423,6 @@ async def handle_tpoints_excel_upload(message: Message, state: FSMContext, user_
             
             # Кнопки для подтверждения или отмены
             # Сохраняем файл через менеджер временных файлов
-            from ..utils.temp_file_manager import temp_file_manager
             file_id = temp_file_manager.store_file(file_path, ttl_minutes=30)
             
             keyboard = UserManagementKeyboard.get_tpoints_confirm_operations(file_id)
@@ -463,12 +445,11 @@ async def handle_tpoints_excel_upload(message: Message, state: FSMContext, user_
 
 
 @user_management_router.callback_query(F.data.startswith("tpoints:confirm:"))
-async def confirm_tpoints_operations(callback: CallbackQuery, user_manager_service: UserManagerService):
+async def confirm_tpoints_operations(callback: CallbackQuery, user_manager_service: UserManagerService, temp_file_manager: TempFileManager):
     """Подтверждение и применение T-Points операций"""
     try:
-        from ..utils.temp_file_manager import temp_file_manager
         file_id = callback.data.replace("tpoints:confirm:", "")
-        file_path = temp_file_manager.get_file_path(file_id)
+        file_path = await temp_file_manager.get_file_path(file_id)
         
         if not file_path:
             await safe_callback_answer(callback, "❌ Файл не найден или истек срок действия", show_alert=True)
@@ -477,7 +458,7 @@ async def confirm_tpoints_operations(callback: CallbackQuery, user_manager_servi
         logger.info(f"Confirming T-Points operations from file: {file_path}")
         
         if not os.path.exists(file_path):
-            temp_file_manager.remove_file(file_id)
+            await temp_file_manager.remove_file(file_id)
             await safe_callback_answer(callback, "❌ Файл не найден", show_alert=True)
             return
         
@@ -514,7 +495,7 @@ async def confirm_tpoints_operations(callback: CallbackQuery, user_manager_servi
             await callback.message.answer(f"❌ Ошибка при выполнении операций: {str(apply_error)}")
         finally:
             # Удаляем временный файл через менеджер
-            temp_file_manager.remove_file(file_id)
+            await temp_file_manager.remove_file(file_id)
         
         # Возвращаем в меню T-Points
         keyboard = UserManagementKeyboard.get_tpoints_export_menu()
@@ -532,12 +513,11 @@ async def confirm_tpoints_operations(callback: CallbackQuery, user_manager_servi
 
 
 @user_management_router.callback_query(F.data.startswith("users:confirm:"))
-async def confirm_users_import(callback: CallbackQuery, user_manager_service: UserManagerService):
+async def confirm_users_import(callback: CallbackQuery, user_manager_service: UserManagerService, temp_file_manager: TempFileManager):
     """Подтверждение и применение импорта пользователей"""
     try:
-        from ..utils.temp_file_manager import temp_file_manager
         file_id = callback.data.replace("users:confirm:", "")
-        file_path = temp_file_manager.get_file_path(file_id)
+        file_path = await temp_file_manager.get_file_path(file_id)
         
         if not file_path:
             await safe_callback_answer(callback, "❌ Файл не найден или истек срок действия", show_alert=True)
@@ -546,7 +526,7 @@ async def confirm_users_import(callback: CallbackQuery, user_manager_service: Us
         logger.info(f"Confirming users import from file: {file_path}")
         
         if not os.path.exists(file_path):
-            temp_file_manager.remove_file(file_id)
+            await temp_file_manager.remove_file(file_id)
             await safe_callback_answer(callback, "❌ Файл не найден", show_alert=True)
             return
         
@@ -590,7 +570,7 @@ async def confirm_users_import(callback: CallbackQuery, user_manager_service: Us
             await callback.message.answer(f"❌ Ошибка при выполнении импорта: {str(apply_error)}")
         finally:
             # Удаляем временный файл через менеджер
-            temp_file_manager.remove_file(file_id)
+            await temp_file_manager.remove_file(file_id)
         
         # Возвращаем в меню управления пользователями
         keyboard = UserManagementKeyboard.get_users_export_menu()
@@ -608,14 +588,13 @@ async def confirm_users_import(callback: CallbackQuery, user_manager_service: Us
 
 
 @user_management_router.callback_query(F.data.startswith("users:cancel:"))
-async def cancel_users_import(callback: CallbackQuery):
+async def cancel_users_import(callback: CallbackQuery, temp_file_manager: TempFileManager):
     """Отмена импорта пользователей"""
     try:
-        from ..utils.temp_file_manager import temp_file_manager
         file_id = callback.data.replace("users:cancel:", "")
         
         # Удаляем временный файл через менеджер
-        temp_file_manager.remove_file(file_id)
+        await temp_file_manager.remove_file(file_id)
         
         # Возвращаем в меню управления пользователями
         keyboard = UserManagementKeyboard.get_users_export_menu()
@@ -634,14 +613,13 @@ async def cancel_users_import(callback: CallbackQuery):
 
 
 @user_management_router.callback_query(F.data.startswith("tpoints:cancel:"))
-async def cancel_tpoints_operations(callback: CallbackQuery):
+async def cancel_tpoints_operations(callback: CallbackQuery, temp_file_manager: TempFileManager):
     """Отмена T-Points операций"""
     try:
-        from ..utils.temp_file_manager import temp_file_manager
         file_id = callback.data.replace("tpoints:cancel:", "")
         
         # Удаляем временный файл через менеджер
-        temp_file_manager.remove_file(file_id)
+        await temp_file_manager.remove_file(file_id)
         
         # Возвращаем в меню T-Points
         keyboard = UserManagementKeyboard.get_tpoints_export_menu()
@@ -673,26 +651,21 @@ async def export_tpoints_journal(callback: CallbackQuery, user_manager_service:
         )
         
         # Генерируем Excel файл с журналом (за последние 30 дней)
-        excel_buffer = await user_manager_service.export_tpoints_journal_to_excel(days=30)
-        
-        # Создаем временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as temp_file:
-            temp_file.write(excel_buffer.getvalue())
-            temp_file_path = temp_file.name
+        journal_path = await user_manager_service.export_tpoints_journal_to_excel(days=30)
         
-        # Отправляем файл
-        await callback.message.answer_document(
-            document=FSInputFile(temp_file_path, filename="tpoints_journal.xlsx"),
-            caption=(
-                "📊 <b>Журнал T-Points операций</b>\n\n"
-                "📅 Период: последние 30 дней\n"
-                "📋 Данные разбиты по отделам\n"
-                "📊 Включена сводная статистика"
+        # Журнал может быть большим: файл отправляется с диска по частям и затем удаляется
+        try:
+            await callback.message.answer_document(
+                document=FSInputFile(journal_path, filename="tpoints_journal.xlsx"),
+                caption=(
+                    "📊 <b>Журнал T-Points операций</b>\n\n"
+                    "📅 Период: последние 30 дней\n"
+                    "📋 Данные разбиты по отделам\n"
+                    "📊 Включена сводная статистика"
+                )
             )
-        )
-        
-        # Удаляем временный файл
-        os.remove(temp_file_path)
+        finally:
+            os.remove(journal_path)
         
         # Показываем меню с опциями
         keyboard = UserManagementKeyboard.get_tpoints_journal_menu()
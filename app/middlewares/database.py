@@ -11,7 +11,7 @@ from datetime import datetime
 from app.services.cart import CartService
 from app.services.catalog import CatalogService
 from app.services.order import OrderService
-from app.services.user import UserService
+from app.services.user import UserService, start_request_user_cache, reset_request_user_cache
 from app.services.status_service import StatusService
 from app.services.onboarding_service import OnboardingService
 from app.services.notifications.order_notifications import OrderNotificationService
@@ -24,7 +24,8 @@ from app.services.auto_events_service import AutoEventsService
 from app.services.notifications.question_notifications import QuestionNotificationService
 from app.services.group_management_service import GroupManagementService
 from app.repositories.user_repository import UserRepository
-from app.config import Config
+from app.repositories.user_loader import UserLoader
+from app.config import get_config
 
 logger = logging.getLogger(__name__)
 
@@ -54,7 +55,7 @@ class DatabaseMiddleware(BaseMiddleware):
         """Инициализация middleware"""
         self.session_factory = session_factory
         self.bot = bot
-        self.config = Config()
+        self.config = get_config()
         self.group_id = self.config.GROUP_ID
         
     async def __call__(
@@ -68,9 +69,25 @@ class DatabaseMiddleware(BaseMiddleware):
         notifications = get_pending_notifications()
         notifications.clear()  # Очищаем очередь для этого запроса
         
+        # Пользователи и роли, загруженные за время апдейта, переиспользуются без повторных SELECT
+        user_cache_token = start_request_user_cache()
+        try:
+            return await self._handle(handler, event, data)
+        finally:
+            reset_request_user_cache(user_cache_token)
+    
+    async def _handle(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка апдейта в сессии запроса"""
         async with self.session_factory() as session:
             try:
-                # Создаем экземпляры сервисов для этого запроса
+                # Создаем экземпляры сервисов для этого запроса.
+                # Все сервисы работают в одной сессии запроса: соединение берётся из пула
+                # только при первом обращении к БД и возвращается после commit/rollback
                 order_notification_service = OrderNotificationService(session, self.bot, self.config)
                 question_service = QuestionService(session)
                 user_service = UserService(session)
@@ -78,23 +95,25 @@ class DatabaseMiddleware(BaseMiddleware):
                 cart_service = CartService(session)
                 status_service = StatusService(session)
                 onboarding_service = OnboardingService(session)
-                order_service = OrderService(session)
+                order_service = OrderService(session, status_service=status_service)
                 excel_service = ExcelService(session)
-                transaction_service = TransactionService(session)
+                user_loader = UserLoader(session)
+                transaction_service = TransactionService(session, user_loader=user_loader)
                 
                 # Создаем GroupManagementService если есть GROUP_ID
                 group_management_service = None
                 if self.group_id:
                     group_management_service = GroupManagementService(session, self.group_id)
                 
+                tpoints_activity_service = TPointsActivityService(session)
+                
                 # Передаем группу-сервис в UserManagerService
                 user_manager_service = UserManagerService(
                     session, 
                     group_management_service=group_management_service, 
-                    bot=self.bot
+                    bot=self.bot,
+                    tpoints_activity_service=tpoints_activity_service
                 )
-                
-                tpoints_activity_service = TPointsActivityService(session)
                 auto_events_service = AutoEventsService(session, self.bot)
                 question_notification_service = QuestionNotificationService(session, self.bot, self.config)
                 user_repository = UserRepository(session)
@@ -119,6 +138,7 @@ class DatabaseMiddleware(BaseMiddleware):
                     "auto_events_service": auto_events_service,
                     "question_notification_service": question_notification_service,
                     "user_repository": user_repository,
+                    "user_loader": user_loader,
                     "database_middleware": self,
                 })
                 
@@ -285,6 +305,11 @@ def get_user_service():
             async with _database_middleware.session_factory() as session:
                 user_service = UserService(session)
                 return await user_service.get_user_by_telegram_id(telegram_id)
+        
+        async def get_user_role(self, telegram_id: int) -> str:
+            # Роль обычно берётся из кэша, сессия открывается только при промахе
+            async with _database_middleware.session_factory() as session:
+                return await UserService(session).get_user_role(telegram_id)
     
     return TempUserService()
 
@@ -1,7 +1,6 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Boolean, Date, ForeignKey, Text, DateTime, Float, JSON
+from sqlalchemy import Column, Integer, String, Boolean, Date, ForeignKey, Text, DateTime, Float, JSON, func
 from datetime import date, datetime
-import json
 import logging
 
 
@@ -67,7 +66,7 @@ class Product(Base):
     price = Column(Integer, nullable=False)
     image_url = Column(String(500), nullable=True)
     is_available = Column(Boolean, default=True)
-    size_quantities = Column(Text, nullable=True)  # JSON строка с размерами {"XL": 10, "L": 21} или просто число
+    size_quantities = Column(JSON, nullable=True)  # Размеры {"XL": 10, "L": 21} или просто число (драйвер сам (де)сериализует JSON)
     color = Column(String(50), nullable=True)
     
     def __repr__(self):
@@ -75,44 +74,24 @@ class Product(Base):
     
     @property
     def sizes_dict(self):
-        """Получить размеры как словарь"""
-        if not self.size_quantities:
-            return {}
-        
-        # Сначала проверяем, не является ли это просто числом
-        try:
-            int(self.size_quantities)
-            # Если это число, возвращаем пустой словарь
-            return {}
-        except (ValueError, TypeError):
-            # Если не число, пробуем парсить как JSON
-            try:
-                parsed = json.loads(self.size_quantities)
-                # Проверяем, что это действительно словарь
-                if isinstance(parsed, dict):
-                    return parsed
-                else:
-                    return {}
-            except json.JSONDecodeError as e:
-                logging.error(f'JSONDecodeError in sizes_dict: {e} for product {self.id}')
-                return {}
+        """Получить размеры как словарь (копию, чтобы изменения не попадали в атрибут модели)"""
+        value = self.size_quantities
+        return dict(value) if isinstance(value, dict) else {}
     
     @sizes_dict.setter
     def sizes_dict(self, value):
         """Установить размеры из словаря"""
-        if value:
-            self.size_quantities = json.dumps(value, ensure_ascii=False)
-        else:
-            self.size_quantities = None
+        self.size_quantities = dict(value) if value else None
     
     @property
     def quantity_as_number(self):
         """Получить size_quantities как число"""
-        if not self.size_quantities:
+        value = self.size_quantities
+        if value is None or isinstance(value, dict):
             return 0
         try:
-            # Пробуем преобразовать в число
-            return int(self.size_quantities)
+            # Старые записи могли сохраниться строкой с числом
+            return int(value)
         except (ValueError, TypeError):
             # Если не число, возвращаем 0
             return 0
@@ -120,42 +99,29 @@ class Product(Base):
     @quantity_as_number.setter
     def quantity_as_number(self, value):
         """Установить size_quantities как число"""
-        self.size_quantities = str(value) if value is not None else None
+        self.size_quantities = int(value) if value is not None else None
     
     def is_clothing(self):
-        """Проверить, является ли товар одеждой (имеет размеры в JSON формате)"""
-        return bool(self.size_quantities and self.sizes_dict)
+        """Проверить, является ли товар одеждой (имеет размеры)"""
+        return bool(self.sizes_dict)
     
     def has_quantity_number(self):
         """Проверить, содержит ли size_quantities просто число"""
-        if not self.size_quantities:
+        if self.size_quantities is None:
             return False
         return not bool(self.sizes_dict) and self.quantity_as_number >= 0
     
     @property
     def total_stock(self):
         """Получить общее количество товара"""
-        if not self.size_quantities:
-            return 0
-        
-        # Сначала проверяем, является ли это числом
-        try:
-            # Пробуем получить как число
-            number_quantity = int(self.size_quantities)
-            return number_quantity
-        except (ValueError, TypeError):
-            # Если не число, пробуем как JSON словарь
+        value = self.size_quantities
+        if isinstance(value, dict):
             try:
-                sizes = self.sizes_dict
-                if sizes and isinstance(sizes, dict):
-                    return sum(sizes.values())
-                else:
-                    return 0
-            except (AttributeError, TypeError, KeyError) as e:
-                # Логируем конкретную ошибку вместо глухого перехвата
-                import logging
+                return sum(value.values())
+            except TypeError as e:
                 logging.error(f"Error calculating total_stock for product {self.id}: {e}")
                 return 0
+        return self.quantity_as_number
     
     # Relationships
     order_items = relationship("OrderItem", back_populates="product")
@@ -237,7 +203,7 @@ class TPointsActivity(Base):
     description = Column(Text, nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=func.now(), server_default=func.now(), onupdate=func.now())
     
     transactions = relationship("TPointsTransaction", back_populates="activity")
 
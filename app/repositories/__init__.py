@@ -7,6 +7,7 @@ from .question_repository import QuestionRepository
 from .tpoints_activity_repository import TPointsActivityRepository
 
 from .status_repository import StatusRepository
+from .user_loader import UserLoader
 
 __all__ = [
     'UserRepository',
@@ -16,5 +17,6 @@ __all__ = [
     'OrderRepository',
     'QuestionRepository',
     'TPointsActivityRepository',
-    'StatusRepository'
+    'StatusRepository',
+    'UserLoader'
 ] 
\ No newline at end of file
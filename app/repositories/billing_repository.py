@@ -2,35 +2,91 @@
 Репозиторий для работы с транзакциями T-Points
 Содержит ВСЮ работу с БД для биллинга
 """
-from typing import List, Optional
-from sqlalchemy import select, update, func
-from sqlalchemy.orm import selectinload
+from typing import AsyncIterator, List, Optional, Dict, Iterable, Tuple
+from sqlalchemy import select, update, insert, func, bindparam
+from sqlalchemy.orm import raiseload, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 
-from ..models.models import TPointsTransaction, User, TPointsActivity
-from ..core.base import BaseRepository
+from ..models.models import TPointsTransaction, User, TPointsActivity, Product
+from ..core.base import BaseRepository, run_after_transaction
+from ..core.constants import BalanceOperationStatus
+from ..utils.ttl_cache import TTLCache
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Кэш балансов (ключ - telegram_id) и общей статистики T-Points.
+# Сбрасывается при каждой записи баланса, TTL - только страховка
+balance_cache = TTLCache(ttl_seconds=60)
+tpoints_stats_cache = TTLCache(ttl_seconds=300)
+TPOINTS_STATS_CACHE_KEY = "global"
+# Названия активностей для описаний транзакций (сбрасывается при изменении активностей)
+activity_name_cache = TTLCache(ttl_seconds=300, maxsize=512)
+
+
+# Частые запросы собраны один раз на уровне модуля: параметры передаются через bindparam,
+# поэтому выражение не строится заново при каждом вызове, а скомпилированный SQL
+# берётся из кэша движка (query_cache_size)
+_STMT_USER_BY_ID = select(User).where(User.telegram_id == bindparam("uid"))
+_STMT_USER_BALANCE = select(User.tpoints).where(User.telegram_id == bindparam("uid"))
+_STMT_RECENT_TRANSACTIONS = (
+    select(TPointsTransaction)
+    .order_by(TPointsTransaction.created_at.desc())
+    .limit(bindparam("lim"))
+)
+_STMT_ACTIVITY_BY_ID = select(TPointsActivity).where(TPointsActivity.id == bindparam("activity_id"))
+
+
+def invalidate_balance_cache(*user_ids: int) -> None:
+    """Сбросить закэшированные балансы пользователей и общую статистику"""
+    for user_id in user_ids:
+        balance_cache.delete(user_id)
+    tpoints_stats_cache.clear()
+
+
+def invalidate_balance_cache_after_commit(session: AsyncSession, *user_ids: int) -> None:
+    """Сбросить балансы по завершении транзакции сессии (не раньше, чем изменения станут видны)"""
+    run_after_transaction(session, lambda: invalidate_balance_cache(*user_ids))
+
 class BillingRepository(BaseRepository):
     """Репозиторий для всех операций с транзакциями и балансом"""
 
     def __init__(self, session: AsyncSession):
         super().__init__(session)
 
+    @staticmethod
+    def _transaction_relations():
+        """Опции eager-загрузки связей транзакции (без ленивых запросов на каждую строку)"""
+        return (
+            selectinload(TPointsTransaction.user),
+            selectinload(TPointsTransaction.product),
+            selectinload(TPointsTransaction.activity)
+        )
+
     async def get_user_by_id(self, user_id: int) -> Optional[User]:
         """Получить пользователя по telegram_id (primary key)"""
         try:
             # user_id в нашей системе это telegram_id (primary key)
-            query = select(User).where(User.telegram_id == user_id)
-            result = await self.session.execute(query)
+            result = await self.session.execute(_STMT_USER_BY_ID, {"uid": user_id})
             return result.scalar_one_or_none()
         except Exception as e:
             logger.error(f"Error getting user {user_id}: {e}")
             return None
 
+    async def get_users_by_ids(self, user_ids: Iterable[int]) -> Dict[int, User]:
+        """Получить пользователей по списку telegram_id одним запросом"""
+        user_ids = set(user_ids)
+        if not user_ids:
+            return {}
+        try:
+            query = select(User).where(User.telegram_id.in_(user_ids))
+            result = await self.session.execute(query)
+            return {user.telegram_id: user for user in result.scalars()}
+        except Exception as e:
+            logger.error(f"Error getting users {user_ids}: {e}")
+            return {}
+
     async def get_user_by_id_for_update(self, user_id: int) -> Optional[User]:
         """
         Получить пользователя с блокировкой для обновления
@@ -61,6 +117,7 @@ class BillingRepository(BaseRepository):
         try:
             stmt = update(User).where(User.telegram_id == user_id).values(tpoints=new_balance)
             result = await self.session.execute(stmt)
+            invalidate_balance_cache_after_commit(self.session, user_id)
             # НЕ коммитим - это делает middleware!
             return result.rowcount > 0
         except Exception as e:
@@ -71,28 +128,27 @@ class BillingRepository(BaseRepository):
     async def get_user_balance(self, user_id: int) -> Optional[int]:
         """Получить баланс пользователя"""
         try:
-            query = select(User.tpoints).where(User.telegram_id == user_id)
-            result = await self.session.execute(query)
+            result = await self.session.execute(_STMT_USER_BALANCE, {"uid": user_id})
             balance = result.scalar_one_or_none()
             return balance
         except Exception as e:
             logger.error(f"Error getting balance for user {user_id}: {e}")
             return None
 
-    async def get_user_transactions(self, user_id: int, limit: int = 100) -> List[TPointsTransaction]:
-        """Получить историю транзакций пользователя"""
+    async def get_user_transactions(self, user_id: int, limit: int = 100, eager: bool = False) -> List[TPointsTransaction]:
+        """
+        Получить историю транзакций пользователя
+        eager=True подгружает user, product и activity теми же запросами
+        """
         try:
             query = (
                 select(TPointsTransaction)
-                .options(
-                    selectinload(TPointsTransaction.user),
-                    selectinload(TPointsTransaction.product),
-                    selectinload(TPointsTransaction.activity)
-                )
                 .where(TPointsTransaction.user_id == user_id)
                 .order_by(TPointsTransaction.created_at.desc())
                 .limit(limit)
             )
+            if eager:
+                query = query.options(*self._transaction_relations())
             result = await self.session.execute(query)
             return list(result.scalars().all())
         except Exception as e:
@@ -129,41 +185,36 @@ class BillingRepository(BaseRepository):
 
     async def create_transaction_with_balance_update(
         self, 
-        transaction: TPointsTransaction, 
-        new_balance: int
+        transaction: TPointsTransaction
     ) -> Optional[TPointsTransaction]:
         """
-        ИСПРАВЛЕНО: Атомарно создать транзакцию и обновить баланс пользователя
+        ИСПРАВЛЕНО: Атомарно создать транзакцию и изменить баланс пользователя на её сумму
         БЕЗ commit - в рамках общей транзакции middleware
+        Два запроса: относительный UPDATE tpoints = tpoints + amount (заодно проверяет
+        существование пользователя) и INSERT транзакции с RETURNING id при flush.
+        Баланс заранее не читается, поэтому параллельные изменения не теряются.
+        Один запрос с CTE (UPDATE ... RETURNING внутри INSERT) не используется:
+        SQLite не поддерживает изменяющие CTE, а ORM-объект транзакции должен остаться в сессии
         """
         try:
-            # Блокируем пользователя для обновления
-            user = await self.get_user_by_id_for_update(transaction.user_id)
-            if not user:
-                logger.error(f"User {transaction.user_id} not found for balance update")
-                return None
-            
-            # Добавляем транзакцию
-            self.session.add(transaction)
-            
-            # Обновляем баланс в той же транзакции
             stmt = update(User).where(
                 User.telegram_id == transaction.user_id
-            ).values(tpoints=new_balance)
+            ).values(tpoints=User.tpoints + transaction.points_amount)
             
             result = await self.session.execute(stmt)
             
             if result.rowcount == 0:
-                # Пользователь не найден (не должно произойти)
-                logger.error(f"Failed to update balance for user {transaction.user_id}")
+                logger.error(f"User {transaction.user_id} not found for balance update")
                 return None
+            invalidate_balance_cache_after_commit(self.session, transaction.user_id)
             
-            # Получаем ID транзакции
+            # Добавляем транзакцию и получаем её ID (INSERT ... RETURNING)
+            self.session.add(transaction)
             await self.session.flush()
             
             # НЕ коммитим - общий commit делает middleware!
             
-            logger.info(f"Created transaction {transaction.id} and updated balance for user {transaction.user_id}")
+            logger.info("Created transaction %s and updated balance for user %s", transaction.id, transaction.user_id)
             return transaction
             
         except Exception as e:
@@ -171,34 +222,192 @@ class BillingRepository(BaseRepository):
             # НЕ откатываем - общий rollback делает middleware!
             raise
 
-    async def get_recent_transactions(self, limit: int = 50) -> List[TPointsTransaction]:
-        """Получить последние транзакции всех пользователей"""
+    async def apply_transaction(
+        self,
+        transaction: TPointsTransaction,
+        user: Optional[User] = None
+    ) -> Tuple[str, Optional[TPointsTransaction]]:
+        """
+        Атомарно проверить баланс, создать транзакцию и обновить баланс пользователя
+        Баланс читается из заблокированной строки (SELECT ... FOR UPDATE), новый баланс
+        вычисляется от неё же — без повторного чтения и без гонки между проверкой и записью.
+        Если вызывающий код уже загрузил user, SELECT пропускается: баланс меняется
+        условным UPDATE tpoints = tpoints + amount, который сам проверяет достаточность средств.
+        БЕЗ commit - в рамках общей транзакции middleware
+        Возвращает (BalanceOperationStatus, транзакция или None)
+        """
         try:
-            query = (
-                select(TPointsTransaction)
-                .options(
-                    selectinload(TPointsTransaction.user),
-                    selectinload(TPointsTransaction.product),
-                    selectinload(TPointsTransaction.activity)
-                )
-                .order_by(TPointsTransaction.created_at.desc())
-                .limit(limit)
+            if user is not None:
+                return await self._apply_transaction_for_loaded_user(transaction, user)
+            
+            query = select(User.tpoints).where(
+                User.telegram_id == transaction.user_id
+            ).with_for_update()
+            result = await self.session.execute(query)
+            row = result.first()
+            if row is None:
+                return BalanceOperationStatus.USER_NOT_FOUND, None
+            
+            current_balance = row.tpoints or 0
+            amount = transaction.points_amount
+            if amount < 0 and current_balance < -amount:
+                return BalanceOperationStatus.INSUFFICIENT_FUNDS, None
+            
+            self.session.add(transaction)
+            await self.session.execute(
+                update(User)
+                .where(User.telegram_id == transaction.user_id)
+                .values(tpoints=current_balance + amount)
             )
+            invalidate_balance_cache_after_commit(self.session, transaction.user_id)
+            
+            # Получаем ID транзакции
+            await self.session.flush()
+            return BalanceOperationStatus.OK, transaction
+        except Exception as e:
+            logger.error(f"Error in atomic transaction creation: {e}")
+            # НЕ откатываем - общий rollback делает middleware!
+            raise
+
+    async def _apply_transaction_for_loaded_user(
+        self,
+        transaction: TPointsTransaction,
+        user: User
+    ) -> Tuple[str, Optional[TPointsTransaction]]:
+        """Применить транзакцию к уже загруженному пользователю без предварительного SELECT"""
+        amount = transaction.points_amount
+        stmt = update(User).where(User.telegram_id == user.telegram_id)
+        if amount < 0:
+            stmt = stmt.where(User.tpoints >= -amount)
+        stmt = stmt.values(tpoints=User.tpoints + amount).execution_options(synchronize_session="fetch")
+        
+        result = await self.session.execute(stmt)
+        if result.rowcount == 0:
+            return BalanceOperationStatus.INSUFFICIENT_FUNDS, None
+        invalidate_balance_cache_after_commit(self.session, user.telegram_id)
+        
+        self.session.add(transaction)
+        await self.session.flush()
+        return BalanceOperationStatus.OK, transaction
+
+    async def apply_bulk_points(self, entries: List[dict]) -> List[bool]:
+        """
+        Массово применить операции с T-Points (БЕЗ commit - в рамках общей транзакции middleware)
+        entries: [{"user_id", "amount", "description", "transaction_type", "activity_id"?}]
+        Возвращает список флагов успеха в порядке entries.
+        Пользователи блокируются одним запросом, транзакции вставляются одним INSERT,
+        балансы обновляются одним bulk UPDATE по первичному ключу
+        """
+        try:
+            user_ids = {entry['user_id'] for entry in entries}
+            query = select(User.telegram_id, User.tpoints).where(
+                User.telegram_id.in_(user_ids)
+            ).with_for_update()
             result = await self.session.execute(query)
+            balances = {telegram_id: tpoints or 0 for telegram_id, tpoints in result.all()}
+            
+            # Операции одного пользователя применяются последовательно в порядке entries,
+            # поэтому баланс проверяется с учётом предыдущих операций пакета.
+            # Параллельный asyncio.gather здесь не нужен и невозможен: одна AsyncSession
+            # не допускает конкурентных запросов, а весь пакет уже укладывается в 3 запроса
+            results = []
+            rows = []
+            for entry in entries:
+                user_id = entry['user_id']
+                amount = entry['amount']
+                balance = balances.get(user_id)
+                
+                if balance is None or (amount < 0 and balance < -amount):
+                    results.append(False)
+                    continue
+                
+                balances[user_id] = balance + amount
+                rows.append({
+                    'user_id': user_id,
+                    'points_amount': amount,
+                    'description': entry['description'],
+                    'transaction_type': entry['transaction_type'],
+                    'activity_id': entry.get('activity_id')
+                })
+                results.append(True)
+            
+            if rows:
+                await self.session.execute(insert(TPointsTransaction), rows)
+                changed_ids = {row['user_id'] for row in rows}
+                await self.session.execute(
+                    update(User),
+                    [{'telegram_id': user_id, 'tpoints': balances[user_id]} for user_id in changed_ids]
+                )
+                invalidate_balance_cache_after_commit(self.session, *changed_ids)
+            
+            return results
+        except Exception as e:
+            logger.error(f"Error applying bulk points: {e}")
+            # НЕ откатываем - общий rollback делает middleware!
+            raise
+
+    async def get_recent_transactions(self, limit: int = 50, eager: bool = False) -> List[TPointsTransaction]:
+        """
+        Получить последние транзакции всех пользователей
+        eager=True подгружает user, product и activity теми же запросами
+        """
+        try:
+            query = _STMT_RECENT_TRANSACTIONS
+            if eager:
+                query = query.options(*self._transaction_relations())
+            result = await self.session.execute(query, {"lim": limit})
             return list(result.scalars().all())
         except Exception as e:
             logger.error(f"Error getting recent transactions: {e}")
             return []
 
+    # Размер порции при потоковом чтении журнала
+    STREAM_BATCH_SIZE = 100
+
+    async def stream_recent_transactions(
+        self,
+        limit: int = 50,
+        user_id: Optional[int] = None
+    ) -> AsyncIterator[Tuple[TPointsTransaction, Optional[str], Optional[str]]]:
+        """
+        Потоково получить последние транзакции в виде (транзакция, fullname, username)
+        Имя пользователя берётся JOIN'ом без загрузки объектов User, product и activity
+        подгружаются пачками. Строки читаются с сервера порциями по STREAM_BATCH_SIZE
+        """
+        query = (
+            select(TPointsTransaction, User.fullname, User.username)
+            .outerjoin(User, User.telegram_id == TPointsTransaction.user_id)
+            .options(
+                selectinload(TPointsTransaction.product),
+                selectinload(TPointsTransaction.activity)
+            )
+            .order_by(TPointsTransaction.created_at.desc())
+            .limit(limit)
+            .execution_options(yield_per=self.STREAM_BATCH_SIZE)
+        )
+        if user_id:
+            query = query.where(TPointsTransaction.user_id == user_id)
+        
+        result = await self.session.stream(query)
+        async for transaction, fullname, username in result:
+            yield transaction, fullname, username
+
     async def get_transactions_since_date(self, since_date) -> List[TPointsTransaction]:
-        """Получить транзакции с определенной даты"""
+        """
+        Получить транзакции с определенной даты (для журнала операций)
+        Связи подгружаются пакетно и только с колонками, которые попадают в журнал;
+        любая другая ленивая загрузка запрещена (журнал собирается в отдельном потоке)
+        """
         try:
             query = (
                 select(TPointsTransaction)
                 .options(
-                    selectinload(TPointsTransaction.user),
-                    selectinload(TPointsTransaction.product),
-                    selectinload(TPointsTransaction.activity)
+                    selectinload(TPointsTransaction.user).load_only(
+                        User.telegram_id, User.username, User.fullname, User.department
+                    ),
+                    selectinload(TPointsTransaction.product).load_only(Product.name),
+                    selectinload(TPointsTransaction.activity).load_only(TPointsActivity.name),
+                    raiseload('*')
                 )
                 .where(TPointsTransaction.created_at >= since_date)
                 .order_by(TPointsTransaction.created_at.desc())
@@ -246,11 +455,39 @@ class BillingRepository(BaseRepository):
                 'monthly_transactions': 0
             }
 
+    async def get_transaction_type_summary(
+        self,
+        user_id: Optional[int] = None,
+        limit: int = 1000
+    ) -> List[Tuple[str, int, int]]:
+        """
+        Получить (transaction_type, количество, сумма) по последним limit транзакциям
+        Агрегация выполняется в БД
+        """
+        try:
+            recent = select(
+                TPointsTransaction.transaction_type,
+                TPointsTransaction.points_amount
+            ).order_by(TPointsTransaction.created_at.desc()).limit(limit)
+            if user_id:
+                recent = recent.where(TPointsTransaction.user_id == user_id)
+            recent = recent.subquery()
+            
+            query = select(
+                recent.c.transaction_type,
+                func.count(),
+                func.coalesce(func.sum(recent.c.points_amount), 0)
+            ).group_by(recent.c.transaction_type)
+            result = await self.session.execute(query)
+            return [tuple(row) for row in result.all()]
+        except Exception as e:
+            logger.error(f"Error getting transaction type summary: {e}")
+            return []
+
     async def get_activity_by_id(self, activity_id: int) -> Optional[TPointsActivity]:
         """Получить активность по ID"""
         try:
-            query = select(TPointsActivity).where(TPointsActivity.id == activity_id)
-            result = await self.session.execute(query)
+            result = await self.session.execute(_STMT_ACTIVITY_BY_ID, {"activity_id": activity_id})
             return result.scalar_one_or_none()
         except Exception as e:
             logger.error(f"Error getting activity {activity_id}: {e}")
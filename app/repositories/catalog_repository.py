@@ -4,7 +4,6 @@ from ..models.models import Product
 from ..core.base import BaseRepository
 from typing import List, Optional, Dict, Any
 import logging
-import json
 
 logger = logging.getLogger(__name__)
 
@@ -40,7 +39,7 @@ class CatalogRepository(BaseRepository):
     async def update_product_quantity(self, product_id: int, quantity: int) -> bool:
         """Обновить количество товара"""
         try:
-            query = update(Product).where(Product.id == product_id).values(size_quantities=str(quantity))
+            query = update(Product).where(Product.id == product_id).values(size_quantities=quantity)
             await self.session.execute(query)
             return True
         except Exception as e:
@@ -50,10 +49,8 @@ class CatalogRepository(BaseRepository):
     async def update_product_sizes(self, product_id: int, sizes: Dict[str, int]) -> bool:
         """Обновить размеры товара"""
         try:
-            # Преобразуем dict в JSON строку для сохранения
-            sizes_json = json.dumps(sizes)
-            
-            query = update(Product).where(Product.id == product_id).values(size_quantities=sizes_json)
+            # Колонка JSON - словарь сериализует драйвер
+            query = update(Product).where(Product.id == product_id).values(size_quantities=sizes)
             await self.session.execute(query)
             return True
         except Exception as e:
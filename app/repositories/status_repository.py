@@ -2,14 +2,14 @@
 Репозиторий для работы со статусами заказов и типами уведомлений
 """
 
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Sequence, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, insert
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, and_, insert, exists, union_all, cast, null, Integer
+from sqlalchemy.orm import selectinload, aliased
 import logging
 
 from ..models.models import OrderStatus, NotificationType, StatusTransition
-from ..core.base import BaseRepository
+from ..core.base import BaseRepository, dialect_insert
 
 logger = logging.getLogger(__name__)
 
@@ -67,6 +67,25 @@ class StatusRepository(BaseRepository):
             logger.error(f"Error getting all statuses: {e}")
             return []
     
+    async def get_status_rows(self) -> List[Tuple[str, Optional[str], str, Optional[str], Optional[str]]]:
+        """
+        Получить (code, emoji, name, comment_user, comment_hr) активных статусов
+        без загрузки ORM-объектов
+        """
+        try:
+            query = select(
+                OrderStatus.code,
+                OrderStatus.emoji,
+                OrderStatus.name,
+                OrderStatus.comment_user,
+                OrderStatus.comment_hr
+            ).where(OrderStatus.is_active == True).order_by(OrderStatus.order_index)
+            result = await self.session.execute(query)
+            return [tuple(row) for row in result.all()]
+        except Exception as e:
+            logger.error(f"Error getting status rows: {e}")
+            return []
+    
     async def create_status(self, status_data: dict) -> Optional[OrderStatus]:
         """Создать новый статус"""
         try:
@@ -154,6 +173,43 @@ class StatusRepository(BaseRepository):
             logger.error(f"Error getting status transition: {e}")
             return None
     
+    async def get_notification_for_transition_codes(self, from_code: Optional[str], to_code: str) -> Optional[NotificationType]:
+        """Получить тип уведомления для перехода по кодам статусов одним запросом"""
+        try:
+            from_status = aliased(OrderStatus)
+            to_status = aliased(OrderStatus)
+            
+            query = select(NotificationType).join(
+                StatusTransition, StatusTransition.notification_type_id == NotificationType.id
+            ).join(
+                to_status, StatusTransition.to_status_id == to_status.id
+            ).outerjoin(
+                from_status, StatusTransition.from_status_id == from_status.id
+            ).where(
+                and_(
+                    to_status.code == to_code,
+                    to_status.is_active == True,
+                    StatusTransition.is_active == True
+                )
+            )
+            
+            # Специфичный переход по коду или общий (from_status_id = NULL)
+            if from_code:
+                query = query.where(
+                    (from_status.code == from_code) | StatusTransition.from_status_id.is_(None)
+                )
+            else:
+                query = query.where(StatusTransition.from_status_id.is_(None))
+            
+            # Специфичный переход приоритетнее общего
+            query = query.order_by(StatusTransition.from_status_id.is_(None))
+            
+            result = await self.session.execute(query.limit(1))
+            return result.scalars().first()
+        except Exception as e:
+            logger.error(f"Error getting notification for transition {from_code} -> {to_code}: {e}")
+            return None
+    
     async def create_status_transition(self, transition_data: dict) -> Optional[StatusTransition]:
         """Создать переход между статусами"""
         try:
@@ -182,7 +238,9 @@ class StatusRepository(BaseRepository):
     async def bulk_create_statuses(self, statuses_data: List[dict]) -> bool:
         """Массовое создание статусов"""
         try:
-            stmt = insert(OrderStatus).values(statuses_data)
+            stmt = dialect_insert(self.session, OrderStatus).values(statuses_data).on_conflict_do_nothing(
+                index_elements=[OrderStatus.code]
+            )
             await self.session.execute(stmt)
             return True
         except Exception as e:
@@ -192,7 +250,9 @@ class StatusRepository(BaseRepository):
     async def bulk_create_notification_types(self, notifications_data: List[dict]) -> bool:
         """Массовое создание типов уведомлений"""
         try:
-            stmt = insert(NotificationType).values(notifications_data)
+            stmt = dialect_insert(self.session, NotificationType).values(notifications_data).on_conflict_do_nothing(
+                index_elements=[NotificationType.code]
+            )
             await self.session.execute(stmt)
             return True
         except Exception as e:
@@ -207,4 +267,51 @@ class StatusRepository(BaseRepository):
             return True
         except Exception as e:
             logger.error(f"Error bulk creating transitions: {e}")
-            return False 
\ No newline at end of file
+            return False
+    
+    async def bulk_create_transitions_by_codes(self, transitions: Sequence[Tuple[Optional[str], str, str]]) -> bool:
+        """
+        Массовое создание переходов по кодам (from_status, to_status, notification_type)
+        одним INSERT ... SELECT; уже существующие переходы пропускаются
+        """
+        try:
+            selects = []
+            for from_code, to_code, notification_code in transitions:
+                to_status = aliased(OrderStatus)
+                notification_type = aliased(NotificationType)
+                
+                query = select(to_status.id, notification_type.id).select_from(to_status).join(
+                    notification_type, notification_type.code == notification_code
+                )
+                
+                if from_code:
+                    from_status = aliased(OrderStatus)
+                    query = query.join(from_status, from_status.code == from_code)
+                    from_id = from_status.id
+                    same_from = StatusTransition.from_status_id == from_id
+                else:
+                    from_id = cast(null(), Integer)
+                    same_from = StatusTransition.from_status_id.is_(None)
+                
+                query = query.add_columns(from_id.label('from_status_id')).where(
+                    to_status.code == to_code,
+                    ~exists().where(
+                        same_from,
+                        StatusTransition.to_status_id == to_status.id,
+                        StatusTransition.notification_type_id == notification_type.id
+                    )
+                )
+                selects.append(query)
+            
+            if not selects:
+                return True
+            
+            stmt = insert(StatusTransition).from_select(
+                ['to_status_id', 'notification_type_id', 'from_status_id'],
+                union_all(*selects)
+            )
+            await self.session.execute(stmt)
+            return True
+        except Exception as e:
+            logger.error(f"Error bulk creating transitions by codes: {e}")
+            return False
@@ -1,13 +1,19 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, update, exists, and_
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased
 from typing import List, Optional, Dict
+from datetime import datetime
 import logging
 
 from ..models.models import TPointsActivity
+from ..core.base import dialect_insert
 
 logger = logging.getLogger(__name__)
 
+# Размер пачки для массовой записи активностей
+UPSERT_BATCH_SIZE = 500
+
 
 class TPointsActivityRepository:
     """Репозиторий для работы с T-Points активностями"""
@@ -45,6 +51,18 @@ class TPointsActivityRepository:
             logger.error(f"Error getting activity by name {name}: {e}")
             return None
     
+    async def get_points_by_name(self, name: str) -> Optional[int]:
+        """Получить только количество поинтов активности по имени"""
+        try:
+            query = select(TPointsActivity.points).where(
+                TPointsActivity.name == name,
+                TPointsActivity.is_active == True
+            )
+            return await self.session.scalar(query)
+        except SQLAlchemyError as e:
+            logger.error(f"Error getting points by name {name}: {e}")
+            return None
+    
     async def create_activity(self, name: str, points: int, description: str = None) -> Optional[TPointsActivity]:
         """Создать новую активность"""
         try:
@@ -70,18 +88,39 @@ class TPointsActivityRepository:
             logger.error(f"Error updating activity {activity.id}: {e}")
             return False
     
-    async def delete_activity(self, activity_id: int) -> bool:
-        """Удалить активность (мягкое удаление - is_active = False)"""
+    async def update_fields(self, activity_id: int, **fields) -> Optional[str]:
+        """
+        Обновить поля активности одним UPDATE ... RETURNING
+        Если передано новое имя, обновление выполняется только при его уникальности.
+        Возвращает имя активности или None, если ничего не обновлено
+        """
         try:
-            activity = await self.get_activity_by_id(activity_id)
-            if activity:
-                activity.is_active = False
-                await self.session.merge(activity)
-                return True
-            return False
+            conditions = [TPointsActivity.id == activity_id]
+            new_name = fields.get('name')
+            if new_name is not None:
+                duplicate = aliased(TPointsActivity)
+                conditions.append(~exists().where(
+                    and_(duplicate.name == new_name, duplicate.id != activity_id)
+                ))
+            
+            stmt = (
+                update(TPointsActivity)
+                .where(*conditions)
+                .values(**fields)
+                .returning(TPointsActivity.name)
+            )
+            result = await self.session.execute(stmt)
+            return result.scalar_one_or_none()
         except SQLAlchemyError as e:
-            logger.error(f"Error deleting activity {activity_id}: {e}")
-            return False
+            logger.error(f"Error updating activity fields {activity_id}: {e}")
+            return None
+    
+    async def delete_activity(self, activity_id: int) -> Optional[str]:
+        """
+        Удалить активность (мягкое удаление - is_active = False)
+        Возвращает имя удалённой активности или None, если она не найдена
+        """
+        return await self.update_fields(activity_id, is_active=False)
     
     async def hard_delete_activity(self, activity_id: int) -> bool:
         """Жёсткое удаление активности из БД"""
@@ -120,4 +159,52 @@ class TPointsActivityRepository:
             return True
         except SQLAlchemyError as e:
             logger.error(f"Error bulk creating activities: {e}")
-            return False 
\ No newline at end of file
+            return False 
+    
+    async def upsert_activities_and_prune(self, activities_data: List[Dict]) -> bool:
+        """
+        Заменить список активностей одной транзакцией:
+        существующие обновляются по имени (ID сохраняются), новые добавляются,
+        отсутствующие в списке деактивируются.
+        Запись идёт пачками по UPSERT_BATCH_SIZE строк Core-запросами без создания ORM-объектов.
+        Все записанные строки получают одну метку updated_at - по ней и находятся устаревшие,
+        без передачи полного списка имён в запрос
+        """
+        try:
+            run_marker = datetime.utcnow()
+            for start in range(0, len(activities_data), UPSERT_BATCH_SIZE):
+                rows = [
+                    {
+                        'name': data['name'],
+                        'points': data['points'],
+                        'description': data.get('description'),
+                        'is_active': True,
+                        'updated_at': run_marker
+                    }
+                    for data in activities_data[start:start + UPSERT_BATCH_SIZE]
+                ]
+                stmt = dialect_insert(self.session, TPointsActivity).values(rows)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[TPointsActivity.name],
+                    set_={
+                        'points': stmt.excluded.points,
+                        'description': stmt.excluded.description,
+                        'is_active': True,
+                        'updated_at': run_marker
+                    }
+                )
+                await self.session.execute(stmt)
+            
+            # Мягкое удаление, чтобы не ломать ссылки из истории транзакций
+            await self.session.execute(
+                update(TPointsActivity)
+                .where(
+                    TPointsActivity.is_active == True,
+                    TPointsActivity.updated_at != run_marker
+                )
+                .values(is_active=False)
+            )
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Error upserting activities: {e}")
+            return False
@@ -0,0 +1,78 @@
+"""
+Загрузчик пользователей в рамках одного запроса (по образцу DataLoader)
+Обращения к load() за один проход event loop объединяются в один SELECT ... IN,
+загруженные пользователи запоминаются до конца запроса
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models.models import User
+from .billing_repository import BillingRepository
+
+logger = logging.getLogger(__name__)
+
+
+class UserLoader:
+    """Пакетная загрузка пользователей по telegram_id с кэшем на время запроса"""
+
+    def __init__(self, session: AsyncSession):
+        self.billing_repo = BillingRepository(session)
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._queue: List[int] = []
+        self._dispatch_task: Optional[asyncio.Task] = None
+
+    def load(self, user_id: int) -> "asyncio.Future[Optional[User]]":
+        """Получить пользователя; запросы одного прохода event loop выполняются одним SELECT"""
+        future = self._futures.get(user_id)
+        if future is not None:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[user_id] = future
+        if not self._queue:
+            # Запрос уходит после того, как все задачи текущего прохода добавят свои id
+            loop.call_soon(self._schedule_dispatch, loop)
+        self._queue.append(user_id)
+        return future
+
+    async def load_many(self, user_ids: Iterable[int]) -> List[Optional[User]]:
+        """Получить пользователей в порядке user_ids"""
+        return list(await asyncio.gather(*(self.load(user_id) for user_id in user_ids)))
+
+    def prime(self, user: User) -> None:
+        """Запомнить уже загруженного пользователя"""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(user)
+        self._futures[user.telegram_id] = future
+
+    def clear(self, user_id: int) -> None:
+        """Забыть пользователя (например, после изменения его данных)"""
+        self._futures.pop(user_id, None)
+
+    def _schedule_dispatch(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._dispatch_task = loop.create_task(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        user_ids, self._queue = self._queue, []
+        try:
+            users = await self.billing_repo.get_users_by_ids(user_ids)
+        except Exception as e:
+            for user_id in user_ids:
+                future = self._futures.pop(user_id, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        for user_id in user_ids:
+            future = self._futures.get(user_id)
+            if future is None or future.done():
+                continue
+            user = users.get(user_id)
+            future.set_result(user)
+            if user is None:
+                # Отсутствующих пользователей не запоминаем — они могут появиться позже
+                self._futures.pop(user_id, None)
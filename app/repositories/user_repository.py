@@ -1,12 +1,51 @@
-from sqlalchemy import select, update, func, distinct
+from sqlalchemy import select, update, func, distinct, bindparam
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..models.models import User
-from ..core.base import BaseRepository
-from typing import List, Optional
+from ..core.base import BaseRepository, run_after_transaction
+from .billing_repository import invalidate_balance_cache_after_commit
+from ..utils.ttl_cache import TTLCache
+from typing import Dict, Iterable, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Самый частый запрос бота собран один раз; telegram_id передаётся через bindparam
+_STMT_USER_BY_TELEGRAM_ID = select(User).where(User.telegram_id == bindparam("telegram_id"))
+_STMT_USER_ROLE = select(User.role).where(User.telegram_id == bindparam("telegram_id"))
+
+# Выгрузка в Excel: кортежи выгружаемых колонок (без ORM-объектов и identity map),
+# порядок строк совпадает с порядком листов (активные по отделам, активные без отдела, неактивные)
+_EXPORT_DEPARTMENT = func.coalesce(func.trim(User.department), '')
+_STMT_USERS_FOR_EXPORT = select(
+    User.telegram_id, User.username, User.fullname, User.birth_date,
+    User.hire_date, User.department, User.is_active, User.tpoints
+).order_by(
+    func.coalesce(User.is_active, False).desc(),
+    (_EXPORT_DEPARTMENT == '').asc(),
+    _EXPORT_DEPARTMENT.asc()
+)
+_STMT_ACTIVE_USERS_FOR_EXPORT = _STMT_USERS_FOR_EXPORT.where(User.is_active == True)
+
+# Роль (ключ - telegram_id) запрашивается на каждом апдейте.
+# Кэшируется скалярное значение, а не ORM-объект: объект привязан к сессии своего запроса.
+# Сбрасывается после завершения транзакции, изменившей пользователя через репозиторий
+user_role_cache = TTLCache(ttl_seconds=60)
+
+
+def invalidate_user_cache(*telegram_ids: int) -> None:
+    """Сбросить закэшированные роли пользователей"""
+    for telegram_id in telegram_ids:
+        user_role_cache.delete(telegram_id)
+
+
+def invalidate_user_cache_after_commit(session: AsyncSession, *telegram_ids: int) -> None:
+    """
+    Сбросить роли по завершении транзакции сессии
+    Роль из кэша проверяет IsAdmin: ранний сброс позволил бы параллельному запросу
+    снова закэшировать старую роль до коммита
+    """
+    run_after_transaction(session, lambda: invalidate_user_cache(*telegram_ids))
+
 class UserRepository(BaseRepository):
     """Репозиторий для работы с пользователями"""
     
@@ -15,8 +54,20 @@ class UserRepository(BaseRepository):
         
     async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[User]:
         """Получить пользователя по Telegram ID"""
-        query = select(User).where(User.telegram_id == telegram_id)
-        result = await self.session.execute(query)
+        result = await self.session.execute(_STMT_USER_BY_TELEGRAM_ID, {"telegram_id": telegram_id})
+        return result.scalar_one_or_none()
+        
+    async def get_users_by_ids(self, telegram_ids: Iterable[int]) -> Dict[int, User]:
+        """Получить пользователей по списку Telegram ID одним запросом (WHERE telegram_id IN ...)"""
+        telegram_ids = set(telegram_ids)
+        if not telegram_ids:
+            return {}
+        result = await self.session.execute(select(User).where(User.telegram_id.in_(telegram_ids)))
+        return {user.telegram_id: user for user in result.scalars()}
+        
+    async def get_user_role(self, telegram_id: int) -> Optional[str]:
+        """Получить только роль пользователя (None, если пользователя нет)"""
+        result = await self.session.execute(_STMT_USER_ROLE, {"telegram_id": telegram_id})
         return result.scalar_one_or_none()
         
     async def get_user_by_id(self, user_id: int) -> Optional[User]:
@@ -26,8 +77,7 @@ class UserRepository(BaseRepository):
     async def get_or_create_user(self, telegram_id: int, username: Optional[str], fullname: str, is_active: bool = True) -> User:
         """Получить или создать пользователя"""
         # Пытаемся найти пользователя
-        query = select(User).where(User.telegram_id == telegram_id)
-        result = await self.session.execute(query)
+        result = await self.session.execute(_STMT_USER_BY_TELEGRAM_ID, {"telegram_id": telegram_id})
         user = result.scalar_one_or_none()
         
         if user:
@@ -48,7 +98,8 @@ class UserRepository(BaseRepository):
             )
             self.session.add(user)
             # Не нужно коммитить здесь - middleware сделает это
-            
+        
+        invalidate_user_cache_after_commit(self.session, telegram_id)
         return user
         
     async def update_tpoints(self, telegram_id: int, points: int) -> bool:
@@ -56,6 +107,7 @@ class UserRepository(BaseRepository):
         try:
             query = update(User).where(User.telegram_id == telegram_id).values(tpoints=points)
             await self.session.execute(query)
+            invalidate_balance_cache_after_commit(self.session, telegram_id)
             return True
         except Exception as e:
             logger.error(f"Error updating T-Points for user {telegram_id}: {e}")
@@ -89,6 +141,16 @@ class UserRepository(BaseRepository):
         result = await self.session.execute(query)
         return list(result.scalars().all())
         
+    async def get_user_rows_for_export(self, active_only: bool = False) -> List[tuple]:
+        """
+        Строки пользователей для Excel-выгрузки, упорядоченные по листам:
+        активные по отделам, активные без отдела, затем неактивные.
+        Кортеж: (telegram_id, username, fullname, birth_date, hire_date, department, is_active, tpoints)
+        """
+        query = _STMT_ACTIVE_USERS_FOR_EXPORT if active_only else _STMT_USERS_FOR_EXPORT
+        result = await self.session.execute(query)
+        return list(result.tuples().all())
+        
     async def get_all_active_users(self) -> List[User]:
         """Получить всех активных пользователей"""
         query = select(User).where(User.is_active == True)
@@ -107,6 +169,12 @@ class UserRepository(BaseRepository):
         result = await self.session.execute(query)
         return list(result.scalars().all())
         
+    async def get_hr_and_admin_telegram_ids(self) -> List[int]:
+        """Получить только telegram_id активных HR и админов (для рассылок)"""
+        query = select(User.telegram_id).where(User.role.in_(["hr", "admin"]), User.is_active == True)
+        result = await self.session.execute(query)
+        return list(result.scalars().all())
+        
     async def get_all_admins(self) -> List[User]:
         """Получить всех администраторов"""
         query = select(User).where(User.role == "admin")
@@ -136,28 +204,64 @@ class UserRepository(BaseRepository):
         try:
             query = update(User).where(User.telegram_id == telegram_id).values(**update_data)
             result = await self.session.execute(query)
+            invalidate_user_cache_after_commit(self.session, telegram_id)
+            if 'tpoints' in update_data:
+                invalidate_balance_cache_after_commit(self.session, telegram_id)
             return result.rowcount > 0
         except Exception as e:
             logger.error(f"Error updating user data for {telegram_id}: {e}")
             return False
 
+    async def bulk_update_users(self, updates: List[dict]) -> bool:
+        """
+        Обновить нескольких пользователей (БЕЗ commit - в рамках общей транзакции middleware)
+        updates: [{"telegram_id": ..., <поле>: <значение>, ...}] - наборы полей могут различаться.
+        ORM bulk UPDATE по первичному ключу: строки с одинаковым набором полей
+        уходят одним executemany, а не отдельным запросом на пользователя
+        """
+        if not updates:
+            return True
+        try:
+            await self.session.execute(update(User), updates)
+            telegram_ids = [item['telegram_id'] for item in updates]
+            invalidate_user_cache_after_commit(self.session, *telegram_ids)
+            invalidate_balance_cache_after_commit(self.session, *(item['telegram_id'] for item in updates if 'tpoints' in item))
+            return True
+        except Exception as e:
+            logger.error(f"Error bulk updating {len(updates)} users: {e}")
+            return False
+
+    async def update_user_data_returning(self, telegram_id: int, update_data: dict) -> Optional[User]:
+        """Обновить данные пользователя и вернуть его тем же запросом (UPDATE ... RETURNING)"""
+        try:
+            query = (
+                update(User)
+                .where(User.telegram_id == telegram_id)
+                .values(**update_data)
+                .returning(User)
+            )
+            result = await self.session.execute(query)
+            invalidate_user_cache_after_commit(self.session, telegram_id)
+            if 'tpoints' in update_data:
+                invalidate_balance_cache_after_commit(self.session, telegram_id)
+            return result.scalar_one_or_none()
+        except Exception as e:
+            logger.error(f"Error updating user data for {telegram_id}: {e}")
+            return None
+
     async def get_users_stats(self) -> dict:
         """Получить статистику по пользователям"""
         try:
-            # Общее количество пользователей
-            total_query = select(func.count(User.telegram_id))
-            total_result = await self.session.execute(total_query)
-            total_users = total_result.scalar() or 0
-            
-            # Активные пользователи  
-            active_query = select(func.count(User.telegram_id)).where(User.is_active == True)
-            active_result = await self.session.execute(active_query)
-            active_users = active_result.scalar() or 0
-            
-            # Количество отделов (уникальные department)
-            departments_query = select(func.count(distinct(User.department))).where(User.department.isnot(None))
-            departments_result = await self.session.execute(departments_query)
-            departments_count = departments_result.scalar() or 0
+            # Все три показателя одним запросом; COUNT(DISTINCT) не учитывает NULL в department
+            query = select(
+                func.count(User.telegram_id).label('total'),
+                func.count(User.telegram_id).filter(User.is_active == True).label('active'),
+                func.count(distinct(User.department)).label('departments')
+            )
+            row = (await self.session.execute(query)).one()
+            total_users = row.total or 0
+            active_users = row.active or 0
+            departments_count = row.departments or 0
             
             return {
                 'total_users': total_users,
@@ -6,7 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 from datetime import datetime, time, timedelta
 import asyncio
-from ...utils.telegram_client import SafeTelegramClient
+from ...utils.telegram_client import create_safe_telegram_client
 from ...config import Config
 
 logger = logging.getLogger(__name__)
@@ -17,13 +17,8 @@ class BaseNotificationService(ABC):
     def __init__(self, session: AsyncSession, bot: Bot, config: Config = None):
         self.session = session
         self.bot = bot
-        # Создаем безопасный клиент для отправки сообщений
-        if config:
-            self.safe_client = SafeTelegramClient(bot, config)
-        else:
-            # Fallback для обратной совместимости
-            from ...config import Config
-            self.safe_client = SafeTelegramClient(bot, Config())
+        # Безопасный клиент для отправки сообщений - общий для всех сервисов этого бота
+        self.safe_client = create_safe_telegram_client(bot, config)
         
     @abstractmethod
     async def send_notification(self, **kwargs) -> bool:
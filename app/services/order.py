@@ -18,14 +18,15 @@ logger = logging.getLogger(__name__)
 class OrderService(BaseService):
     """Сервис для работы с заказами - ИСПРАВЛЕНО: только бизнес-логика"""
     
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, status_service: Optional[StatusService] = None):
         super().__init__(session)
         self.order_repo = OrderRepository(session)
         self.cart_repo = CartRepository(session)
         self.user_repo = UserRepository(session)
         self.billing_repo = BillingRepository(session)
         self.catalog_repo = CatalogRepository(session)
-        self.status_service = StatusService(session)
+        # Переиспользуем StatusService запроса, чтобы работать в той же сессии
+        self.status_service = status_service or StatusService(session)
         self.refund_service = RefundService(session)
     
     async def get_orders(self, user_id: int = None, skip: int = 0, limit: int = 100) -> List[Order]:
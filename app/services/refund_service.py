@@ -31,17 +31,9 @@ class RefundService(BaseService):
                 transaction_type=TransactionType.REFUND
             )
             
-            # Получаем текущий баланс пользователя
-            current_balance = await self.billing_repo.get_user_balance(user_id)
-            if current_balance is None:
-                logger.error(f"User {user_id} not found for refund")
-                return False
-            
-            new_balance = current_balance + int(refund_amount)
-            
-            # Атомарно создаем транзакцию и обновляем баланс
+            # Атомарно создаем транзакцию и увеличиваем баланс на сумму возврата
             created_transaction = await self.billing_repo.create_transaction_with_balance_update(
-                refund_transaction, new_balance
+                refund_transaction
             )
             
             if created_transaction:
@@ -2,14 +2,41 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from typing import List, Optional, Dict, Tuple
 import logging
+import re
+import time
 from datetime import datetime
 
-from app.core.base import BaseService
+from app.core.base import BaseService, run_after_transaction
 from ..repositories.tpoints_activity_repository import TPointsActivityRepository
+from ..repositories.billing_repository import activity_name_cache
 from ..models.models import TPointsActivity
 
 logger = logging.getLogger(__name__)
 
+# Строка списка активностей: "название: поинты"
+_ACTIVITY_LINE_RE = re.compile(r'^\s*([^:]*?)\s*:\s*(-?\d+)\s*$')
+
+# Кэш словаря активностей {название: поинты} в рамках процесса
+_ACTIVITIES_CACHE_TTL = 60  # секунд
+_ACTIVITIES_CACHE: Optional[Tuple[float, Dict[str, int]]] = None
+_ACTIVITIES_VERSION = 0
+
+
+def invalidate_activities_cache() -> None:
+    """
+    Сбросить кэш активностей после изменения списка
+    Из сервиса вызывается через run_after_transaction - когда изменения уже закоммичены
+    """
+    global _ACTIVITIES_CACHE, _ACTIVITIES_VERSION
+    _ACTIVITIES_CACHE = None
+    _ACTIVITIES_VERSION += 1
+    activity_name_cache.clear()
+
+
+def activities_version() -> int:
+    """Номер версии списка активностей (растет при каждом изменении)"""
+    return _ACTIVITIES_VERSION
+
 
 class TPointsActivityService(BaseService):
     """Сервис для работы с T-Points активностями"""
@@ -23,22 +50,27 @@ class TPointsActivityService(BaseService):
         Получить список активностей в виде словаря {название: поинты}
         Бизнес-логика: только активные активности, отсортированные по поинтам
         """
-        try:
-            activities = await self.activity_repo.get_all_activities()
-            return {activity.name: activity.points for activity in activities}
-        except Exception as e:
-            logger.error(f"Error getting activities dict: {e}")
-            return {}
+        global _ACTIVITIES_CACHE
+        
+        cached = _ACTIVITIES_CACHE
+        if cached is not None and time.monotonic() - cached[0] < _ACTIVITIES_CACHE_TTL:
+            return dict(cached[1])
+        
+        # Ошибки БД логируются в репозитории
+        version = _ACTIVITIES_VERSION
+        activities = await self.activity_repo.get_all_activities()
+        activities_dict = {activity.name: activity.points for activity in activities}
+        
+        # Не кэшируем результат, если список изменился во время запроса
+        if version == _ACTIVITIES_VERSION:
+            _ACTIVITIES_CACHE = (time.monotonic(), activities_dict)
+        return dict(activities_dict)
     
     async def get_all_activities_full(self) -> List[TPointsActivity]:
         """
         Получить полный список активностей (для админки)
         """
-        try:
-            return await self.activity_repo.get_all_activities()
-        except Exception as e:
-            logger.error(f"Error getting full activities: {e}")
-            return []
+        return await self.activity_repo.get_all_activities()
     
     async def create_activity(self, name: str, points: int, description: str = None) -> Tuple[bool, str]:
         """
@@ -64,13 +96,14 @@ class TPointsActivityService(BaseService):
             activity = await self.activity_repo.create_activity(name, points, description)
             
             if activity:
+                run_after_transaction(self.session, invalidate_activities_cache)
                 logger.info(f"Created new activity: {name} ({points} points)")
                 return True, f"Активность '{name}' создана успешно"
             else:
                 return False, "Ошибка при создании активности"
                 
-        except Exception as e:
-            logger.error(f"Error creating activity {name}: {e}")
+        except SQLAlchemyError as e:
+            logger.exception("Error creating activity %s", name)
             return False, f"Ошибка: {str(e)}"
     
     async def update_activity(self, activity_id: int, name: str = None, points: int = None, 
@@ -80,46 +113,45 @@ class TPointsActivityService(BaseService):
         Бизнес-логика: валидация и проверка уникальности имени
         """
         try:
-            activity = await self.activity_repo.get_activity_by_id(activity_id)
-            if not activity:
-                return False, "Активность не найдена"
-            
             # Бизнес-логика: обновляем только переданные поля
+            fields = {}
+            
             if name is not None:
                 name = name.strip()
                 if not name:
                     return False, "Название не может быть пустым"
-                
-                # Проверяем уникальность нового имени
-                if name != activity.name:
-                    existing = await self.activity_repo.get_activity_by_name(name)
-                    if existing:
-                        return False, f"Активность '{name}' уже существует"
-                
-                activity.name = name
+                fields['name'] = name
             
             if points is not None:
                 if points < 0:
                     return False, "Количество поинтов не может быть отрицательным"
-                activity.points = points
+                fields['points'] = points
             
             if description is not None:
-                activity.description = description
-            
-            # Обновляем время изменения
-            activity.updated_at = datetime.utcnow()
-            
-            # Сохраняем через репозиторий
-            success = await self.activity_repo.update_activity(activity)
-            
-            if success:
-                logger.info(f"Updated activity {activity_id}: {activity.name}")
-                return True, "Активность обновлена успешно"
-            else:
+                fields['description'] = description
+            
+            # UPDATE без SET SQLAlchemy не собирает - пустой вызов ничего не меняет
+            if not fields:
+                return False, "Нет полей для обновления"
+            
+            # Одно UPDATE с проверкой уникальности имени внутри запроса
+            updated_name = await self.activity_repo.update_fields(activity_id, **fields)
+            
+            if updated_name is None:
+                # Различаем "не найдена" и конфликт имени только на пути ошибки
+                activity = await self.activity_repo.get_activity_by_id(activity_id)
+                if not activity:
+                    return False, "Активность не найдена"
+                if name is not None:
+                    return False, f"Активность '{name}' уже существует"
                 return False, "Ошибка при обновлении активности"
+            
+            run_after_transaction(self.session, invalidate_activities_cache)
+            logger.info(f"Updated activity {activity_id}: {updated_name}")
+            return True, "Активность обновлена успешно"
                 
-        except Exception as e:
-            logger.error(f"Error updating activity {activity_id}: {e}")
+        except SQLAlchemyError as e:
+            logger.exception("Error updating activity %s", activity_id)
             return False, f"Ошибка: {str(e)}"
     
     async def delete_activity(self, activity_id: int) -> Tuple[bool, str]:
@@ -127,20 +159,16 @@ class TPointsActivityService(BaseService):
         Удалить активность (мягкое удаление)
         """
         try:
-            activity = await self.activity_repo.get_activity_by_id(activity_id)
-            if not activity:
+            deleted_name = await self.activity_repo.delete_activity(activity_id)
+            if deleted_name is None:
                 return False, "Активность не найдена"
             
-            success = await self.activity_repo.delete_activity(activity_id)
-            
-            if success:
-                logger.info(f"Deleted activity {activity_id}: {activity.name}")
-                return True, f"Активность '{activity.name}' удалена"
-            else:
-                return False, "Ошибка при удалении активности"
+            run_after_transaction(self.session, invalidate_activities_cache)
+            logger.info(f"Deleted activity {activity_id}: {deleted_name}")
+            return True, f"Активность '{deleted_name}' удалена"
                 
-        except Exception as e:
-            logger.error(f"Error deleting activity {activity_id}: {e}")
+        except SQLAlchemyError as e:
+            logger.exception("Error deleting activity %s", activity_id)
             return False, f"Ошибка: {str(e)}"
     
     async def update_activities_from_text(self, text_data: str) -> Tuple[bool, str]:
@@ -151,25 +179,22 @@ class TPointsActivityService(BaseService):
         try:
             # Бизнес-логика: парсим текстовые данные
             new_activities = []
+            seen_names: set = set()
+            description = f"Обновлено из списка {datetime.now().strftime('%d.%m.%Y %H:%M')}"
             lines = text_data.strip().split('\n')
             
             for line_num, line in enumerate(lines, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                
-                if ':' not in line:
-                    return False, f"Строка {line_num}: неверный формат. Ожидается 'название:поинты'"
+                match = _ACTIVITY_LINE_RE.match(line)
+                if match is None:
+                    # Разбираем причину ошибки только на неуспешном пути
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if ':' not in line:
+                        return False, f"Строка {line_num}: неверный формат. Ожидается 'название:поинты'"
+                    return False, f"Строка {line_num}: '{line.split(':', 1)[1].strip()}' не является числом"
                 
-                parts = line.split(':', 1)
-                if len(parts) != 2:
-                    return False, f"Строка {line_num}: неверный формат"
-                
-                name = parts[0].strip()
-                try:
-                    points = int(parts[1].strip())
-                except ValueError:
-                    return False, f"Строка {line_num}: '{parts[1].strip()}' не является числом"
+                name, points = match.group(1), int(match.group(2))
                 
                 if not name:
                     return False, f"Строка {line_num}: название не может быть пустым"
@@ -178,60 +203,45 @@ class TPointsActivityService(BaseService):
                     return False, f"Строка {line_num}: поинты не могут быть отрицательными"
                 
                 # Проверяем дубликаты в самом списке
-                if any(act['name'] == name for act in new_activities):
+                if name in seen_names:
                     return False, f"Дубликат активности: '{name}'"
+                seen_names.add(name)
                 
                 new_activities.append({
                     'name': name,
                     'points': points,
-                    'description': f"Обновлено из списка {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+                    'description': description
                 })
             
             if not new_activities:
                 return False, "Не найдено ни одной валидной активности"
             
-            # Бизнес-логика: заменяем весь список
-            # 1. Очищаем старые данные
-            success = await self.activity_repo.clear_all_activities()
-            if not success:
-                return False, "Ошибка при очистке старых данных"
-            
-            # 2. Добавляем новые данные
-            success = await self.activity_repo.bulk_create_activities(new_activities)
+            # Бизнес-логика: заменяем весь список одной операцией upsert
+            success = await self.activity_repo.upsert_activities_and_prune(new_activities)
             if not success:
-                return False, "Ошибка при добавлении новых данных"
+                return False, "Ошибка при обновлении данных"
             
+            run_after_transaction(self.session, invalidate_activities_cache)
             logger.info(f"Updated activities list: {len(new_activities)} activities")
             return True, f"Список обновлён: {len(new_activities)} активностей"
             
-        except SQLAlchemyError as db_e:
-            logger.error(f"Database error updating activities: {db_e}")
+        except SQLAlchemyError:
+            logger.exception("Database error updating activities")
             raise  # Пробрасываем для rollback
-        except Exception as e:
-            logger.error(f"Error updating activities from text: {e}")
-            return False, f"Ошибка: {str(e)}"
     
     async def get_activity_by_name(self, name: str) -> Optional[TPointsActivity]:
         """
         Получить активность по названию
         """
-        try:
-            return await self.activity_repo.get_activity_by_name(name.strip())
-        except Exception as e:
-            logger.error(f"Error getting activity by name {name}: {e}")
-            return None
+        return await self.activity_repo.get_activity_by_name(name.strip())
     
     async def get_activity_points(self, name: str) -> int:
         """
         Получить количество поинтов за активность
         Бизнес-логика: возвращает 0 если активность не найдена
         """
-        try:
-            activity = await self.get_activity_by_name(name)
-            return activity.points if activity else 0
-        except Exception as e:
-            logger.error(f"Error getting points for activity {name}: {e}")
-            return 0
+        points = await self.activity_repo.get_points_by_name(name.strip())
+        return points if points is not None else 0
 
 
 # Алиас для обратной совместимости (возможно используется в старом коде)
@@ -1,23 +1,59 @@
-from typing import List, Optional
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import AsyncIterator, List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import logging
 
 from app.models.models import TPointsTransaction, User, Product, TPointsActivity
 from app.core.base import BaseService
-from app.core.constants import TransactionType
-from app.repositories.billing_repository import BillingRepository
+from app.core.constants import TransactionType, BalanceOperationStatus
+from app.repositories.billing_repository import (
+    BillingRepository,
+    balance_cache,
+    activity_name_cache,
+    tpoints_stats_cache,
+    TPOINTS_STATS_CACHE_KEY,
+)
+from app.repositories.user_loader import UserLoader
 
 logger = logging.getLogger(__name__)
 
+
+@dataclass(slots=True)
+class JournalEntry:
+    """Запись журнала операций T-Points"""
+    id: int
+    user_id: int
+    user_fullname: str
+    user_username: Optional[str]
+    points_amount: int
+    description: str
+    created_at: datetime
+    type: str
+    transaction_type: str
+    transaction_type_name: str
+    order_id: Optional[int]
+    activity: Optional[dict] = None
+    product: Optional[dict] = None
+
+    def to_dict(self) -> dict:
+        """Представление в виде словаря (для сериализации)"""
+        return asdict(self)
+
+
 class TransactionService(BaseService):
     """
     Сервис для работы с транзакциями T-Points
     ИСПРАВЛЕНО: работает через репозиторий, содержит только бизнес-логику
     """
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, user_loader: Optional[UserLoader] = None):
         super().__init__(session)
         self.billing_repo = BillingRepository(session)
+        # Загрузчик пользователей запроса: повторные операции с одним пользователем не делают SELECT
+        self.user_loader = user_loader
 
     async def create_transaction(
         self,
@@ -27,27 +63,18 @@ class TransactionService(BaseService):
         product_id: Optional[int] = None,
         activity_id: Optional[int] = None,
         transaction_type: str = TransactionType.TOP_UP,
-        order_id: Optional[int] = None
+        order_id: Optional[int] = None,
+        user: Optional[User] = None
     ) -> Optional[TPointsTransaction]:
         """
         Создать новую транзакцию T-Points
         ИСПРАВЛЕНО: атомарная операция через репозиторий + поддержка типов
+        user: уже загруженный пользователь — позволяет пропустить повторный SELECT
         """
         try:
             # Бизнес-логика: валидация данных
             if amount == 0:
-                logger.error(f"Invalid amount: {amount}")
-                return None
-            
-            # Получаем пользователя через репозиторий
-            user = await self.billing_repo.get_user_by_id(user_id)
-            if not user:
-                logger.error(f"User {user_id} not found")
-                return None
-            
-            # Бизнес-логика: проверка баланса для списания
-            if amount < 0 and user.tpoints < abs(amount):
-                logger.warning(f"Insufficient T-points for user {user_id}: {user.tpoints} < {abs(amount)}")
+                logger.error("Invalid amount: %s", amount)
                 return None
             
             # Создаем объект транзакции
@@ -61,33 +88,47 @@ class TransactionService(BaseService):
                 transaction_type=transaction_type
             )
             
-            # Вычисляем новый баланс
-            new_balance = user.tpoints + amount
+            if user is None and self.user_loader is not None:
+                user = await self.user_loader.load(user_id)
+                if user is None:
+                    logger.error("User %s not found", user_id)
+                    return None
             
-            # Атомарно создаем транзакцию и обновляем баланс
-            created_transaction = await self.billing_repo.create_transaction_with_balance_update(
-                transaction, new_balance
-            )
+            # Атомарно проверяем баланс, создаем транзакцию и обновляем баланс
+            status, created_transaction = await self.billing_repo.apply_transaction(transaction, user)
+            
+            if status == BalanceOperationStatus.USER_NOT_FOUND:
+                logger.error("User %s not found", user_id)
+                return None
+            
+            if status == BalanceOperationStatus.INSUFFICIENT_FUNDS:
+                logger.warning("Insufficient T-points for user %s to debit %s", user_id, abs(amount))
+                return None
             
             if created_transaction:
-                logger.info(f"Transaction created: ID {created_transaction.id}, User {user_id}, Amount {amount}, Type {transaction_type}")
+                logger.info("Transaction created: ID %s, User %s, Amount %s, Type %s",
+                            created_transaction.id, user_id, amount, transaction_type)
             
             return created_transaction
             
-        except Exception as e:
+        except IntegrityError as e:
+            logger.error(f"Constraint violation creating transaction for user {user_id} "
+                         f"(duplicate or missing product/activity/order): {e}")
+            return None
+        except SQLAlchemyError as e:
             logger.error(f"Error creating transaction for user {user_id}: {e}")
             return None
 
-    async def get_user_transactions(self, user_id: int, limit: int = 100) -> List[TPointsTransaction]:
+    async def get_user_transactions(self, user_id: int, limit: int = 100, eager: bool = True) -> List[TPointsTransaction]:
         """
         Получить историю транзакций пользователя
         ИСПРАВЛЕНО: работа через репозиторий
         """
         try:
-            transactions = await self.billing_repo.get_user_transactions(user_id, limit)
-            logger.info(f"Retrieved {len(transactions)} transactions for user {user_id}")
+            transactions = await self.billing_repo.get_user_transactions(user_id, limit, eager=eager)
+            logger.info("Retrieved %s transactions for user %s", len(transactions), user_id)
             return transactions
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error retrieving transactions for user {user_id}: {e}")
             return []
 
@@ -97,15 +138,19 @@ class TransactionService(BaseService):
         ИСПРАВЛЕНО: работа через репозиторий
         """
         try:
-            user = await self.billing_repo.get_user_by_id(user_id)
-            if not user:
+            balance = balance_cache.get(user_id)
+            if balance is not None:
+                return balance
+            
+            balance = await self.billing_repo.get_user_balance(user_id)
+            if balance is None:
                 logger.error(f"User {user_id} not found")
                 return 0
             
-            balance = user.tpoints
-            logger.info(f"Balance for user {user_id}: {balance}")
+            balance_cache.set(user_id, balance)
+            logger.info("Balance for user %s: %s", user_id, balance)
             return balance
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error retrieving balance for user {user_id}: {e}")
             return 0
 
@@ -123,77 +168,78 @@ class TransactionService(BaseService):
                 logger.info(f"Retrieved transaction {transaction_id}")
             
             return transaction
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error retrieving transaction {transaction_id}: {e}")
             return None
     
-    async def add_points(self, user_id: int, points: int, description: str, activity_id: Optional[int] = None) -> bool:
+    async def add_points(self, user_id: int, points: int, description: str, activity_id: Optional[int] = None,
+                         user: Optional[User] = None) -> bool:
         """
         Добавить T-Points пользователю с созданием транзакции
         """
         try:
             if points <= 0:
-                logger.error(f"Invalid points amount for adding: {points}")
+                logger.error("Invalid points amount for adding: %s", points)
                 return False
             
-            if not description or description.strip() == "":
-                logger.error(f"Description is required for adding points")
+            desc = description.strip() if description else ""
+            if not desc:
+                logger.error("Description is required for adding points")
                 return False
             
             transaction = await self.create_transaction(
                 user_id=user_id,
                 amount=points,
-                description=description.strip(),
+                description=desc,
                 activity_id=activity_id,
-                transaction_type=TransactionType.TOP_UP
+                transaction_type=TransactionType.TOP_UP,
+                user=user
             )
             
             success = transaction is not None
             if success:
-                logger.info(f"Successfully added {points} points to user {user_id}")
+                logger.info("Successfully added %s points to user %s", points, user_id)
             else:
-                logger.error(f"Failed to add {points} points to user {user_id}")
+                logger.error("Failed to add %s points to user %s", points, user_id)
             
             return success
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error adding points to user {user_id}: {e}")
             return False
     
-    async def remove_points(self, user_id: int, points: int, description: str) -> bool:
+    async def remove_points(self, user_id: int, points: int, description: str,
+                            user: Optional[User] = None) -> bool:
         """
         Списать T-Points у пользователя с созданием транзакции
         """
         try:
             if points <= 0:
-                logger.error(f"Invalid points amount for removal: {points}")
+                logger.error("Invalid points amount for removal: %s", points)
                 return False
             
-            if not description or description.strip() == "":
-                logger.error(f"Description is required for removing points")
-                return False
-            
-            # Дополнительная проверка баланса перед списанием
-            current_balance = await self.get_user_balance(user_id)
-            if current_balance < points:
-                logger.warning(f"Insufficient balance for user {user_id}: {current_balance} < {points}")
+            desc = description.strip() if description else ""
+            if not desc:
+                logger.error("Description is required for removing points")
                 return False
             
+            # Баланс проверяется атомарно внутри create_transaction
             # Создаем транзакцию с отрицательным amount
             transaction = await self.create_transaction(
                 user_id=user_id,
                 amount=-points,  # Отрицательное значение для списания
-                description=description.strip(),
-                transaction_type=TransactionType.DEBIT
+                description=desc,
+                transaction_type=TransactionType.DEBIT,
+                user=user
             )
             
             success = transaction is not None
             if success:
-                logger.info(f"Successfully removed {points} points from user {user_id}")
+                logger.info("Successfully removed %s points from user %s", points, user_id)
             else:
-                logger.error(f"Failed to remove {points} points from user {user_id}")
+                logger.error("Failed to remove %s points from user %s", points, user_id)
             
             return success
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error removing points from user {user_id}: {e}")
             return False
 
@@ -205,112 +251,192 @@ class TransactionService(BaseService):
         """
         result = {"success": 0, "failed": 0, "errors": []}
         
+        # Валидация в Python, запись в БД — одним пакетом
+        entries = []
+        entry_rows = []
         for i, operation in enumerate(operations):
+            user_id = operation.get("user_id")
+            points = operation.get("points")
+            description = str(operation.get("description") or "").strip()
+            op_type = operation.get("operation")
+            
+            if user_id is None or points is None or not description or op_type is None:
+                result["failed"] += 1
+                result["errors"].append(f"Строка {i+1}: Отсутствуют обязательные поля")
+                continue
+            
+            amount = self._parse_points(points)
+            if amount is None:
+                result["failed"] += 1
+                result["errors"].append(f"Строка {i+1}: Количество T-Points должно быть целым числом '{points}'")
+                continue
+            if amount <= 0:
+                result["failed"] += 1
+                result["errors"].append(f"Строка {i+1}: Некорректное количество T-Points '{points}'")
+                continue
+            
+            if op_type == "add":
+                transaction_type = TransactionType.TOP_UP
+            elif op_type == "remove":
+                amount, transaction_type = -amount, TransactionType.DEBIT
+            else:
+                result["failed"] += 1
+                result["errors"].append(f"Строка {i+1}: Неизвестная операция '{op_type}'")
+                continue
+            
+            entries.append({
+                "user_id": user_id,
+                "amount": amount,
+                "description": description,
+                "transaction_type": transaction_type
+            })
+            entry_rows.append(i)
+        
+        if entries:
             try:
-                user_id = operation.get("user_id")
-                points = operation.get("points")
-                description = operation.get("description")
-                op_type = operation.get("operation")
-                
-                if not all([user_id, points, description, op_type]):
-                    result["failed"] += 1
-                    result["errors"].append(f"Строка {i+1}: Отсутствуют обязательные поля")
-                    continue
-                
-                if op_type == "add":
-                    success = await self.add_points(user_id, points, description)
-                elif op_type == "remove":
-                    success = await self.remove_points(user_id, points, description)
-                else:
-                    result["failed"] += 1
-                    result["errors"].append(f"Строка {i+1}: Неизвестная операция '{op_type}'")
-                    continue
-                
+                applied = await self.billing_repo.apply_bulk_points(entries)
+            except SQLAlchemyError as e:
+                logger.error(f"Error applying bulk points operation: {e}")
+                applied = [False] * len(entries)
+            
+            for i, entry, success in zip(entry_rows, entries, applied):
                 if success:
                     result["success"] += 1
                 else:
                     result["failed"] += 1
-                    result["errors"].append(f"Строка {i+1}: Ошибка выполнения операции для пользователя {user_id}")
-                    
-            except Exception as e:
-                result["failed"] += 1
-                result["errors"].append(f"Строка {i+1}: {str(e)}")
+                    result["errors"].append(f"Строка {i+1}: Ошибка выполнения операции для пользователя {entry['user_id']}")
         
         logger.info(f"Bulk operation completed: {result['success']} success, {result['failed']} failed")
         return result 
 
-    async def get_transactions_journal(self, limit: int = 50, user_id: Optional[int] = None) -> List[dict]:
+    @staticmethod
+    def _parse_points(value) -> Optional[int]:
+        """Привести количество T-Points к целому числу; дробные и нечисловые значения - None"""
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, int):
+            return value
+        try:
+            number = Decimal(str(value).strip())
+        except InvalidOperation:
+            return None
+        if not number.is_finite() or number != number.to_integral_value():
+            return None
+        return int(number)
+
+    async def apply_bulk(self, operations: List[dict]) -> List[bool]:
+        """
+        Применить заранее проверенные операции одним пакетом (блокировка, INSERT, UPDATE)
+        operations: [{"user_id": int, "points": int (отрицательное - списание),
+                      "description": str, "activity_id": Optional[int]}]
+        Возвращает флаги успеха в порядке operations
+        """
+        entries = []
+        for operation in operations:
+            points = operation["points"]
+            activity_id = operation.get("activity_id")
+            if points < 0:
+                transaction_type = TransactionType.DEBIT
+            elif activity_id is not None:
+                transaction_type = TransactionType.EARNING
+            else:
+                transaction_type = TransactionType.TOP_UP
+            entries.append({
+                "user_id": operation["user_id"],
+                "amount": points,
+                "description": operation["description"],
+                "transaction_type": transaction_type,
+                "activity_id": activity_id if points > 0 else None
+            })
+        
+        if not entries:
+            return []
+        try:
+            return await self.billing_repo.apply_bulk_points(entries)
+        except SQLAlchemyError as e:
+            logger.error(f"Error applying bulk transactions: {e}")
+            return [False] * len(entries)
+
+    async def iter_transactions_journal(
+        self,
+        limit: int = 50,
+        user_id: Optional[int] = None
+    ) -> AsyncIterator[JournalEntry]:
+        """
+        Потоково получить журнал операций T-Points
+        Строки читаются с сервера порциями, записи отдаются по мере получения
+        """
+        type_names = TransactionType.DISPLAY_NAMES
+        async for transaction, fullname, username in self.billing_repo.stream_recent_transactions(limit, user_id):
+            try:
+                yield self._to_journal_entry(transaction, fullname, username, type_names)
+            except Exception as e:
+                logger.error(f"Error processing transaction {transaction.id} for journal: {e}")
+    
+    async def get_transactions_journal(self, limit: int = 50, user_id: Optional[int] = None) -> List[JournalEntry]:
         """
         Получить журнал операций T-Points
         """
         try:
-            if user_id:
-                transactions = await self.get_user_transactions(user_id, limit)
-            else:
-                # Получаем последние транзакции всех пользователей
-                transactions = await self.billing_repo.get_recent_transactions(limit)
-            
-            journal = []
-            for transaction in transactions:
-                try:
-                    # Получаем данные пользователя
-                    user = await self.billing_repo.get_user_by_id(transaction.user_id)
-                    
-                    journal_entry = {
-                        'id': transaction.id,
-                        'user_id': transaction.user_id,
-                        'user_fullname': user.fullname if user else 'Неизвестный пользователь',
-                        'user_username': user.username if user else None,
-                        'points_amount': transaction.points_amount,
-                        'description': transaction.description,
-                        'created_at': transaction.created_at,
-                        'type': 'начисление' if transaction.points_amount > 0 else 'списание',
-                        'transaction_type': transaction.transaction_type,
-                        'transaction_type_name': TransactionType.get_display_name(transaction.transaction_type),
-                        'order_id': transaction.order_id,
-                        'activity': None,
-                        'product': None
-                    }
-                    
-                    # Добавляем информацию об активности, если есть
-                    if transaction.activity_id and hasattr(transaction, 'activity') and transaction.activity:
-                        journal_entry['activity'] = {
-                            'id': transaction.activity.id,
-                            'name': transaction.activity.name,
-                            'points': transaction.activity.points
-                        }
-                    
-                    # Добавляем информацию о продукте, если есть
-                    if transaction.product_id and hasattr(transaction, 'product') and transaction.product:
-                        journal_entry['product'] = {
-                            'id': transaction.product.id,
-                            'name': transaction.product.name,
-                            'price': transaction.product.price
-                        }
-                    
-                    journal.append(journal_entry)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing transaction {transaction.id} for journal: {e}")
-                    continue
-            
+            journal = [entry async for entry in self.iter_transactions_journal(limit, user_id)]
             logger.info(f"Generated journal with {len(journal)} entries")
             return journal
             
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error generating transactions journal: {e}")
             return []
+    
+    @staticmethod
+    def _to_journal_entry(
+        transaction: TPointsTransaction,
+        user_fullname: Optional[str],
+        user_username: Optional[str],
+        type_names: dict
+    ) -> JournalEntry:
+        """Преобразовать транзакцию в запись журнала"""
+        activity = transaction.activity
+        product = transaction.product
+        return JournalEntry(
+            id=transaction.id,
+            user_id=transaction.user_id,
+            user_fullname=user_fullname or 'Неизвестный пользователь',
+            user_username=user_username,
+            points_amount=transaction.points_amount,
+            description=transaction.description,
+            created_at=transaction.created_at,
+            type='начисление' if transaction.points_amount > 0 else 'списание',
+            transaction_type=transaction.transaction_type,
+            transaction_type_name=type_names.get(transaction.transaction_type, transaction.transaction_type),
+            order_id=transaction.order_id,
+            # Информация об активности и продукте, если есть
+            activity={
+                'id': activity.id,
+                'name': activity.name,
+                'points': activity.points
+            } if activity is not None else None,
+            product={
+                'id': product.id,
+                'name': product.name,
+                'price': product.price
+            } if product is not None else None
+        )
 
     async def get_tpoints_stats(self) -> dict:
         """Получить статистику по T-Points"""
         try:
+            cached = tpoints_stats_cache.get(TPOINTS_STATS_CACHE_KEY)
+            if cached is not None:
+                return dict(cached)
+            
             stats = await self.billing_repo.get_tpoints_stats()
-            return {
+            result = {
                 'total_points': stats.get('total_points', 0),
                 'active_users': stats.get('active_users', 0),
                 'monthly_transactions': stats.get('monthly_transactions', 0)
             }
-        except Exception as e:
+            tpoints_stats_cache.set(TPOINTS_STATS_CACHE_KEY, result)
+            return dict(result)
+        except SQLAlchemyError as e:
             logger.error(f"Error getting T-Points stats: {e}")
             return {
                 'total_points': 0,
@@ -325,7 +451,8 @@ class TransactionService(BaseService):
         user_id: int,
         order_id: int,
         amount: int,
-        description: Optional[str] = None
+        description: Optional[str] = None,
+        user: Optional[User] = None
     ) -> Optional[TPointsTransaction]:
         """
         Создать транзакцию покупки для заказа
@@ -344,9 +471,10 @@ class TransactionService(BaseService):
                 amount=amount,
                 description=description,
                 transaction_type=TransactionType.PURCHASE,
-                order_id=order_id
+                order_id=order_id,
+                user=user
             )
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error creating purchase transaction: {e}")
             return None
     
@@ -355,7 +483,8 @@ class TransactionService(BaseService):
         user_id: int,
         order_id: int,
         amount: int,
-        description: Optional[str] = None
+        description: Optional[str] = None,
+        user: Optional[User] = None
     ) -> Optional[TPointsTransaction]:
         """
         Создать транзакцию возврата за отмененный заказ
@@ -374,9 +503,10 @@ class TransactionService(BaseService):
                 amount=amount,
                 description=description,
                 transaction_type=TransactionType.REFUND,
-                order_id=order_id
+                order_id=order_id,
+                user=user
             )
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error creating refund transaction: {e}")
             return None
     
@@ -385,7 +515,8 @@ class TransactionService(BaseService):
         user_id: int,
         activity_id: int,
         points: int,
-        description: Optional[str] = None
+        description: Optional[str] = None,
+        user: Optional[User] = None
     ) -> Optional[TPointsTransaction]:
         """
         Создать транзакцию за выполнение активности
@@ -396,29 +527,39 @@ class TransactionService(BaseService):
                 return None
             
             if not description:
-                # Получаем название активности
-                activity = await self.billing_repo.get_activity_by_id(activity_id) 
-                activity_name = activity.name if activity else "активность"
-                description = f"Начисление за: {activity_name}"
+                activity_name = await self._activity_name(activity_id)
+                description = f"Начисление за: {activity_name or 'активность'}"
             
             return await self.create_transaction(
                 user_id=user_id,
                 amount=points,
                 description=description,
                 transaction_type=TransactionType.EARNING,
-                activity_id=activity_id
+                activity_id=activity_id,
+                user=user
             )
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error creating activity transaction: {e}")
             return None
     
+    async def _activity_name(self, activity_id: int) -> Optional[str]:
+        """Название активности с кэшированием (при массовых начислениях — один SELECT на активность)"""
+        name = activity_name_cache.get(activity_id)
+        if name is None:
+            activity = await self.billing_repo.get_activity_by_id(activity_id)
+            if activity is None:
+                return None
+            name = activity.name
+            activity_name_cache.set(activity_id, name)
+        return name
+    
     async def get_order_transactions(self, order_id: int) -> List[TPointsTransaction]:
         """
         Получить все транзакции связанные с заказом
         """
         try:
             return await self.billing_repo.get_transactions_by_order(order_id)
-        except Exception as e:
+        except SQLAlchemyError as e:
             logger.error(f"Error getting transactions for order {order_id}: {e}")
             return []
     
@@ -427,24 +568,17 @@ class TransactionService(BaseService):
         Получить сводку транзакций по типам
         """
         try:
-            transactions = await self.billing_repo.get_user_transactions(user_id, 1000) if user_id else await self.billing_repo.get_recent_transactions(1000)
-            
-            summary = {}
-            for transaction in transactions:
-                t_type = transaction.transaction_type
-                type_name = TransactionType.get_display_name(t_type)
-                
-                if type_name not in summary:
-                    summary[type_name] = {
-                        'count': 0,
-                        'total_amount': 0,
-                        'type_code': t_type
-                    }
-                
-                summary[type_name]['count'] += 1
-                summary[type_name]['total_amount'] += transaction.points_amount
-            
-            return summary
-        except Exception as e:
+            rows = await self.billing_repo.get_transaction_type_summary(user_id, 1000)
+            
+            type_names = TransactionType.DISPLAY_NAMES
+            return {
+                type_names.get(t_type, t_type): {
+                    'count': count,
+                    'total_amount': total_amount,
+                    'type_code': t_type
+                }
+                for t_type, count, total_amount in rows
+            }
+        except SQLAlchemyError as e:
             logger.error(f"Error getting transaction summary: {e}")
             return {} 
\ No newline at end of file
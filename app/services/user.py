@@ -1,158 +1,222 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from sqlalchemy.ext.asyncio import AsyncSession
-from ..repositories.user_repository import UserRepository
+from sqlalchemy.exc import SQLAlchemyError
+from ..repositories.user_repository import UserRepository, user_role_cache
 from ..models.models import User
-from ..core.base import BaseService
-from typing import Optional, List
+from ..core.base import BaseService, log_and_default
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Optional, List, Tuple
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Кэш пользователей и ролей на время обработки одного апдейта.
+# Устанавливается DatabaseMiddleware; вне запроса (фильтры, фоновые задачи) равен None
+_request_user_cache: ContextVar[Optional[Dict[Tuple[str, int], Any]]] = ContextVar(
+    '_request_user_cache', default=None
+)
+
+
+def start_request_user_cache() -> Token:
+    """Включить кэш пользователей для текущего апдейта"""
+    return _request_user_cache.set({})
+
+
+def reset_request_user_cache(token: Token) -> None:
+    """Выключить кэш пользователей по завершении апдейта"""
+    _request_user_cache.reset(token)
+
+
+def _remember_user(session: AsyncSession, telegram_id: int, user: Optional[User]) -> None:
+    """Обновить кэш запроса после загрузки или изменения пользователя"""
+    cache = _request_user_cache.get()
+    if cache is None:
+        return
+    cache.pop(('role', telegram_id), None)
+    if user is None:
+        cache.pop(('user', telegram_id), None)
+    else:
+        # Объект User привязан к сессии, поэтому запоминаем его вместе с ней
+        cache[('user', telegram_id)] = (session, user)
+
+
+def _cached_user(session: AsyncSession, telegram_id: int) -> Optional[User]:
+    """Пользователь из кэша запроса, если он загружен в той же сессии"""
+    cache = _request_user_cache.get()
+    if cache is None:
+        return None
+    entry = cache.get(('user', telegram_id))
+    if entry is None or entry[0] is not session:
+        return None
+    return entry[1]
+
+
+# Одновременных отправок при рассылке HR (глобальный лимит Telegram — 30 сообщений/с)
+HR_BROADCAST_CONCURRENCY = 25
+
+# Клавиатура уведомления HR о новом сотруднике (статичная, собирается один раз)
+_HR_NOTIFY_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(
+            text="👥 Управление сотрудниками",
+            callback_data="menu:users"
+        )
+    ],
+    [
+        InlineKeyboardButton(
+            text="⏰ Позже",
+            callback_data="hr_notification_later"
+        )
+    ]
+])
+
+ONBOARDING_MESSAGE_TEMPLATE = (
+    "🎉 <b>Добро пожаловать, {fullname}!</b>\n\n"
+    "Поздравляем с присоединением к нашей команде! 🚀\n\n"
+    "📱 <b>О боте HR Support:</b>\n"
+    "• 🛍 Корпоративный магазин с товарами\n"
+    "• 💎 Система T-Points для покупок\n"
+    "• ❓ Анонимные вопросы и предложения\n"
+    "• 📋 Управление заказами\n\n"
+    "💰 <b>Ваш стартовый баланс:</b> {tpoints:,} T-Points\n\n"
+    "ℹ️ <b>Как зарабатывать T-Points:</b>\n"
+    "• Активное участие в жизни компании\n"
+    "• Выполнение специальных активностей\n"
+    "• Достижения и успехи в работе\n\n"
+    "📝 Дополнительные данные (дата рождения, отдел) можно будет заполнить через HR.\n\n"
+    "🏠 Нажмите кнопку ниже, чтобы перейти в главное меню:"
+)
+
+WELCOME_MESSAGE_TEMPLATE = (
+    "👋 Привет, {first_name}!\n\n"
+    "💎 Ваш баланс: {tpoints:,} T-Points\n\n"
+    "Выберите действие:"
+)
+
 class UserService(BaseService):
     """Сервис для работы с пользователями"""
     
     def __init__(self, session: AsyncSession):
         super().__init__(session)
         self.repository = UserRepository(session)
+        # Роли со своими запросами в репозитории; остальные — через get_users_by_role
+        self._role_dispatch = {
+            "admin": self.repository.get_all_admins,
+            "hr": self.repository.get_all_hr_users,
+        }
         
+    @log_and_default(None, "Error getting user {telegram_id}")
     async def get_user(self, telegram_id: int) -> Optional[User]:
         """Получить пользователя по Telegram ID"""
-        try:
-            return await self.repository.get_user_by_telegram_id(telegram_id)
-        except Exception as e:
-            logger.error(f"Error getting user {telegram_id}: {e}")
-            return None
+        user = _cached_user(self.session, telegram_id)
+        if user is not None:
+            return user
+        
+        user = await self.repository.get_user_by_telegram_id(telegram_id)
+        if user is not None:
+            _remember_user(self.session, telegram_id, user)
+        return user
             
     async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[User]:
         """Получить пользователя по Telegram ID (алиас для совместимости)"""
         return await self.get_user(telegram_id)
             
+    @log_and_default(None, "Error getting or creating user {telegram_id}")
     async def get_or_create_user(self, telegram_id: int, username: Optional[str], fullname: str, is_active: bool = True) -> Optional[User]:
         """Получить или создать пользователя"""
-        try:
-            return await self.repository.get_or_create_user(telegram_id, username, fullname, is_active)
-        except Exception as e:
-            logger.error(f"Error getting or creating user {telegram_id}: {e}")
-            return None
-            
+        user = await self.repository.get_or_create_user(telegram_id, username, fullname, is_active)
+        _remember_user(self.session, telegram_id, user)
+        return user
+    
+    @log_and_default("user", "Error getting user role for {telegram_id}")
     async def get_user_role(self, telegram_id: int) -> str:
         """Получить роль пользователя"""
-        try:
-            user = await self.repository.get_user_by_telegram_id(telegram_id)
-            if user:
-                return user.role
-            return "user"  # Роль по умолчанию
-        except Exception as e:
-            logger.error(f"Error getting user role for {telegram_id}: {e}")
-            return "user"
+        user = _cached_user(self.session, telegram_id)
+        if user is not None:
+            return user.role
+        
+        cache = _request_user_cache.get()
+        if cache is not None:
+            role = cache.get(('role', telegram_id))
+            if role is not None:
+                return role
+        
+        role = await user_role_cache.get_or_load(
+            telegram_id, lambda: self.repository.get_user_role(telegram_id)
+        )
+        role = role or "user"  # Роль по умолчанию
+        if cache is not None:
+            cache[('role', telegram_id)] = role
+        return role
             
+    @log_and_default(False, "Error updating T-Points for user {telegram_id}")
     async def update_tpoints(self, telegram_id: int, points: int) -> bool:
         """Обновить количество T-Points у пользователя"""
-        try:
-            return await self.repository.update_tpoints(telegram_id, points)
-        except Exception as e:
-            logger.error(f"Error updating T-Points for user {telegram_id}: {e}")
-            return False
+        return await self.repository.update_tpoints(telegram_id, points)
             
+    @log_and_default(False, "Error adding T-Points for user {telegram_id}")
     async def add_tpoints(self, telegram_id: int, points: int) -> bool:
         """Добавить T-Points пользователю"""
-        try:
-            return await self.repository.add_tpoints(telegram_id, points)
-        except Exception as e:
-            logger.error(f"Error adding T-Points for user {telegram_id}: {e}")
-            return False
+        return await self.repository.add_tpoints(telegram_id, points)
             
+    @log_and_default(False, "Error removing T-Points for user {telegram_id}")
     async def remove_tpoints(self, telegram_id: int, points: int) -> bool:
         """Удалить T-Points у пользователя"""
-        try:
-            return await self.repository.remove_tpoints(telegram_id, points)
-        except Exception as e:
-            logger.error(f"Error removing T-Points for user {telegram_id}: {e}")
-            return False
+        return await self.repository.remove_tpoints(telegram_id, points)
             
+    @log_and_default(list, "Error getting all users")
     async def get_all_users(self) -> List[User]:
         """Получить всех пользователей"""
-        try:
-            return await self.repository.get_all_users()
-        except Exception as e:
-            logger.error(f"Error getting all users: {e}")
-            return []
+        return await self.repository.get_all_users()
             
+    @log_and_default(list, "Error getting active users")
     async def get_all_active_users(self) -> List[User]:
         """Получить всех активных пользователей"""
-        try:
-            return await self.repository.get_all_active_users()
-        except Exception as e:
-            logger.error(f"Error getting active users: {e}")
-            return []
+        return await self.repository.get_all_active_users()
             
+    @log_and_default(list, "Error getting HR users")
     async def get_all_hr_users(self) -> List[User]:
         """Получить всех HR-пользователей"""
-        try:
-            return await self.repository.get_all_hr_users()
-        except Exception as e:
-            logger.error(f"Error getting HR users: {e}")
-            return []
+        return await self.repository.get_all_hr_users()
     
+    @log_and_default(list, "Error getting HR and admin users")
     async def get_all_hr_and_admin_users(self) -> List[User]:
         """Получить всех HR и админов для работы с заказами"""
-        try:
-            return await self.repository.get_all_hr_and_admin_users()
-        except Exception as e:
-            logger.error(f"Error getting HR and admin users: {e}")
-            return []
+        return await self.repository.get_all_hr_and_admin_users()
             
+    @log_and_default(list, "Error getting admin users")
     async def get_all_admins(self) -> List[User]:
         """Получить всех администраторов"""
-        try:
-            return await self.repository.get_all_admins()
-        except Exception as e:
-            logger.error(f"Error getting admin users: {e}")
-            return []
+        return await self.repository.get_all_admins()
     
+    @log_and_default(list, "Error getting users by role {role}")
     async def get_users_by_role(self, role: str) -> List[User]:
         """Получить пользователей по роли"""
-        try:
-            if role == "admin":
-                return await self.repository.get_all_admins()
-            elif role == "hr":
-                return await self.repository.get_all_hr_users()
-            elif role == "user":
-                # Получаем всех пользователей с ролью "user"
-                return await self.repository.get_users_by_role("user")
-            else:
-                return await self.repository.get_users_by_role(role)
-        except Exception as e:
-            logger.error(f"Error getting users by role {role}: {e}")
-            return []
+        fetch = self._role_dispatch.get(role)
+        return await (fetch() if fetch else self.repository.get_users_by_role(role))
     
+    @log_and_default(list, "Error getting blocked users")
     async def get_blocked_users(self) -> List[User]:
         """Получить заблокированных пользователей"""
-        try:
-            return await self.repository.get_blocked_users()
-        except Exception as e:
-            logger.error(f"Error getting blocked users: {e}")
-            return []
+        return await self.repository.get_blocked_users()
 
+    @log_and_default(False, "Error checking onboarding for user {telegram_id}")
     async def needs_onboarding(self, telegram_id: int) -> bool:
         """Проверить, нужен ли онбординг пользователю"""
-        try:
-            user = await self.repository.get_user_by_telegram_id(telegram_id)
-            if not user:
-                return False
-            
-            # Проверяем, заполнены ли обязательные поля
-            return not user.birth_date or not user.hire_date
-            
-        except Exception as e:
-            logger.error(f"Error checking onboarding for user {telegram_id}: {e}")
+        user = await self.get_user(telegram_id)
+        if not user:
             return False
+        
+        # Проверяем, заполнены ли обязательные поля
+        return not user.birth_date or not user.hire_date
 
     async def notify_hr_about_new_employee(self, bot, new_user) -> bool:
         """Уведомление HR о новом сотруднике"""
         try:
-            hr_users = await self.repository.get_all_hr_and_admin_users()
+            hr_telegram_ids = await self.repository.get_hr_and_admin_telegram_ids()
             
-            if not hr_users:
+            if not hr_telegram_ids:
                 logger.warning("No HR users found to notify about new employee")
                 return False
             
@@ -178,148 +242,100 @@ class UserService(BaseService):
                 f"Используйте кнопки ниже для управления сотрудником."
             )
             
-            # Импортируем клавиатуру для уведомлений HR
-            from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-            
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="👥 Управление сотрудниками",
-                        callback_data="menu:users"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text="⏰ Позже",
-                        callback_data="hr_notification_later"
-                    )
-                ]
-            ])
+            # Отправляем уведомление всем HR параллельно, ограничивая число одновременных запросов
+            semaphore = asyncio.Semaphore(HR_BROADCAST_CONCURRENCY)
             
-            # Отправляем уведомление всем HR
-            success_count = 0
-            for hr_user in hr_users:
-                try:
-                    await bot.send_message(
-                        chat_id=hr_user.telegram_id,
-                        text=notification_text,
-                        reply_markup=keyboard
-                    )
-                    success_count += 1
-                    logger.info(f"Sent new employee notification to HR {hr_user.telegram_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send notification to HR {hr_user.telegram_id}: {e}")
+            async def _send(hr_telegram_id: int) -> bool:
+                async with semaphore:
+                    try:
+                        await bot.send_message(
+                            chat_id=hr_telegram_id,
+                            text=notification_text,
+                            reply_markup=_HR_NOTIFY_KEYBOARD
+                        )
+                        logger.info("Sent new employee notification to HR %s", hr_telegram_id)
+                        return True
+                    except Exception as e:
+                        logger.error("Failed to send notification to HR %s: %s", hr_telegram_id, e)
+                        return False
             
-            return success_count > 0
+            results = await asyncio.gather(*(_send(hr_telegram_id) for hr_telegram_id in hr_telegram_ids))
+            return sum(results) > 0
             
-        except Exception as e:
-            logger.error(f"Error notifying HR about new employee: {e}")
+        except SQLAlchemyError as e:
+            logger.error("Error notifying HR about new employee: %s", e)
             return False
 
-    async def get_onboarding_message(self, user) -> str:
+    def get_onboarding_message(self, user) -> str:
         """Генерация приветственного сообщения для нового сотрудника"""
-        return (
-            f"🎉 <b>Добро пожаловать, {user.fullname}!</b>\n\n"
-            f"Поздравляем с присоединением к нашей команде! 🚀\n\n"
-            f"📱 <b>О боте HR Support:</b>\n"
-            f"• 🛍 Корпоративный магазин с товарами\n"
-            f"• 💎 Система T-Points для покупок\n"
-            f"• ❓ Анонимные вопросы и предложения\n"
-            f"• 📋 Управление заказами\n\n"
-            f"💰 <b>Ваш стартовый баланс:</b> {user.tpoints:,} T-Points\n\n"
-            f"ℹ️ <b>Как зарабатывать T-Points:</b>\n"
-            f"• Активное участие в жизни компании\n"
-            f"• Выполнение специальных активностей\n"
-            f"• Достижения и успехи в работе\n\n"
-            f"📝 Дополнительные данные (дата рождения, отдел) можно будет заполнить через HR.\n\n"
-            f"🏠 Нажмите кнопку ниже, чтобы перейти в главное меню:"
-        )
+        return ONBOARDING_MESSAGE_TEMPLATE.format(fullname=user.fullname, tpoints=user.tpoints)
 
-    async def get_welcome_message(self, user) -> str:
+    def get_welcome_message(self, user) -> str:
         """Генерация приветственного сообщения для существующего пользователя"""
         # Извлекаем имя из ФИО
-        parts = user.fullname.strip().split()
+        # Нужны только первые два слова — остаток ФИО не разбиваем
+        parts = user.fullname.split(None, 2)
         first_name = parts[1] if len(parts) >= 2 else parts[0] if parts else user.fullname
         
-        return (
-            f"👋 Привет, {first_name}!\n\n"
-            f"💎 Ваш баланс: {user.tpoints:,} T-Points\n\n"
-            f"Выберите действие:"
-        )
+        return WELCOME_MESSAGE_TEMPLATE.format(first_name=first_name, tpoints=user.tpoints)
 
+    @log_and_default(
+        lambda: {'total_users': 0, 'active_users': 0, 'departments_count': 0},
+        "Error getting users stats"
+    )
     async def get_users_stats(self) -> dict:
         """Получить статистику по пользователям"""
-        try:
-            stats = await self.repository.get_users_stats()
-            return {
-                'total_users': stats.get('total_users', 0),
-                'active_users': stats.get('active_users', 0),
-                'departments_count': stats.get('departments_count', 0)
-            }
-        except Exception as e:
-            logger.error(f"Error getting users stats: {e}")
-            return {
-                'total_users': 0,
-                'active_users': 0,
-                'departments_count': 0
-            }
+        stats = await self.repository.get_users_stats()
+        return {
+            'total_users': stats.get('total_users', 0),
+            'active_users': stats.get('active_users', 0),
+            'departments_count': stats.get('departments_count', 0)
+        }
     
+    @log_and_default(None, "Error setting role for user {telegram_id}")
     async def set_role(self, telegram_id: int, role: str) -> Optional[User]:
         """Установить роль пользователя"""
-        try:
-            success = await self.repository.update_user_data(telegram_id, {'role': role})
-            if success:
-                return await self.repository.get_user_by_telegram_id(telegram_id)
-            return None
-        except Exception as e:
-            logger.error(f"Error setting role for user {telegram_id}: {e}")
-            return None
+        user = await self.repository.update_user_data_returning(telegram_id, {'role': role})
+        _remember_user(self.session, telegram_id, user)
+        return user
     
+    @log_and_default(None, "Error activating user {telegram_id}")
     async def activate_user(self, telegram_id: int) -> Optional[User]:
         """Активировать пользователя"""
-        try:
-            success = await self.repository.update_user_data(telegram_id, {'is_active': True})
-            if success:
-                return await self.repository.get_user_by_telegram_id(telegram_id)
-            return None
-        except Exception as e:
-            logger.error(f"Error activating user {telegram_id}: {e}")
-            return None
+        user = await self.repository.update_user_data_returning(telegram_id, {'is_active': True})
+        _remember_user(self.session, telegram_id, user)
+        return user
     
+    @log_and_default(None, "Error deactivating user {telegram_id}")
     async def deactivate_user(self, telegram_id: int, remove_from_group: bool = False, 
                              bot=None, group_management_service=None) -> Optional[User]:
         """Деактивировать пользователя и опционально удалить из группы"""
-        try:
-            success = await self.repository.update_user_data(telegram_id, {'is_active': False})
-            if success:
-                user = await self.repository.get_user_by_telegram_id(telegram_id)
-                
-                # Автоматическое удаление из группы если переданы нужные сервисы
-                if remove_from_group and bot and group_management_service:
-                    try:
-                        removal_success = await group_management_service.remove_user_from_group(
+        user = await self.repository.update_user_data_returning(telegram_id, {'is_active': False})
+        _remember_user(self.session, telegram_id, user)
+        if user:
+            # Автоматическое удаление из группы если переданы нужные сервисы
+            if remove_from_group and bot and group_management_service:
+                try:
+                    removal_success = await group_management_service.remove_user_from_group(
+                        bot=bot,
+                        user_id=telegram_id,
+                        reason=f"Деактивация пользователя {user.fullname}"
+                    )
+                    
+                    if removal_success:
+                        logger.warning("🚨 USER REMOVED FROM GROUP: %s (ID: %s)", user.fullname, telegram_id)
+                        
+                        # Уведомляем пользователя
+                        await group_management_service.notify_user_about_removal(
                             bot=bot,
                             user_id=telegram_id,
-                            reason=f"Деактивация пользователя {user.fullname}"
+                            reason="деактивации аккаунта"
                         )
+                    else:
+                        logger.error("Failed to remove deactivated user %s from group", telegram_id)
                         
-                        if removal_success:
-                            logger.warning(f"🚨 USER REMOVED FROM GROUP: {user.fullname} (ID: {telegram_id})")
-                            
-                            # Уведомляем пользователя
-                            await group_management_service.notify_user_about_removal(
-                                bot=bot,
-                                user_id=telegram_id,
-                                reason="деактивации аккаунта"
-                            )
-                        else:
-                            logger.error(f"Failed to remove deactivated user {telegram_id} from group")
-                            
-                    except Exception as group_error:
-                        logger.error(f"Error removing user {telegram_id} from group: {group_error}")
-                
-                return user
-            return None
-        except Exception as e:
-            logger.error(f"Error deactivating user {telegram_id}: {e}")
-            return None
\ No newline at end of file
+                except Exception as group_error:
+                    logger.error("Error removing user %s from group: %s", telegram_id, group_error)
+            
+            return user
+        return None
@@ -1,18 +1,181 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..repositories.user_repository import UserRepository
 from ..services.transaction_service import TransactionService
-from ..models.models import User, TPointsActivity
+from ..models.models import TPointsActivity
 from ..core.base import BaseService
-from typing import List, Dict, Any, Optional
+from ..utils.xlsx_export import XlsxExport
+from ..utils.ttl_cache import TTLCache
+from .tpoints_activity_service import activities_version
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+from datetime import date
+import numpy as np
 import pandas as pd
-import openpyxl
-from openpyxl.styles import PatternFill
+from python_calamine import CalamineWorkbook
 from io import BytesIO
+from collections import defaultdict
+from itertools import groupby
+import asyncio
+import hashlib
 import logging
-from datetime import datetime, date
+import os
+import re
+import tempfile
 
 logger = logging.getLogger(__name__)
 
+# Колонки листов экспорта (записываются потоково через xlsxwriter)
+USERS_SHEET_COLUMNS = (
+    'telegram_id', 'username', 'fullname', 'birth_date',
+    'hire_date', 'department', 'is_active', 'tpoints'
+)
+TPOINTS_SHEET_COLUMNS = (
+    'telegram_id', 'username', 'fullname', 'current_tpoints',
+    'activity_name', 'points_to_add', 'reason'
+)
+INSTRUCTIONS_COLUMNS = ('Описание', 'Детали')
+# Позиции в строках UserRepository.get_user_rows_for_export (порядок USERS_SHEET_COLUMNS)
+EXPORT_DEPARTMENT = USERS_SHEET_COLUMNS.index('department')
+EXPORT_IS_ACTIVE = USERS_SHEET_COLUMNS.index('is_active')
+
+# Статичные листы: данные собираются один раз при импорте модуля
+# Лист инструкции к выгрузке пользователей
+USERS_INSTRUCTIONS_ROWS = (
+    ('📋 ИНСТРУКЦИЯ ПО РАБОТЕ С ДАННЫМИ ПОЛЬЗОВАТЕЛЕЙ', ''),
+    ('', ''),
+    ('🔴 ВАЖНО: НЕ ИЗМЕНЯЙТЕ telegram_id!', 'Это основной ключ'),
+    ('', ''),
+    ('✅ Что можно изменять:', ''),
+    ('- fullname', 'Полное имя'),
+    ('- birth_date', 'Дата рождения (YYYY-MM-DD)'),
+    ('- hire_date', 'Дата трудоустройства'),
+    ('- department', 'Отдел'),
+    ('- is_active', 'Активность (TRUE/FALSE)'),
+    ('', ''),
+    ('🔴 Обязательные поля (красные если пустые):', ''),
+    ('- fullname', 'Обязательно'),
+    ('', ''),
+    ('⚠️ Рекомендуемые поля (предупреждение если пустые):', ''),
+    ('- birth_date', 'Рекомендуется для ДР уведомлений'),
+    ('', ''),
+    ('🚨 ВАЖНО про деактивацию (is_active = FALSE):', ''),
+    ('- Пользователь будет АВТОМАТИЧЕСКИ удалён из группы', 'Без уведомления HR!'),
+    ('- Пользователь получит уведомление об удалении', 'Автоматически'),
+    ('- Данные сохранятся в БД', 'Видно в вкладке "❌ Неактивные"'),
+    ('- Можно реактивировать позже', 'is_active = TRUE, но нужно заново пригласить в группу'),
+    ('', ''),
+    ('⚠️ НЕ изменяйте:', ''),
+    ('- telegram_id', 'НЕ ТРОГАТЬ!'),
+    ('- username', 'Из Telegram'),
+    ('- tpoints', 'Используйте отдельный файл')
+)
+
+# Лист инструкции к шаблону T-Points
+TPOINTS_INSTRUCTIONS_ROWS = (
+    ('💰 ИНСТРУКЦИЯ ПО НАЧИСЛЕНИЮ T-POINTS', ''),
+    ('', ''),
+    ('🔴 НЕ ИЗМЕНЯЙТЕ telegram_id, username, fullname!', ''),
+    ('', ''),
+    ('📋 Порядок заполнения:', ''),
+    ('1. Посмотрите лист "🎯 АКТИВНОСТИ"', 'Список доступных активностей'),
+    ('2. Заполните одним из способов:', ''),
+    ('', ''),
+    ('🎯 СПОСОБ 1 - Через активность:', ''),
+    ('- activity_name', 'Точное название из листа АКТИВНОСТИ'),
+    ('- points_to_add', 'Автоматически (можно изменить)'),
+    ('- reason', 'Автоматически (можно изменить)'),
+    ('', ''),
+    ('✏️ СПОСОБ 2 - Ручное заполнение:', ''),
+    ('- activity_name', 'Оставить пустым'),
+    ('- points_to_add', '+ для начисления, - для списания'),
+    ('- reason', 'Причина операции (обязательно)'),
+    ('', ''),
+    ('📝 Примеры:', ''),
+    ('Хакатон + 100 + "За 1 место"', 'Активность + изменение'),
+    ('пусто + 50 + "Бонус к ЗП"', 'Ручное начисление'),
+    ('пусто + -25 + "Штраф"', 'Ручное списание'),
+    ('пусто + 0 или пусто', 'Пропустить пользователя'),
+    ('', ''),
+    ('⚠️ Правила:', ''),
+    ('- Названия активностей точно как в листе', ''),
+    ('- Обязательно указывайте reason', ''),
+    ('- Пользователи получат уведомления', ''),
+    ('- Отрицательные значения для списания', '')
+)
+
+# Примеры заполнения шаблона T-Points (в порядке TPOINTS_SHEET_COLUMNS)
+TPOINTS_EXAMPLE_ROWS = (
+    (123456789, 'john_doe', 'Иванов Иван Иванович', 150, 'Хакатон', 100, 'За 1 место в хакатоне'),
+    (987654321, 'jane_smith', 'Петрова Анна Сергеевна', 75, 'Тимбилдинг', 25, 'Участие в командном квесте'),
+    (555666777, 'mike_brown', 'Сидоров Михаил Петрович', 200, '', 50, 'Бонус к зарплате за месяц'),
+    (888999000, 'anna_white', 'Кузнецова Анна Александровна', 120, '', -30, 'Штраф за нарушение дресс-кода')
+)
+
+# Журнал T-Points операций
+JOURNAL_SHEET_COLUMNS = (
+    'ID', 'Дата', 'Telegram ID', 'Username', 'ФИО', 'Отдел',
+    'Сумма T-Points', 'Тип', 'Описание', 'Активность', 'Продукт'
+)
+JOURNAL_SUMMARY_COLUMNS = ('Отдел', 'Операций', 'Начислено T-Points', 'Списано T-Points', 'Баланс отдела')
+
+# Лист инструкции к журналу T-Points операций
+JOURNAL_INSTRUCTIONS_ROWS = (
+    ('📊 ЖУРНАЛ T-POINTS ОПЕРАЦИЙ', ''),
+    ('', ''),
+    ('📋 Описание листов:', ''),
+    ('• 📊 СВОДКА', 'Статистика по отделам'),
+    ('• [Отдел] - Операции', 'Детальные операции отдела'),
+    ('• Без отдела - Операции', 'Операции пользователей без отдела'),
+    ('', ''),
+    ('📊 Поля в детальных листах:', ''),
+    ('• ID', 'Уникальный номер операции'),
+    ('• Дата', 'Дата и время операции'),
+    ('• Telegram ID', 'ID пользователя в Telegram'),
+    ('• Username', 'Имя пользователя в Telegram'),
+    ('• ФИО', 'Полное имя сотрудника'),
+    ('• Отдел', 'Отдел сотрудника'),
+    ('• Сумма T-Points', 'Количество T-Points (+/-)'),
+    ('• Тип', 'Начисление или Списание'),
+    ('• Описание', 'Причина операции'),
+    ('• Активность', 'Связанная активность (если есть)'),
+    ('• Продукт', 'Связанный продукт (если есть)'),
+    ('', ''),
+    ('💡 Полезные функции Excel:', ''),
+    ('• Фильтры', 'Настройте фильтры по датам/типам'),
+    ('• Сортировка', 'Сортируйте по любому полю'),
+    ('• Поиск', 'Ctrl+F для поиска'),
+    ('• Сводные таблицы', 'Создайте свою аналитику')
+)
+
+# Справочник активностей в шаблоне T-Points
+ACTIVITIES_SHEET_COLUMNS = ('Название активности', 'T-Points', 'Описание', 'Статус')
+# Примеры, если в базе еще нет активностей
+ACTIVITY_EXAMPLE_ROWS = (
+    ('Участие в корпоративе', 50, 'За участие в корпоративном мероприятии', 'Пример'),
+    ('Хакатон', 100, 'За участие в хакатоне', 'Пример'),
+    ('Обучение', 30, 'За прохождение обучающего курса', 'Пример'),
+    ('Тимбилдинг', 25, 'За участие в командных активностях', 'Пример'),
+    ('Спорт', 20, 'За участие в спортивных мероприятиях', 'Пример')
+)
+
+# Служебные листы загружаемых файлов, которые не содержат данных
+_TPOINTS_SKIP_SHEETS_RE = re.compile('ИНСТРУКЦИЯ|ПРИМЕРЫ|АКТИВНОСТИ')
+_USERS_SKIP_SHEETS_RE = re.compile(re.escape('📋 ИНСТРУКЦИЯ'))
+
+# Разобранные файлы T-Points между предпросмотром и подтверждением (столько же живет сам файл).
+# Ключ - (sha256 содержимого, версия списка активностей), значение - (строки, ошибки разбора);
+# хранятся только неизменяемые данные, пользователи и балансы проверяются заново
+_parsed_tpoints_files = TTLCache(ttl_seconds=30 * 60, maxsize=32)
+
+# Одновременных отправок уведомлений об изменении T-Points (лимит Telegram — ~30 сообщений/с)
+TPOINTS_NOTIFY_CONCURRENCY = 30
+# Одновременных удалений из группы при деактивации (каждое - до 3 запросов к Bot API)
+GROUP_REMOVAL_CONCURRENCY = 10
+
+def _is_missing(value: Any) -> bool:
+    """Пустое скалярное значение (None или NaN) без диспетчеризации pd.isna"""
+    return value is None or value != value
+
+
 class UserManagerService(BaseService):
     """
     Сервис для управления пользователями через Excel
@@ -20,280 +183,138 @@ class UserManagerService(BaseService):
     - Начисление/списание T-Points через Excel
     """
     
-    def __init__(self, session: AsyncSession, group_management_service=None, bot=None):
+    def __init__(self, session: AsyncSession, group_management_service=None, bot=None,
+                 tpoints_activity_service=None):
         super().__init__(session)
         self.user_repo = UserRepository(session)
         self.transaction_service = TransactionService(session)
         self.group_management_service = group_management_service
         self.bot = bot
+        self.tpoints_activity_service = tpoints_activity_service
+        # Справочник активностей, загруженный при разборе файла T-Points
+        self._activity_index: Dict[str, TPointsActivity] = {}
     
     async def export_users_to_excel(self) -> BytesIO:
         """Экспорт пользователей в Excel с разделением по отделам"""
         try:
-            users = await self.user_repo.get_all_users()
+            # Пользователи приходят уже упорядоченными по листам: отделы, без отдела, неактивные
+            users = await self.user_repo.get_user_rows_for_export()
             logger.info(f"Exporting {len(users)} users to Excel")
             
-            # Группируем по отделам и статусу
-            departments = {}
-            users_without_department = []
-            inactive_users = []
-            
-            for user in users:
-                if not user.is_active:
-                    inactive_users.append(user)
-                elif user.department and user.department.strip():
-                    dept_name = user.department.strip()
-                    if dept_name not in departments:
-                        departments[dept_name] = []
-                    departments[dept_name].append(user)
-                else:
-                    users_without_department.append(user)
-            
-            # Создаем Excel
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                
-                # Листы для отделов
-                for dept_name, dept_users in departments.items():
-                    self._create_users_sheet(writer, dept_users, dept_name)
-                
-                # Лист для пользователей без отдела
-                if users_without_department:
-                    self._create_users_sheet(writer, users_without_department, "Сотрудники без отдела")
-                
-                # Лист для неактивных пользователей
-                if inactive_users:
-                    self._create_users_sheet(writer, inactive_users, "❌ Неактивные")
-                
-                # Инструкции
-                self._create_users_instructions_sheet(writer)
-                
-                # Форматирование
-                self._format_users_sheets(writer)
-            
-            output.seek(0)
-            return output
+            # Сборка XLSX нагружает CPU - выполняем вне event loop
+            return await asyncio.to_thread(self._build_users_xlsx, users)
             
         except Exception as e:
             logger.error(f"Error exporting users: {e}")
             raise
     
-    def _create_users_sheet(self, writer, users: List[User], sheet_name: str):
-        """Создает лист с пользователями"""
-        data = []
-        for user in users:
-            data.append({
-                'telegram_id': user.telegram_id,
-                'username': user.username or '',
-                'fullname': user.fullname,
-                'birth_date': user.birth_date.strftime('%Y-%m-%d') if user.birth_date else '',
-                'hire_date': user.hire_date.strftime('%Y-%m-%d') if user.hire_date else '',
-                'department': user.department or '',
-                'is_active': user.is_active,
-                'tpoints': user.tpoints
-            })
-        
-        df = pd.DataFrame(data)
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    def _build_users_xlsx(self, users: List[tuple]) -> BytesIO:
+        """Синхронная сборка выгрузки пользователей (выполняется в отдельном потоке)"""
+        book = XlsxExport()
+        
+        for group, group_users in groupby(users, key=self._export_group):
+            if group is None:
+                # Лист для неактивных пользователей (без подсветки незаполненных полей)
+                self._create_users_sheet(book, group_users, "❌ Неактивные", highlight=False)
+            else:
+                self._create_users_sheet(book, group_users, group or "Сотрудники без отдела")
+        
+        # Инструкции
+        self._create_users_instructions_sheet(book)
+        
+        return book.close()
+    
+    @staticmethod
+    def _export_group(user: tuple) -> Optional[str]:
+        """Лист выгрузки для строки пользователя: отдел ('' - без отдела), None - неактивные"""
+        if not user[EXPORT_IS_ACTIVE]:
+            return None
+        return (user[EXPORT_DEPARTMENT] or '').strip()
     
-    def _create_users_instructions_sheet(self, writer):
-        """Инструкции по работе с пользователями"""
-        instructions = [
-            ['📋 ИНСТРУКЦИЯ ПО РАБОТЕ С ДАННЫМИ ПОЛЬЗОВАТЕЛЕЙ', ''],
-            ['', ''],
-            ['🔴 ВАЖНО: НЕ ИЗМЕНЯЙТЕ telegram_id!', 'Это основной ключ'],
-            ['', ''],
-            ['✅ Что можно изменять:', ''],
-            ['- fullname', 'Полное имя'],
-            ['- birth_date', 'Дата рождения (YYYY-MM-DD)'],
-            ['- hire_date', 'Дата трудоустройства'],
-            ['- department', 'Отдел'],
-            ['- is_active', 'Активность (TRUE/FALSE)'],
-            ['', ''],
-            ['🔴 Обязательные поля (красные если пустые):', ''],
-            ['- fullname', 'Обязательно'],
-            ['', ''],
-            ['⚠️ Рекомендуемые поля (предупреждение если пустые):', ''],
-            ['- birth_date', 'Рекомендуется для ДР уведомлений'],
-            ['', ''],
-            ['🚨 ВАЖНО про деактивацию (is_active = FALSE):', ''],
-            ['- Пользователь будет АВТОМАТИЧЕСКИ удалён из группы', 'Без уведомления HR!'],
-            ['- Пользователь получит уведомление об удалении', 'Автоматически'],
-            ['- Данные сохранятся в БД', 'Видно в вкладке "❌ Неактивные"'],
-            ['- Можно реактивировать позже', 'is_active = TRUE, но нужно заново пригласить в группу'],
-            ['', ''],
-            ['⚠️ НЕ изменяйте:', ''],
-            ['- telegram_id', 'НЕ ТРОГАТЬ!'],
-            ['- username', 'Из Telegram'],
-            ['- tpoints', 'Используйте отдельный файл'],
-        ]
+    def _create_users_sheet(self, book: XlsxExport, users: Iterable[tuple], sheet_name: str,
+                            highlight: bool = True):
+        """
+        Создает лист с пользователями
+        highlight: красная заливка пустого fullname (обязательное поле),
+        желтая - пустой birth_date (рекомендуемое). Стиль задается при записи строки
+        """
+        worksheet = book.add_sheet(sheet_name, USERS_SHEET_COLUMNS)
         
-        df = pd.DataFrame(instructions, columns=['Описание', 'Детали'])
-        df.to_excel(writer, index=False, sheet_name='📋 ИНСТРУКЦИЯ')
+        for row_index, (telegram_id, username, fullname, birth_date, hire_date,
+                        department, is_active, tpoints) in enumerate(users, start=1):
+            birth_date = birth_date.isoformat() if birth_date else ''
+            worksheet.write_row(row_index, 0, (
+                telegram_id,
+                username or '',
+                fullname,
+                birth_date,
+                hire_date.isoformat() if hire_date else '',
+                department or '',
+                is_active,
+                tpoints
+            ))
+            
+            # Пустая ячейка без формата не записывается, с заливкой - записывается
+            if highlight and not fullname:
+                worksheet.write_blank(row_index, 2, None, book.missing_required_format)
+            if highlight and not birth_date:
+                worksheet.write_blank(row_index, 3, None, book.missing_optional_format)
     
-    def _format_users_sheets(self, writer):
-        """Красное выделение обязательных полей, желтое - рекомендуемых"""
-        red_fill = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
-        yellow_fill = PatternFill(start_color="FFFFCC", end_color="FFFFCC", fill_type="solid")
-        
-        for sheet_name, worksheet in writer.sheets.items():
-            if '📋 ИНСТРУКЦИЯ' not in sheet_name and '❌ Неактивные' not in sheet_name:
-                for row in range(2, worksheet.max_row + 1):
-                    # fullname (колонка C) - обязательное поле
-                    if not worksheet[f'C{row}'].value:
-                        worksheet[f'C{row}'].fill = red_fill
-                    
-                    # birth_date (колонка D) - рекомендуемое поле
-                    if not worksheet[f'D{row}'].value:
-                        worksheet[f'D{row}'].fill = yellow_fill
+    def _create_users_instructions_sheet(self, book: XlsxExport):
+        """Инструкции по работе с пользователями"""
+        book.add_table('📋 ИНСТРУКЦИЯ', INSTRUCTIONS_COLUMNS, USERS_INSTRUCTIONS_ROWS)
     
     async def export_tpoints_template_to_excel(self) -> BytesIO:
         """Экспорт шаблона для начисления T-Points по отделам"""
         try:
-            users = await self.user_repo.get_all_active_users()
+            # Активные пользователи, упорядоченные по отделам (без отдела - в конце)
+            users = await self.user_repo.get_user_rows_for_export(active_only=True)
             logger.info(f"Creating T-Points template for {len(users)} users")
             
-            # Группируем по отделам
-            departments = {}
-            users_without_department = []
-            
-            for user in users:
-                if user.department and user.department.strip():
-                    dept_name = user.department.strip()
-                    if dept_name not in departments:
-                        departments[dept_name] = []
-                    departments[dept_name].append(user)
-                else:
-                    users_without_department.append(user)
-            
-            # Создаем Excel
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                
-                # Листы для отделов
-                for dept_name, dept_users in departments.items():
-                    self._create_tpoints_sheet(writer, dept_users, f"{dept_name} - T-Points")
-                
-                # Лист без отдела
-                if users_without_department:
-                    self._create_tpoints_sheet(writer, users_without_department, "Без отдела - T-Points")
-                
-                # Справочники и инструкции
-                await self._create_tpoints_activities_sheet(writer)
-                self._create_tpoints_instructions_sheet(writer)
-                self._create_tpoints_examples_sheet(writer)
+            activity_rows = await self._get_activity_rows()
             
-            output.seek(0)
-            return output
+            # Сборка XLSX нагружает CPU - выполняем вне event loop
+            return await asyncio.to_thread(self._build_tpoints_template_xlsx, users, activity_rows)
             
         except Exception as e:
             logger.error(f"Error creating T-Points template: {e}")
             raise
     
-    def _create_tpoints_sheet(self, writer, users: List[User], sheet_name: str):
+    def _build_tpoints_template_xlsx(self, users: List[tuple], activity_rows: List[tuple]) -> BytesIO:
+        """Синхронная сборка шаблона T-Points (выполняется в отдельном потоке)"""
+        book = XlsxExport()
+        
+        for dept_name, dept_users in groupby(users, key=self._export_group):
+            sheet_name = f"{dept_name} - T-Points" if dept_name else "Без отдела - T-Points"
+            self._create_tpoints_sheet(book, dept_users, sheet_name)
+        
+        # Справочники и инструкции
+        book.add_table('🎯 АКТИВНОСТИ', ACTIVITIES_SHEET_COLUMNS, activity_rows)
+        self._create_tpoints_instructions_sheet(book)
+        self._create_tpoints_examples_sheet(book)
+        
+        return book.close()
+    
+    def _create_tpoints_sheet(self, book: XlsxExport, users: Iterable[tuple], sheet_name: str):
         """Создает лист для начисления T-Points с поддержкой активностей"""
-        data = []
-        for user in users:
-            data.append({
-                'telegram_id': user.telegram_id,
-                'username': user.username or '',
-                'fullname': user.fullname,
-                'current_tpoints': user.tpoints,
-                'activity_name': '',  # Название активности (для автозаполнения)
-                'points_to_add': '',  # Заполняется автоматически или вручную
-                'reason': ''  # Заполняется автоматически или вручную
-            })
-        
-        df = pd.DataFrame(data)
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
+        # activity_name - название активности (для автозаполнения),
+        # points_to_add и reason заполняются автоматически или вручную
+        book.add_table(sheet_name, TPOINTS_SHEET_COLUMNS, (
+            (telegram_id, username or '', fullname, tpoints, '', '', '')
+            for telegram_id, username, fullname, _, _, _, _, tpoints in users
+        ))
     
-    def _create_tpoints_instructions_sheet(self, writer):
+    def _create_tpoints_instructions_sheet(self, book: XlsxExport):
         """Инструкции по начислению T-Points"""
-        instructions = [
-            ['💰 ИНСТРУКЦИЯ ПО НАЧИСЛЕНИЮ T-POINTS', ''],
-            ['', ''],
-            ['🔴 НЕ ИЗМЕНЯЙТЕ telegram_id, username, fullname!', ''],
-            ['', ''],
-            ['📋 Порядок заполнения:', ''],
-            ['1. Посмотрите лист "🎯 АКТИВНОСТИ"', 'Список доступных активностей'],
-            ['2. Заполните одним из способов:', ''],
-            ['', ''],
-            ['🎯 СПОСОБ 1 - Через активность:', ''],
-            ['- activity_name', 'Точное название из листа АКТИВНОСТИ'],
-            ['- points_to_add', 'Автоматически (можно изменить)'],
-            ['- reason', 'Автоматически (можно изменить)'],
-            ['', ''],
-            ['✏️ СПОСОБ 2 - Ручное заполнение:', ''],
-            ['- activity_name', 'Оставить пустым'],
-            ['- points_to_add', '+ для начисления, - для списания'],
-            ['- reason', 'Причина операции (обязательно)'],
-            ['', ''],
-            ['📝 Примеры:', ''],
-            ['Хакатон + 100 + "За 1 место"', 'Активность + изменение'],
-            ['пусто + 50 + "Бонус к ЗП"', 'Ручное начисление'],
-            ['пусто + -25 + "Штраф"', 'Ручное списание'],
-            ['пусто + 0 или пусто', 'Пропустить пользователя'],
-            ['', ''],
-            ['⚠️ Правила:', ''],
-            ['- Названия активностей точно как в листе', ''],
-            ['- Обязательно указывайте reason', ''],
-            ['- Пользователи получат уведомления', ''],
-            ['- Отрицательные значения для списания', ''],
-        ]
-        
-        df = pd.DataFrame(instructions, columns=['Описание', 'Детали'])
-        df.to_excel(writer, index=False, sheet_name='💰 ИНСТРУКЦИЯ')
+        book.add_table('💰 ИНСТРУКЦИЯ', INSTRUCTIONS_COLUMNS, TPOINTS_INSTRUCTIONS_ROWS)
     
-    def _create_tpoints_examples_sheet(self, writer):
+    def _create_tpoints_examples_sheet(self, book: XlsxExport):
         """Примеры заполнения T-Points"""
-        examples = [
-            {
-                'telegram_id': 123456789,
-                'username': 'john_doe',
-                'fullname': 'Иванов Иван Иванович',
-                'current_tpoints': 150,
-                'activity_name': 'Хакатон',
-                'points_to_add': 100,
-                'reason': 'За 1 место в хакатоне'
-            },
-            {
-                'telegram_id': 987654321,
-                'username': 'jane_smith', 
-                'fullname': 'Петрова Анна Сергеевна',
-                'current_tpoints': 75,
-                'activity_name': 'Тимбилдинг',
-                'points_to_add': 25,
-                'reason': 'Участие в командном квесте'
-            },
-            {
-                'telegram_id': 555666777,
-                'username': 'mike_brown',
-                'fullname': 'Сидоров Михаил Петрович',
-                'current_tpoints': 200,
-                'activity_name': '',
-                'points_to_add': 50,
-                'reason': 'Бонус к зарплате за месяц'
-            },
-            {
-                'telegram_id': 888999000,
-                'username': 'anna_white',
-                'fullname': 'Кузнецова Анна Александровна',
-                'current_tpoints': 120,
-                'activity_name': '',
-                'points_to_add': -30,
-                'reason': 'Штраф за нарушение дресс-кода'
-            }
-        ]
-        
-        df = pd.DataFrame(examples)
-        df.to_excel(writer, index=False, sheet_name='📝 ПРИМЕРЫ')
+        book.add_table('📝 ПРИМЕРЫ', TPOINTS_SHEET_COLUMNS, TPOINTS_EXAMPLE_ROWS)
     
     async def preview_tpoints_changes(self, file_content: bytes) -> Dict[str, Any]:
         """Предварительный просмотр изменений T-Points"""
         try:
-            excel_file = BytesIO(file_content)
-            xls = pd.ExcelFile(excel_file)
-            
             summary = {
                 'total_operations': 0,
                 'total_points_add': 0,
@@ -302,70 +323,38 @@ class UserManagerService(BaseService):
                 'errors': []
             }
             
-            for sheet_name in xls.sheet_names:
-                if any(keyword in sheet_name for keyword in ['ИНСТРУКЦИЯ', 'ПРИМЕРЫ', 'АКТИВНОСТИ']):
+            pending, parse_errors = await self._parse_tpoints_file(file_content)
+            summary['errors'].extend(parse_errors)
+            
+            # Проверяем пользователей одним запросом WHERE telegram_id IN (...)
+            users = await self.user_repo.get_users_by_ids(row[0] for row in pending)
+            
+            for telegram_id, points_to_add, reason, activity_name, activity_id in pending:
+                user = users.get(telegram_id)
+                if not user:
+                    summary['errors'].append(f"Пользователь {telegram_id} не найден")
                     continue
-                    
-                df = pd.read_excel(excel_file, sheet_name=sheet_name)
                 
-                for index, row in df.iterrows():
-                    try:
-                        telegram_id = int(row['telegram_id'])
-                        activity_name = row.get('activity_name', '')
-                        points_to_add = row.get('points_to_add', '')
-                        reason = row.get('reason', '')
-                        
-                        # Если указана активность, получаем её данные
-                        if activity_name and not pd.isna(activity_name) and str(activity_name).strip():
-                            activity = await self._get_activity_by_name(str(activity_name).strip())
-                            if activity:
-                                # Автозаполнение, если поля пустые
-                                if pd.isna(points_to_add) or points_to_add == '':
-                                    points_to_add = activity.points
-                                if pd.isna(reason) or str(reason).strip() == '':
-                                    reason = f"Начисление за: {activity.name}"
-                            else:
-                                summary['errors'].append(f"Строка {index+1} в {sheet_name}: Активность '{activity_name}' не найдена")
-                                continue
-                        
-                        # Пропускаем пустые операции
-                        if pd.isna(points_to_add) or points_to_add == '' or points_to_add == 0:
-                            continue
-                        
-                        points_to_add = int(float(points_to_add))
-                        
-                        if not reason or pd.isna(reason) or str(reason).strip() == '':
-                            summary['errors'].append(f"Строка {index+1} в {sheet_name}: нет причины")
-                            continue
-                        
-                        # Проверяем пользователя
-                        user = await self.user_repo.get_user_by_telegram_id(telegram_id)
-                        if not user:
-                            summary['errors'].append(f"Пользователь {telegram_id} не найден")
-                            continue
-                        
-                        operation = {
-                            'telegram_id': telegram_id,
-                            'username': user.username,
-                            'fullname': user.fullname,
-                            'current_points': user.tpoints,
-                            'points_change': points_to_add,
-                            'new_points': user.tpoints + points_to_add,
-                            'reason': str(reason).strip(),
-                            'activity_name': str(activity_name).strip() if activity_name and not pd.isna(activity_name) else None,
-                            'type': 'начисление' if points_to_add > 0 else 'списание'
-                        }
-                        
-                        summary['operations'].append(operation)
-                        summary['total_operations'] += 1
-                        
-                        if points_to_add > 0:
-                            summary['total_points_add'] += points_to_add
-                        else:
-                            summary['total_points_remove'] += abs(points_to_add)
-                            
-                    except Exception as e:
-                        summary['errors'].append(f"Ошибка в строке {index+1}: {str(e)}")
+                operation = {
+                    'telegram_id': telegram_id,
+                    'username': user.username,
+                    'fullname': user.fullname,
+                    'current_points': user.tpoints,
+                    'points_change': points_to_add,
+                    'new_points': user.tpoints + points_to_add,
+                    'reason': reason,
+                    'activity_name': activity_name,
+                    'activity_id': activity_id,
+                    'type': 'начисление' if points_to_add > 0 else 'списание'
+                }
+                
+                summary['operations'].append(operation)
+                summary['total_operations'] += 1
+                
+                if points_to_add > 0:
+                    summary['total_points_add'] += points_to_add
+                else:
+                    summary['total_points_remove'] += abs(points_to_add)
             
             return summary
             
@@ -373,6 +362,114 @@ class UserManagerService(BaseService):
             logger.error(f"Error previewing T-Points: {e}")
             raise
     
+    async def _parse_tpoints_file(self, file_content: bytes) -> Tuple[Tuple[tuple, ...], Tuple[str, ...]]:
+        """
+        Разбор файла T-Points без проверки пользователей
+        Возвращает строки (telegram_id, points, reason, activity_name, activity_id) и ошибки.
+        Результат запоминается: подтверждение после предпросмотра не разбирает файл повторно
+        """
+        key = (hashlib.sha256(file_content).digest(), activities_version())
+        cached = _parsed_tpoints_files.get(key)
+        if cached is not None:
+            return cached
+        
+        # Справочник активностей загружается один раз на файл, а не на каждую строку
+        self._activity_index = await self._load_activity_index()
+        pending = []
+        errors = []
+        for sheet_name, df in self._read_data_sheets(file_content, _TPOINTS_SKIP_SHEETS_RE):
+            pending.extend(self._parse_tpoints_sheet(df, sheet_name, errors))
+        
+        result = (tuple(pending), tuple(errors))
+        _parsed_tpoints_files.set(key, result)
+        return result
+    
+    @staticmethod
+    def _read_data_sheets(file_content: bytes, skip_sheets: re.Pattern) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """
+        Чтение загруженного XLSX через calamine (разбор на Rust, значения без стилей)
+        Первая строка листа - заголовки; полностью пустые строки отбрасываются,
+        индекс строки сохраняет позицию в листе для сообщений об ошибках
+        """
+        workbook = CalamineWorkbook.from_filelike(BytesIO(file_content))
+        for sheet_name in workbook.sheet_names:
+            if skip_sheets.search(sheet_name):
+                continue
+            
+            # skip_empty_area=False: пустые строки в начале листа не сдвигают нумерацию
+            rows = workbook.get_sheet_by_name(sheet_name).to_python(skip_empty_area=False)
+            if not rows or not any(cell != '' for cell in rows[0]):
+                continue
+            columns = [str(name).strip() if name != '' else f'_{i}' for i, name in enumerate(rows[0])]
+            
+            df = pd.DataFrame.from_records(rows[1:], columns=columns)
+            # calamine отдает пустые ячейки как '' - приводим к NaN, как и у остальных пропусков
+            df = df.mask(df.eq(''))
+            yield sheet_name, df.dropna(how='all')
+    
+    @staticmethod
+    def _sheet_column(df: pd.DataFrame, name: str) -> pd.Series:
+        """Колонка листа; отсутствующая колонка считается пустой"""
+        if name in df.columns:
+            return df[name]
+        return pd.Series(pd.NA, index=df.index, dtype=object)
+    
+    @staticmethod
+    def _text_column(column: pd.Series) -> pd.Series:
+        """Текстовая колонка без пробелов по краям; пустые ячейки -> ''"""
+        return column.astype('string').str.strip().fillna('')
+    
+    def _parse_tpoints_sheet(self, df: pd.DataFrame, sheet_name: str, errors: List[str]) -> List[tuple]:
+        """
+        Проверка листа T-Points целыми колонками, без обращений к БД
+        Возвращает строки (telegram_id, points, reason, activity_name, activity_id),
+        ошибки дописывает в errors
+        """
+        telegram_ids = pd.to_numeric(self._sheet_column(df, 'telegram_id'), errors='coerce')
+        activity_names = self._text_column(self._sheet_column(df, 'activity_name'))
+        raw_points = self._sheet_column(df, 'points_to_add')
+        reasons = self._text_column(self._sheet_column(df, 'reason'))
+        
+        # Автозаполнение баллов и причины из справочника активностей
+        # (одно обращение к индексу на строку, найденный id сохраняется в операции)
+        activity_keys = activity_names.str.lower()
+        has_activity = activity_names.ne('')
+        activity_ids = activity_keys.map({key: a.id for key, a in self._activity_index.items()})
+        activity_points = activity_keys.map({key: a.points for key, a in self._activity_index.items()})
+        activity_reasons = activity_keys.map({key: f"Начисление за: {a.name}" for key, a in self._activity_index.items()})
+        activity_missing = has_activity & activity_ids.isna()
+        
+        points_blank = raw_points.isna() | raw_points.astype('string').str.strip().eq('').fillna(True).astype(bool)
+        points = pd.to_numeric(raw_points.where(~points_blank), errors='coerce')
+        points = points.where(~points_blank, activity_points.astype('float64'))
+        reasons = reasons.where(reasons.ne(''), activity_reasons.fillna(''))
+        
+        points_invalid = ~points_blank & points.isna()
+        # int(float(x)): дробные значения отбрасываются к нулю
+        points = np.trunc(points)
+        is_empty = ~points_invalid & (points.isna() | points.eq(0))
+        id_invalid = telegram_ids.isna() | telegram_ids.ne(telegram_ids.round())
+        
+        # Пустые строки (в том числе хвост шаблона без telegram_id) пропускаются молча
+        row_errors = pd.Series(None, index=df.index, dtype=object)
+        row_errors[~is_empty & reasons.eq('')] = "нет причины"
+        row_errors[points_invalid] = "некорректное значение points_to_add"
+        for index in df.index[activity_missing]:
+            row_errors[index] = f"Активность '{activity_names[index]}' не найдена"
+        row_errors[id_invalid & ~(is_empty & ~activity_missing)] = "некорректный telegram_id"
+        
+        for index in df.index[row_errors.notna()]:
+            errors.append(f"Строка {index+1} в {sheet_name}: {row_errors[index]}")
+        
+        valid = row_errors.isna() & ~is_empty & ~id_invalid
+        return list(zip(
+            telegram_ids[valid].astype('int64').tolist(),
+            points[valid].astype('int64').tolist(),
+            reasons[valid].tolist(),
+            [name or None for name in activity_names[valid].tolist()],
+            [None if _is_missing(activity_id) else int(activity_id) for activity_id in activity_ids[valid].tolist()]
+        ))
+    
     async def apply_tpoints_changes(self, file_content: bytes, bot=None) -> Dict[str, Any]:
         """Применяет изменения T-Points с уведомлениями"""
         try:
@@ -386,68 +483,43 @@ class UserManagerService(BaseService):
                     'applied': 0
                 }
             
-            # Применяем операции
-            applied = 0
+            # Все операции файла применяются одним пакетом: одна блокировка пользователей,
+            # один INSERT транзакций и один UPDATE балансов
+            bulk_operations = []
+            for operation in summary['operations']:
+                bulk_operations.append({
+                    'user_id': operation['telegram_id'],
+                    'points': operation['points_change'],
+                    'description': operation['reason'],
+                    # Активность найдена при предпросмотре; списание по ней проводится как обычное списание
+                    'activity_id': operation.get('activity_id')
+                })
+            
+            results = await self.transaction_service.apply_bulk(bulk_operations)
+            
             successful_ops = []
+            for operation, success in zip(summary['operations'], results):
+                if success:
+                    successful_ops.append(operation)
+                else:
+                    logger.error(f"Error applying T-Points for {operation['telegram_id']}")
+            applied = len(successful_ops)
             
-            for operation in summary['operations']:
-                try:
-                    telegram_id = operation['telegram_id']
-                    points_change = operation['points_change']
-                    reason = operation['reason']
-                    
-                    # Выполняем транзакцию
-                    activity_name = operation.get('activity_name')
-                    
-                    if activity_name:
-                        # Если операция связана с активностью, используем специальный метод
-                        activity = await self._get_activity_by_name(activity_name)
-                        if activity and points_change > 0:
-                            success = await self.transaction_service.create_activity_transaction(
-                                user_id=telegram_id,
-                                activity_id=activity.id,
-                                points=points_change,
-                                description=reason
-                            )
-                        else:
-                            # Обычная транзакция, если активность не найдена или это списание
-                            if points_change > 0:
-                                success = await self.transaction_service.add_points(
-                                    user_id=telegram_id,
-                                    points=points_change,
-                                    description=reason
-                                )
-                            else:
-                                success = await self.transaction_service.remove_points(
-                                    user_id=telegram_id,
-                                    points=abs(points_change),
-                                    description=reason
-                                )
-                    else:
-                        # Ручная операция пополнения/списания
-                        if points_change > 0:
-                            success = await self.transaction_service.add_points(
-                                user_id=telegram_id,
-                                points=points_change,
-                                description=reason
-                            )
-                        else:
-                            success = await self.transaction_service.remove_points(
-                                user_id=telegram_id,
-                                points=abs(points_change),
-                                description=reason
-                            )
-                    
-                    if success:
-                        applied += 1
-                        successful_ops.append(operation)
-                        
-                        # Уведомление пользователю
-                        if bot:
-                            await self._send_tpoints_notification(bot, operation)
-                            
-                except Exception as e:
-                    logger.error(f"Error applying T-Points for {operation['telegram_id']}: {e}")
+            # Уведомления пользователям параллельно, с ограничением числа одновременных запросов
+            if bot and successful_ops:
+                semaphore = asyncio.Semaphore(TPOINTS_NOTIFY_CONCURRENCY)
+                
+                async def _notify(operation: Dict[str, Any]):
+                    async with semaphore:
+                        await self._send_tpoints_notification(bot, operation)
+                
+                results = await asyncio.gather(
+                    *(_notify(operation) for operation in successful_ops),
+                    return_exceptions=True
+                )
+                for operation, result in zip(successful_ops, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Error sending notification to {operation['telegram_id']}: {result}")
             
             return {
                 'success': True,
@@ -493,20 +565,26 @@ class UserManagerService(BaseService):
         except Exception as e:
             logger.error(f"Error sending notification to {operation['telegram_id']}: {e}")
     
-    async def _get_activity_by_name(self, activity_name: str) -> Optional['TPointsActivity']:
-        """Получить активность по названию"""
-        try:
+    def _get_activity_service(self):
+        """Получить TPointsActivityService, работающий в сессии текущего запроса"""
+        if self.tpoints_activity_service is None:
             from ..services.tpoints_activity_service import TPointsActivityService
-            activity_service = TPointsActivityService(self.session)
+            self.tpoints_activity_service = TPointsActivityService(self.session)
+        return self.tpoints_activity_service
+    
+    async def _load_activity_index(self) -> Dict[str, 'TPointsActivity']:
+        """Активные активности по названию в нижнем регистре (один запрос на файл)"""
+        try:
+            activity_service = self._get_activity_service()
             activities = await activity_service.get_all_activities_full()
-            
-            for activity in activities:
-                if activity.is_active and activity.name.strip().lower() == activity_name.lower():
-                    return activity
-            return None
+            return {
+                activity.name.strip().lower(): activity
+                for activity in activities
+                if activity.is_active
+            }
         except Exception as e:
-            logger.error(f"Error getting activity by name '{activity_name}': {e}")
-            return None
+            logger.error(f"Error loading activities: {e}")
+            return {}
     
     async def collect_user_onboarding_data(self, telegram_id: int, fullname: str, 
                                          birth_date: Optional[date] = None,
@@ -545,9 +623,6 @@ class UserManagerService(BaseService):
     async def preview_users_import(self, file_content: bytes) -> Dict[str, Any]:
         """Предварительный просмотр изменений данных пользователей"""
         try:
-            excel_file = BytesIO(file_content)
-            xls = pd.ExcelFile(excel_file)
-            
             summary = {
                 'total_users': 0,
                 'users_to_update': [],
@@ -555,115 +630,155 @@ class UserManagerService(BaseService):
                 'warnings': []
             }
             
-            for sheet_name in xls.sheet_names:
-                if '📋 ИНСТРУКЦИЯ' in sheet_name:
+            rows = []
+            for _, df in self._read_data_sheets(file_content, _USERS_SKIP_SHEETS_RE):
+                rows.extend(self._parse_users_sheet(df, summary['errors']))
+            
+            # Текущие данные всех пользователей файла одним запросом
+            users = await self.user_repo.get_users_by_ids(row['telegram_id'] for row in rows)
+            
+            for row in rows:
+                telegram_id = row['telegram_id']
+                current_user = users.get(telegram_id)
+                if not current_user:
+                    summary['errors'].append(f"Пользователь {telegram_id} не найден в системе")
                     continue
-                    
-                df = pd.read_excel(excel_file, sheet_name=sheet_name)
                 
-                for index, row in df.iterrows():
-                    try:
-                        telegram_id = int(row['telegram_id'])
-                        
-                        # Получаем текущего пользователя
-                        current_user = await self.user_repo.get_user_by_telegram_id(telegram_id)
-                        if not current_user:
-                            summary['errors'].append(f"Пользователь {telegram_id} не найден в системе")
-                            continue
-                        
-                        # Анализируем изменения
-                        changes = {}
-                        warnings = []
-                        
-                        # Проверяем fullname (обязательное)
-                        new_fullname = str(row.get('fullname', '')).strip()
-                        if not new_fullname:
-                            summary['errors'].append(f"Строка {index+1}: fullname обязательно")
-                            continue
-                        if new_fullname != current_user.fullname:
-                            changes['fullname'] = {
-                                'old': current_user.fullname,
-                                'new': new_fullname
-                            }
-                        
-                        # Проверяем birth_date (рекомендуемое)
-                        birth_date_str = str(row.get('birth_date', '')).strip()
-                        if not birth_date_str or birth_date_str == 'nan':
-                            warnings.append("Дата рождения не указана - не будет уведомлений о ДР")
-                        else:
-                            try:
-                                new_birth_date = datetime.strptime(birth_date_str, '%Y-%m-%d').date()
-                                current_birth_str = current_user.birth_date.strftime('%Y-%m-%d') if current_user.birth_date else ''
-                                if birth_date_str != current_birth_str:
-                                    changes['birth_date'] = {
-                                        'old': current_birth_str,
-                                        'new': birth_date_str
-                                    }
-                            except ValueError:
-                                summary['errors'].append(f"Строка {index+1}: неверный формат birth_date (нужен YYYY-MM-DD)")
-                                continue
-                        
-                        # Проверяем hire_date (опциональное)
-                        hire_date_str = str(row.get('hire_date', '')).strip()
-                        if hire_date_str and hire_date_str != 'nan':
-                            try:
-                                new_hire_date = datetime.strptime(hire_date_str, '%Y-%m-%d').date()
-                                current_hire_str = current_user.hire_date.strftime('%Y-%m-%d') if current_user.hire_date else ''
-                                if hire_date_str != current_hire_str:
-                                    changes['hire_date'] = {
-                                        'old': current_hire_str,
-                                        'new': hire_date_str
-                                    }
-                            except ValueError:
-                                summary['errors'].append(f"Строка {index+1}: неверный формат hire_date")
-                                continue
-                        
-                        # Проверяем department
-                        new_department = str(row.get('department', '')).strip()
-                        current_department = current_user.department or ''
-                        if new_department != current_department:
-                            changes['department'] = {
-                                'old': current_department,
-                                'new': new_department
-                            }
-                        
-                        # Проверяем is_active
-                        new_is_active = bool(row.get('is_active', True))
-                        if new_is_active != current_user.is_active:
-                            changes['is_active'] = {
-                                'old': current_user.is_active,
-                                'new': new_is_active
-                            }
-                            if not new_is_active:
-                                warnings.append("🚨 ДЕАКТИВАЦИЯ: Данный пользователь должен быть удалён из группы!")
-                        
-                        # Проверка попытки изменить tpoints
-                        if 'tpoints' in row and not pd.isna(row['tpoints']):
-                            new_tpoints = int(row['tpoints'])
-                            if new_tpoints != current_user.tpoints:
-                                warnings.append("Изменение T-Points игнорируется (используйте отдельный файл)")
-                        
-                        # Если есть изменения, добавляем пользователя
-                        if changes:
-                            user_update = {
-                                'telegram_id': telegram_id,
-                                'username': current_user.username,
-                                'fullname': current_user.fullname,
-                                'changes': changes,
-                                'warnings': warnings
-                            }
-                            summary['users_to_update'].append(user_update)
-                            summary['total_users'] += 1
-                            
-                    except Exception as e:
-                        summary['errors'].append(f"Ошибка в строке {index+1}: {str(e)}")
-            
+                # Анализируем изменения; параллельно собираем готовую к записи строку UPDATE
+                # (значения уже типизированы, при импорте изменения повторно не разбираются)
+                changes = {}
+                warnings = []
+                update_data = {'telegram_id': telegram_id}
+                
+                if row['fullname'] != current_user.fullname:
+                    changes['fullname'] = {
+                        'old': current_user.fullname,
+                        'new': row['fullname']
+                    }
+                    update_data['fullname'] = row['fullname']
+                
+                # birth_date рекомендуемое
+                if not row['birth_date']:
+                    warnings.append("Дата рождения не указана - не будет уведомлений о ДР")
+                else:
+                    current_birth_str = current_user.birth_date.isoformat() if current_user.birth_date else ''
+                    if row['birth_date'] != current_birth_str:
+                        changes['birth_date'] = {
+                            'old': current_birth_str,
+                            'new': row['birth_date']
+                        }
+                        update_data['birth_date'] = row['birth_date_value']
+                
+                # hire_date опциональное
+                if row['hire_date']:
+                    current_hire_str = current_user.hire_date.isoformat() if current_user.hire_date else ''
+                    if row['hire_date'] != current_hire_str:
+                        changes['hire_date'] = {
+                            'old': current_hire_str,
+                            'new': row['hire_date']
+                        }
+                        update_data['hire_date'] = row['hire_date_value']
+                
+                current_department = current_user.department or ''
+                if row['department'] != current_department:
+                    changes['department'] = {
+                        'old': current_department,
+                        'new': row['department']
+                    }
+                    update_data['department'] = row['department']
+                
+                if row['is_active'] != current_user.is_active:
+                    changes['is_active'] = {
+                        'old': current_user.is_active,
+                        'new': row['is_active']
+                    }
+                    update_data['is_active'] = row['is_active']
+                    if not row['is_active']:
+                        warnings.append("🚨 ДЕАКТИВАЦИЯ: Данный пользователь должен быть удалён из группы!")
+                
+                # Проверка попытки изменить tpoints
+                if row['tpoints'] is not None and row['tpoints'] != current_user.tpoints:
+                    warnings.append("Изменение T-Points игнорируется (используйте отдельный файл)")
+                
+                # Если есть изменения, добавляем пользователя
+                if changes:
+                    user_update = {
+                        'telegram_id': telegram_id,
+                        'username': current_user.username,
+                        'fullname': current_user.fullname,
+                        'changes': changes,
+                        'warnings': warnings,
+                        'update': update_data
+                    }
+                    summary['users_to_update'].append(user_update)
+                    summary['total_users'] += 1
+        
             return summary
             
         except Exception as e:
             logger.error(f"Error previewing users import: {e}")
             raise
     
+    def _parse_users_sheet(self, df: pd.DataFrame, errors: List[str]) -> List[Dict[str, Any]]:
+        """
+        Проверка листа пользователей целыми колонками, без обращений к БД
+        Даты возвращаются строками YYYY-MM-DD ('' - не указана) для сравнения и показа
+        и объектами date в *_value для записи в БД; ошибки дописываются в errors
+        """
+        telegram_ids = pd.to_numeric(self._sheet_column(df, 'telegram_id'), errors='coerce')
+        fullnames = self._text_column(self._sheet_column(df, 'fullname'))
+        departments = self._text_column(self._sheet_column(df, 'department'))
+        is_active = self._sheet_column(df, 'is_active').fillna(True).astype(bool)
+        tpoints = pd.to_numeric(self._sheet_column(df, 'tpoints'), errors='coerce')
+        
+        dates = {}
+        date_values = {}
+        date_invalid = {}
+        for column in ('birth_date', 'hire_date'):
+            raw = self._text_column(self._sheet_column(df, column))
+            parsed = pd.to_datetime(raw.where(raw.ne('')), format='%Y-%m-%d', errors='coerce')
+            dates[column] = parsed.dt.strftime('%Y-%m-%d').fillna('')
+            date_values[column] = parsed.dt.date
+            date_invalid[column] = raw.ne('') & parsed.isna()
+        
+        id_invalid = telegram_ids.isna() | telegram_ids.ne(telegram_ids.round())
+        
+        row_errors = pd.Series(None, index=df.index, dtype=object)
+        row_errors[date_invalid['hire_date']] = "неверный формат hire_date"
+        row_errors[date_invalid['birth_date']] = "неверный формат birth_date (нужен YYYY-MM-DD)"
+        row_errors[fullnames.eq('')] = "fullname обязательно"
+        row_errors[id_invalid] = "некорректный telegram_id"
+        
+        for index in df.index[row_errors.notna()]:
+            errors.append(f"Строка {index+1}: {row_errors[index]}")
+        
+        valid = row_errors.isna()
+        return [
+            {
+                'telegram_id': telegram_id,
+                'fullname': fullname,
+                'birth_date': birth_date,
+                'birth_date_value': birth_date_value,
+                'hire_date': hire_date,
+                'hire_date_value': hire_date_value,
+                'department': department,
+                'is_active': active,
+                'tpoints': None if _is_missing(points) else int(points)
+            }
+            for (telegram_id, fullname, birth_date, birth_date_value, hire_date, hire_date_value,
+                 department, active, points) in zip(
+                telegram_ids[valid].astype('int64').tolist(),
+                fullnames[valid].tolist(),
+                dates['birth_date'][valid].tolist(),
+                date_values['birth_date'][valid].tolist(),
+                dates['hire_date'][valid].tolist(),
+                date_values['hire_date'][valid].tolist(),
+                departments[valid].tolist(),
+                is_active[valid].tolist(),
+                tpoints[valid].tolist()
+            )
+        ]
+    
     async def import_users_from_excel(self, file_content: bytes) -> Dict[str, Any]:
         """Импорт обновлений данных пользователей из Excel"""
         try:
@@ -685,77 +800,62 @@ class UserManagerService(BaseService):
                     'updated': 0
                 }
             
-            # Применяем изменения
-            updated = 0
-            deactivated_users = []
+            # Один проход по изменениям: строки UPDATE (собраны при предпросмотре),
+            # результат для обработчика и список деактивируемых
+            updates = []
             successful_updates = []
+            deactivated_users = []
             
             for user_update in preview['users_to_update']:
-                try:
-                    telegram_id = user_update['telegram_id']
-                    changes = user_update['changes']
-                    
-                    # Подготавливаем данные для обновления
-                    update_data = {}
-                    
-                    for field, change in changes.items():
-                        if field == 'birth_date':
-                            update_data[field] = datetime.strptime(change['new'], '%Y-%m-%d').date()
-                        elif field == 'hire_date' and change['new']:
-                            update_data[field] = datetime.strptime(change['new'], '%Y-%m-%d').date()
-                        else:
-                            update_data[field] = change['new']
-                    
-                    # Обновляем пользователя
-                    success = await self.user_repo.update_user_data(telegram_id, update_data)
-                    
-                    if success:
-                        updated += 1
-                        successful_updates.append({
-                            'telegram_id': telegram_id,
-                            'changes': changes
-                        })
-                        
-                        # Специальное логирование для деактивации
-                        if 'is_active' in changes and not changes['is_active']['new']:
-                            user = await self.user_repo.get_user_by_telegram_id(telegram_id)
-                            logger.warning(f"🚨 USER DEACTIVATED: {user.fullname} (ID: {telegram_id}) - УДАЛЯЕМ ИЗ ГРУППЫ!")
-                            deactivated_users.append({
-                                'telegram_id': telegram_id,
-                                'fullname': user.fullname,
-                                'username': user.username
-                            })
-                            
-                            # Автоматическое удаление из группы
-                            if self.group_management_service and self.bot:
-                                try:
-                                    removal_success = await self.group_management_service.remove_user_from_group(
-                                        bot=self.bot,
-                                        user_id=telegram_id,
-                                        reason=f"Деактивация через Excel: {user.fullname}"
-                                    )
-                                    
-                                    if removal_success:
-                                        logger.warning(f"✅ USER REMOVED FROM GROUP: {user.fullname} (ID: {telegram_id})")
-                                        
-                                        # Уведомляем пользователя
-                                        await self.group_management_service.notify_user_about_removal(
-                                            bot=self.bot,
-                                            user_id=telegram_id,
-                                            reason="деактивации через HR-систему"
-                                        )
-                                    else:
-                                        logger.error(f"❌ FAILED to remove user {telegram_id} from group")
-                                        
-                                except Exception as group_error:
-                                    logger.error(f"Error removing user {telegram_id} from group: {group_error}")
-                            else:
-                                logger.warning(f"⚠️ Group management not configured - manual removal required for {telegram_id}")
-                        
-                        logger.info(f"Updated user {telegram_id}: {list(changes.keys())}")
-                        
-                except Exception as e:
-                    logger.error(f"Error updating user {user_update['telegram_id']}: {e}")
+                telegram_id = user_update['telegram_id']
+                changes = user_update['changes']
+                updates.append(user_update['update'])
+                successful_updates.append({
+                    'telegram_id': telegram_id,
+                    'changes': changes
+                })
+                
+                if 'is_active' in changes and not changes['is_active']['new']:
+                    # Данные пользователя уже загружены при предпросмотре, повторный SELECT не нужен
+                    fullname = changes['fullname']['new'] if 'fullname' in changes else user_update['fullname']
+                    deactivated_users.append({
+                        'telegram_id': telegram_id,
+                        'fullname': fullname,
+                        'username': user_update['username']
+                    })
+            
+            # Все изменения одним пакетным UPDATE вместо запроса на каждого пользователя
+            if not await self.user_repo.bulk_update_users(updates):
+                return {
+                    'success': False,
+                    'message': 'Ошибка импорта: не удалось обновить пользователей',
+                    'updated': 0
+                }
+            
+            # Весь импорт фиксируется одним commit до обращений к Bot API: удаление из группы
+            # занимает секунды, и блокировка записи не должна удерживаться все это время
+            # (commit middleware после обработчика останется пустым)
+            await self.user_repo.commit()
+            
+            updated = len(updates)
+            if logger.isEnabledFor(logging.INFO):
+                for update in successful_updates:
+                    logger.info("Updated user %s: %s", update['telegram_id'], ', '.join(update['changes']))
+            
+            # Специальное логирование для деактивации
+            for user in deactivated_users:
+                logger.warning("🚨 USER DEACTIVATED: %s (ID: %s) - УДАЛЯЕМ ИЗ ГРУППЫ!", user['fullname'], user['telegram_id'])
+            
+            # Удаление из группы - после записи в БД, параллельно с ограничением числа запросов.
+            # GroupManagementService обращается только к Bot API, общая сессия БД не используется
+            if deactivated_users:
+                semaphore = asyncio.Semaphore(GROUP_REMOVAL_CONCURRENCY)
+                
+                async def _remove(user: Dict[str, Any]):
+                    async with semaphore:
+                        await self._remove_deactivated_user(user)
+                
+                await asyncio.gather(*(_remove(user) for user in deactivated_users))
             
             # Формируем сообщение результата
             message = f'Обновлено {updated} пользователей'
@@ -779,8 +879,45 @@ class UserManagerService(BaseService):
                 'updated': 0
             }
 
-    async def export_tpoints_journal_to_excel(self, days: int = 30) -> BytesIO:
-        """Экспорт журнала T-Points операций в Excel с разделением по отделам"""
+    async def _remove_deactivated_user(self, user: Dict[str, Any]):
+        """Автоматическое удаление деактивированного пользователя из группы с уведомлением"""
+        telegram_id = user['telegram_id']
+        fullname = user['fullname']
+        
+        if not (self.group_management_service and self.bot):
+            logger.warning("⚠️ Group management not configured - manual removal required for %s", telegram_id)
+            return
+        
+        try:
+            removal_success = await self.group_management_service.remove_user_from_group(
+                bot=self.bot,
+                user_id=telegram_id,
+                reason=f"Деактивация через Excel: {fullname}"
+            )
+            
+            if removal_success:
+                logger.warning("✅ USER REMOVED FROM GROUP: %s (ID: %s)", fullname, telegram_id)
+                
+                # Уведомляем пользователя
+                await self.group_management_service.notify_user_about_removal(
+                    bot=self.bot,
+                    user_id=telegram_id,
+                    reason="деактивации через HR-систему"
+                )
+            else:
+                logger.error("❌ FAILED to remove user %s from group", telegram_id)
+                
+        except Exception as group_error:
+            logger.error("Error removing user %s from group: %s", telegram_id, group_error)
+
+    async def export_tpoints_journal_to_excel(self, days: int = 30) -> str:
+        """
+        Экспорт журнала T-Points операций в Excel с разделением по отделам
+        Журнал за период может быть большим, поэтому книга пишется во временный файл на диске,
+        а не в память. Возвращает путь к файлу; удалить его после отправки - задача вызывающего
+        """
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
         try:
             # Получаем транзакции за период
             from datetime import datetime, timedelta
@@ -792,232 +929,146 @@ class UserManagerService(BaseService):
             
             if not transactions:
                 # Создаем пустой файл с инструкциями
-                return await self._create_empty_journal_excel()
+                return await self._create_empty_journal_excel(path)
             
-            # Группируем транзакции по отделам пользователей
-            departments = {}
-            transactions_without_department = []
+            # Один проход: группировка транзакций по отделам и статистика для сводки
+            # Ключ '' - пользователи без отдела
+            departments = defaultdict(list)
+            dept_stats = defaultdict(lambda: {'operations': 0, 'added': 0, 'removed': 0})
             
             for transaction in transactions:
-                user = await self.user_repo.get_user_by_telegram_id(transaction.user_id)
+                # Пользователь подгружен вместе с транзакциями (selectinload), отдельный SELECT не нужен
+                user = transaction.user
                 if not user:
                     continue
-                    
-                if user.department and user.department.strip():
-                    dept_name = user.department.strip()
-                    if dept_name not in departments:
-                        departments[dept_name] = []
-                    departments[dept_name].append((transaction, user))
+                
+                dept_name = user.department.strip() if user.department else ''
+                departments[dept_name].append((transaction, user))
+                stats = dept_stats[dept_name]
+                stats['operations'] += 1
+                if transaction.points_amount > 0:
+                    stats['added'] += transaction.points_amount
                 else:
-                    transactions_without_department.append((transaction, user))
+                    stats['removed'] -= transaction.points_amount
             
-            # Создаем Excel
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                
-                # Листы для отделов
-                for dept_name, dept_transactions in departments.items():
-                    self._create_journal_sheet(writer, dept_transactions, f"{dept_name} - Операции")
-                
-                # Лист для пользователей без отдела
-                if transactions_without_department:
-                    self._create_journal_sheet(writer, transactions_without_department, "Без отдела - Операции")
-                
-                # Сводный лист
-                self._create_journal_summary_sheet(writer, transactions)
-                
-                # Инструкции
-                self._create_journal_instructions_sheet(writer)
+            transactions_without_department = departments.pop('', [])
+            no_dept_stats = dept_stats.pop('', {'operations': 0, 'added': 0, 'removed': 0})
             
-            output.seek(0)
-            return output
+            # Сборка XLSX нагружает CPU - выполняем вне event loop.
+            # Связи транзакций загружены заранее, поэтому поток не обращается к сессии
+            return await asyncio.to_thread(
+                self._build_journal_xlsx, path, departments, transactions_without_department,
+                dept_stats, no_dept_stats
+            )
             
         except Exception as e:
             logger.error(f"Error exporting T-Points journal: {e}")
+            os.remove(path)
             raise
+    
+    def _build_journal_xlsx(self, path: str, departments: Dict[str, List[tuple]],
+                            transactions_without_department: List[tuple],
+                            dept_stats: Dict[str, Dict[str, int]], no_dept_stats: Dict[str, int]) -> str:
+        """Синхронная сборка журнала T-Points в файл path (выполняется в отдельном потоке)"""
+        book = XlsxExport(path)
+        
+        # Листы для отделов
+        for dept_name, dept_transactions in departments.items():
+            self._create_journal_sheet(book, dept_transactions, f"{dept_name} - Операции")
+        
+        # Лист для пользователей без отдела
+        if transactions_without_department:
+            self._create_journal_sheet(book, transactions_without_department, "Без отдела - Операции")
+        
+        # Сводный лист
+        self._create_journal_summary_sheet(book, dept_stats, no_dept_stats)
+        
+        # Инструкции
+        self._create_journal_instructions_sheet(book)
+        
+        return book.close()
 
-    async def _create_empty_journal_excel(self) -> BytesIO:
+    async def _create_empty_journal_excel(self, path: str) -> str:
         """Создает пустой Excel файл журнала с инструкциями"""
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Пустая сводка
-            empty_data = pd.DataFrame({
-                'Отдел': ['Нет данных'],
-                'Операций': [0],
-                'Начислено': [0],
-                'Списано': [0],
-                'Баланс': [0]
-            })
-            empty_data.to_excel(writer, index=False, sheet_name='📊 СВОДКА')
-            
-            # Инструкции
-            self._create_journal_instructions_sheet(writer)
-        
-        output.seek(0)
-        return output
-
-    def _create_journal_sheet(self, writer, dept_transactions: List[tuple], sheet_name: str):
-        """Создает лист с операциями отдела"""
-        data = []
-        for transaction, user in dept_transactions:
-            data.append({
-                'ID': transaction.id,
-                'Дата': transaction.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                'Telegram ID': user.telegram_id,
-                'Username': user.username or '',
-                'ФИО': user.fullname,
-                'Отдел': user.department or '',
-                'Сумма T-Points': transaction.points_amount,
-                'Тип': 'Начисление' if transaction.points_amount > 0 else 'Списание',
-                'Описание': transaction.description,
-                'Активность': transaction.activity.name if transaction.activity else '',
-                'Продукт': transaction.product.name if transaction.product else ''
-            })
-        
-        df = pd.DataFrame(data)
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
+        book = XlsxExport(path)
+        
+        # Пустая сводка
+        book.add_table('📊 СВОДКА', JOURNAL_SUMMARY_COLUMNS, [('Нет данных', 0, 0, 0, 0)])
+        
+        # Инструкции
+        self._create_journal_instructions_sheet(book)
+        
+        return book.close()
 
-    def _create_journal_summary_sheet(self, writer, transactions: List):
-        """Создает сводный лист со статистикой по отделам"""
-        # Группируем по отделам для статистики
-        dept_stats = {}
-        no_dept_stats = {'operations': 0, 'added': 0, 'removed': 0}
-        
-        for transaction in transactions:
-            # Пользователь уже должен быть загружен с relationship
-            user = transaction.user if hasattr(transaction, 'user') and transaction.user else None
-                
-            if not user:
-                continue
-                
-            department = user.department.strip() if user.department else None
-            
-            if department:
-                if department not in dept_stats:
-                    dept_stats[department] = {'operations': 0, 'added': 0, 'removed': 0}
-                
-                dept_stats[department]['operations'] += 1
-                if transaction.points_amount > 0:
-                    dept_stats[department]['added'] += transaction.points_amount
-                else:
-                    dept_stats[department]['removed'] += abs(transaction.points_amount)
-            else:
-                no_dept_stats['operations'] += 1
-                if transaction.points_amount > 0:
-                    no_dept_stats['added'] += transaction.points_amount
-                else:
-                    no_dept_stats['removed'] += abs(transaction.points_amount)
+    def _create_journal_sheet(self, book: XlsxExport, dept_transactions: List[tuple], sheet_name: str):
+        """Создает лист с операциями отдела (строки пишутся сразу, без промежуточного списка)"""
+        worksheet = book.add_sheet(sheet_name, JOURNAL_SHEET_COLUMNS)
+        # Ширина колонки даты, иначе Excel покажет ####
+        worksheet.set_column(1, 1, 19)
         
-        # Формируем данные для сводки
+        for row_index, (transaction, user) in enumerate(dept_transactions, start=1):
+            worksheet.write_number(row_index, 0, transaction.id)
+            worksheet.write_datetime(row_index, 1, transaction.created_at, book.datetime_format)
+            worksheet.write_row(row_index, 2, (
+                user.telegram_id,
+                user.username or '',
+                user.fullname,
+                user.department or '',
+                transaction.points_amount,
+                'Начисление' if transaction.points_amount > 0 else 'Списание',
+                transaction.description,
+                transaction.activity.name if transaction.activity else '',
+                transaction.product.name if transaction.product else ''
+            ))
+
+    def _create_journal_summary_sheet(self, book: XlsxExport, dept_stats: Dict[str, Dict[str, int]],
+                                      no_dept_stats: Dict[str, int]):
+        """Создает сводный лист по статистике, собранной при группировке транзакций"""
+        # Формируем данные для сводки (в порядке JOURNAL_SUMMARY_COLUMNS)
         summary_data = []
         
         for dept_name, stats in dept_stats.items():
             balance = stats['added'] - stats['removed']
-            summary_data.append({
-                'Отдел': dept_name,
-                'Операций': stats['operations'],
-                'Начислено T-Points': stats['added'],
-                'Списано T-Points': stats['removed'],
-                'Баланс отдела': balance
-            })
+            summary_data.append((dept_name, stats['operations'], stats['added'], stats['removed'], balance))
         
         if no_dept_stats['operations'] > 0:
             balance = no_dept_stats['added'] - no_dept_stats['removed']
-            summary_data.append({
-                'Отдел': 'Без отдела',
-                'Операций': no_dept_stats['operations'],
-                'Начислено T-Points': no_dept_stats['added'],
-                'Списано T-Points': no_dept_stats['removed'],
-                'Баланс отдела': balance
-            })
+            summary_data.append((
+                'Без отдела', no_dept_stats['operations'],
+                no_dept_stats['added'], no_dept_stats['removed'], balance
+            ))
         
         # Общая статистика
-        total_operations = sum(item['Операций'] for item in summary_data)
-        total_added = sum(item['Начислено T-Points'] for item in summary_data)
-        total_removed = sum(item['Списано T-Points'] for item in summary_data)
+        total_operations = sum(item[1] for item in summary_data)
+        total_added = sum(item[2] for item in summary_data)
+        total_removed = sum(item[3] for item in summary_data)
         total_balance = total_added - total_removed
         
-        summary_data.append({
-            'Отдел': '🔹 ИТОГО',
-            'Операций': total_operations,
-            'Начислено T-Points': total_added,
-            'Списано T-Points': total_removed,
-            'Баланс отдела': total_balance
-        })
+        summary_data.append(('🔹 ИТОГО', total_operations, total_added, total_removed, total_balance))
         
-        df = pd.DataFrame(summary_data)
-        df.to_excel(writer, index=False, sheet_name='📊 СВОДКА')
+        book.add_table('📊 СВОДКА', JOURNAL_SUMMARY_COLUMNS, summary_data)
 
-    def _create_journal_instructions_sheet(self, writer):
+    def _create_journal_instructions_sheet(self, book: XlsxExport):
         """Инструкции по журналу операций"""
-        instructions = [
-            ['📊 ЖУРНАЛ T-POINTS ОПЕРАЦИЙ', ''],
-            ['', ''],
-            ['📋 Описание листов:', ''],
-            ['• 📊 СВОДКА', 'Статистика по отделам'],
-            ['• [Отдел] - Операции', 'Детальные операции отдела'],
-            ['• Без отдела - Операции', 'Операции пользователей без отдела'],
-            ['', ''],
-            ['📊 Поля в детальных листах:', ''],
-            ['• ID', 'Уникальный номер операции'],
-            ['• Дата', 'Дата и время операции'],
-            ['• Telegram ID', 'ID пользователя в Telegram'],
-            ['• Username', 'Имя пользователя в Telegram'],
-            ['• ФИО', 'Полное имя сотрудника'],
-            ['• Отдел', 'Отдел сотрудника'],
-            ['• Сумма T-Points', 'Количество T-Points (+/-)'],
-            ['• Тип', 'Начисление или Списание'],
-            ['• Описание', 'Причина операции'],
-            ['• Активность', 'Связанная активность (если есть)'],
-            ['• Продукт', 'Связанный продукт (если есть)'],
-            ['', ''],
-            ['💡 Полезные функции Excel:', ''],
-            ['• Фильтры', 'Настройте фильтры по датам/типам'],
-            ['• Сортировка', 'Сортируйте по любому полю'],
-            ['• Поиск', 'Ctrl+F для поиска'],
-            ['• Сводные таблицы', 'Создайте свою аналитику'],
-        ]
-        
-        df = pd.DataFrame(instructions, columns=['Описание', 'Детали'])
-        df.to_excel(writer, index=False, sheet_name='📋 ИНСТРУКЦИЯ')
+        book.add_table('📋 ИНСТРУКЦИЯ', INSTRUCTIONS_COLUMNS, JOURNAL_INSTRUCTIONS_ROWS)
 
-    async def _create_tpoints_activities_sheet(self, writer):
-        """Создает справочник активностей T-Points"""
+    async def _get_activity_rows(self) -> List[tuple]:
+        """Строки справочника активностей T-Points (в порядке ACTIVITIES_SHEET_COLUMNS)"""
         try:
             # Получаем активности из базы данных
-            from ..services.tpoints_activity_service import TPointsActivityService
-            activity_service = TPointsActivityService(self.session)
+            activity_service = self._get_activity_service()
             activities = await activity_service.get_all_activities_full()
             
-            data = []
-            if activities:
-                for activity in activities:
-                    if activity.is_active:
-                        data.append({
-                            'Название активности': activity.name,
-                            'T-Points': activity.points,
-                            'Описание': activity.description or '',
-                            'Статус': 'Активна' if activity.is_active else 'Неактивна'
-                        })
-            
-            # Если активностей нет, создаем примеры
-            if not data:
-                data = [
-                    {'Название активности': 'Участие в корпоративе', 'T-Points': 50, 'Описание': 'За участие в корпоративном мероприятии', 'Статус': 'Пример'},
-                    {'Название активности': 'Хакатон', 'T-Points': 100, 'Описание': 'За участие в хакатоне', 'Статус': 'Пример'},
-                    {'Название активности': 'Обучение', 'T-Points': 30, 'Описание': 'За прохождение обучающего курса', 'Статус': 'Пример'},
-                    {'Название активности': 'Тимбилдинг', 'T-Points': 25, 'Описание': 'За участие в командных активностях', 'Статус': 'Пример'},
-                    {'Название активности': 'Спорт', 'T-Points': 20, 'Описание': 'За участие в спортивных мероприятиях', 'Статус': 'Пример'}
-                ]
-            
-            df = pd.DataFrame(data)
-            df.to_excel(writer, index=False, sheet_name='🎯 АКТИВНОСТИ')
+            rows = [
+                (activity.name, activity.points, activity.description or '', 'Активна')
+                for activity in activities
+                if activity.is_active
+            ]
+            
+            # Если активностей нет, показываем примеры
+            return rows or list(ACTIVITY_EXAMPLE_ROWS)
             
         except Exception as e:
-            logger.error(f"Error creating activities sheet: {e}")
-            # Создаем базовые примеры в случае ошибки
-            data = [
-                {'Название активности': 'Ошибка загрузки', 'T-Points': 0, 'Описание': 'Не удалось загрузить активности', 'Статус': 'Ошибка'}
-            ]
-            df = pd.DataFrame(data)
-            df.to_excel(writer, index=False, sheet_name='🎯 АКТИВНОСТИ')
+            logger.error(f"Error loading activities for template: {e}")
+            # Базовая строка в случае ошибки
+            return [('Ошибка загрузки', 0, 'Не удалось загрузить активности', 'Ошибка')]
@@ -4,6 +4,13 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Ожидаемые ошибки ответа на callback: (фрагмент текста ошибки, сообщение в лог)
+_EXPECTED_ANSWER_ERRORS = (
+    ("query is too old", "Callback query is too old for user {}, proceeding without answering"),
+    ("query id is invalid", "Callback query ID is invalid for user {}"),
+    ("response timeout expired", "Callback query response timeout expired for user {}"),
+)
+
 async def safe_callback_answer(
     callback: CallbackQuery, 
     text: str = "", 
@@ -26,18 +33,14 @@ async def safe_callback_answer(
         await callback.answer(text=text, show_alert=show_alert, cache_time=cache_time)
         return True
     except TelegramBadRequest as e:
-        if "query is too old" in str(e).lower():
-            logger.warning(f"Callback query is too old for user {callback.from_user.id}, proceeding without answering")
-            return False
-        elif "query id is invalid" in str(e).lower():
-            logger.warning(f"Callback query ID is invalid for user {callback.from_user.id}")
-            return False
-        elif "response timeout expired" in str(e).lower():
-            logger.warning(f"Callback query response timeout expired for user {callback.from_user.id}")
-            return False
-        else:
-            logger.error(f"Error answering callback query for user {callback.from_user.id}: {e}")
-            raise  # Пробрасываем другие ошибки
+        # Текст ошибки приводится к нижнему регистру один раз для всех проверок
+        error_text = (e.message or "").lower()
+        for needle, log_message in _EXPECTED_ANSWER_ERRORS:
+            if needle in error_text:
+                logger.warning(log_message.format(callback.from_user.id))
+                return False
+        logger.error(f"Error answering callback query for user {callback.from_user.id}: {e}")
+        raise  # Пробрасываем другие ошибки
     except Exception as e:
         logger.error(f"Unexpected error answering callback query for user {callback.from_user.id}: {e}")
         raise
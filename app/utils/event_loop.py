@@ -0,0 +1,13 @@
+"""
+Выбор реализации event loop для точек входа (бот, миграции)
+"""
+import asyncio
+import sys
+
+
+def install_event_loop_policy() -> None:
+    """uvloop (libuv) вместо стандартного event loop; на Windows uvloop не поддерживается"""
+    if sys.platform == "win32":
+        return
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
@@ -0,0 +1,46 @@
+"""
+Обнаружение ленивых загрузок связей (N+1) вне продакшена
+Каждая ленивая загрузка логируется с указанием объекта и связи,
+в тестах может превращаться в исключение
+"""
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, Session
+
+logger = logging.getLogger(__name__)
+
+_installed = False
+
+
+class LazyLoadError(RuntimeError):
+    """Ленивая загрузка связи при включенном строгом режиме"""
+
+
+def install_lazy_load_detector(raise_on_lazy_load: bool = False) -> None:
+    """
+    Подключить обработчик do_orm_execute ко всем сессиям
+    raise_on_lazy_load=True — бросать LazyLoadError вместо предупреждения
+    """
+    global _installed
+    if _installed:
+        return
+
+    @event.listens_for(Session, "do_orm_execute")
+    def _on_orm_execute(orm_execute_state: ORMExecuteState) -> None:
+        # selectinload/joinedload выполняются как обычные запросы, lazy_loaded_from
+        # заполнен только для ленивой загрузки связи с конкретного объекта
+        parent_state = orm_execute_state.lazy_loaded_from
+        if parent_state is None:
+            return
+
+        message = (
+            f"Lazy load from {parent_state.class_.__name__} "
+            f"(identity {parent_state.identity}): possible N+1 query"
+        )
+        if raise_on_lazy_load:
+            raise LazyLoadError(message)
+        logger.warning(message, stack_info=True)
+
+    _installed = True
+    logger.info("Lazy load detector installed (raise=%s)", raise_on_lazy_load)
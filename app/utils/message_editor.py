@@ -29,10 +29,24 @@ async def update_message(
         chat_id = msg.chat.id
         message = msg
 
+    # Callback может прийти с InaccessibleMessage (старое сообщение) без photo/text/caption,
+    # поэтому поля читаются через getattr один раз
+    has_photo = bool(getattr(message, 'photo', None))
+
+    # Повторное нажатие той же кнопки: текст и клавиатура не меняются - запрос к Telegram не нужен.
+    # html_text восстанавливает HTML-разметку из entities текста или подписи
+    if text and not media and not has_photo:
+        if ((getattr(message, 'text', None) or getattr(message, 'caption', None))
+                and message.html_text == text and message.reply_markup == reply_markup):
+            return
+    elif reply_markup and not text and not media:
+        if getattr(message, 'reply_markup', None) == reply_markup:
+            return
+
     try:
         if media:
             # Если сообщение содержит media (например, фото)
-            if hasattr(message, 'photo') and message.photo:
+            if has_photo:
                 await message.edit_media(media=media, reply_markup=reply_markup)
             else:
                 # Нельзя редактировать media в текстовом сообщении — удаляем и отправляем заново
@@ -46,7 +60,7 @@ async def update_message(
                 )
         elif text:
             # Если текущее сообщение содержит фото, а мы хотим показать только текст
-            if hasattr(message, 'photo') and message.photo:
+            if has_photo:
                 await message.delete()
                 await bot.send_message(
                     chat_id=chat_id,
@@ -54,9 +68,9 @@ async def update_message(
                     parse_mode="HTML",
                     reply_markup=reply_markup
                 )
-            elif hasattr(message, 'text') and message.text:
+            elif getattr(message, 'text', None):
                 await message.edit_text(text=text, parse_mode="HTML", reply_markup=reply_markup)
-            elif hasattr(message, 'caption') and message.caption:
+            elif getattr(message, 'caption', None):
                 await message.edit_caption(caption=text, parse_mode="HTML", reply_markup=reply_markup)
             else:
                 await message.delete()
@@ -1,6 +1,10 @@
 import asyncio
 import logging
-from typing import Optional, Union, Dict, Any
+import random
+import ssl
+from collections import defaultdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar, Union
+import aiogram
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, Message
 from aiogram.exceptions import (
@@ -13,10 +17,49 @@ from aiogram.exceptions import (
 )
 from aiogram.client.session.aiohttp import AiohttpSession
 import aiohttp
-from app.config import Config
+import certifi
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiolimiter import AsyncLimiter
+from app.config import Config, get_config
+from app.utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+# Временные сбои, после которых запрос повторяется с backoff
+_RETRYABLE_ERRORS = (TelegramNetworkError, TelegramServerError)
+
+# Фрагменты описаний BadRequest при редактировании (в нижнем регистре)
+_NOT_MODIFIED = "message is not modified"
+_NOT_FOUND = "message to edit not found"
+
+# Лимиты Bot API действуют на весь процесс, а клиент создается на каждый сервис уведомлений,
+# поэтому ограничители скорости хранятся на уровне модуля
+_global_limiter: Optional[AsyncLimiter] = None
+# Групповые чаты: не больше одного сообщения в секунду в каждый
+_group_chat_limiters: Dict[int, AsyncLimiter] = defaultdict(lambda: AsyncLimiter(1, 1))
+
+
+# Чаты, заблокировавшие бота: повторные рассылки не тратят на них запрос к API.
+# Запись живет час или до /start от пользователя (unblock_chat)
+_blocked_chats = TTLCache(ttl_seconds=60 * 60)
+
+
+def unblock_chat(chat_id: Union[int, str]) -> None:
+    """Снять отметку о блокировке бота (пользователь снова написал боту)"""
+    _blocked_chats.delete(chat_id)
+
+
+def _get_global_limiter(rate: int) -> AsyncLimiter:
+    """Общий ограничитель сообщений в секунду (создается при первом обращении)"""
+    global _global_limiter
+    if _global_limiter is None:
+        _global_limiter = AsyncLimiter(rate, 1)
+    return _global_limiter
+
+
 class SafeTelegramClient:
     """Безопасный клиент для работы с Telegram API с обработкой сетевых ошибок"""
     
@@ -25,7 +68,51 @@ class SafeTelegramClient:
         self.config = config
         self.retry_count = config.TELEGRAM_RETRY_COUNT
         self.retry_delay = config.TELEGRAM_RETRY_DELAY
+        self.retry_max_delay = config.TELEGRAM_RETRY_MAX_DELAY
+        self.retry_jitter = config.TELEGRAM_RETRY_JITTER
         self.timeout = config.TELEGRAM_TIMEOUT
+        self.global_limiter = _get_global_limiter(config.TELEGRAM_GLOBAL_RPS)
+        # chat_id -> время event loop, до которого Telegram просил не писать в чат (RetryAfter)
+        self._cooldown: Dict[Union[int, str], float] = {}
+    
+    def _backoff(self, attempt: int) -> float:
+        """
+        Экспоненциальная задержка перед повтором с джиттером и потолком
+        Случайная добавка разводит повторы одновременных запросов, чтобы они не били в Telegram разом
+        """
+        delay = self.retry_delay * (2 ** attempt) * (1 + random.random() * self.retry_jitter)
+        return min(self.retry_max_delay, delay)
+    
+    async def _call_with_retry(self, chat_id: Union[int, str], call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Вызов Bot API с единой политикой повторов
+        RetryAfter - пауза для всех запросов в чат, сетевые и серверные ошибки - экспоненциальный backoff.
+        Остальные ошибки и ошибка последней попытки пробрасываются вызывающему
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retry_count + 1):
+            # Чат на паузе после 429 - ждем ее окончания, не отправляя запрос
+            cooldown_until = self._cooldown.get(chat_id)
+            if cooldown_until is not None:
+                now = loop.time()
+                if cooldown_until > now:
+                    await asyncio.sleep(cooldown_until - now)
+                else:
+                    self._cooldown.pop(chat_id, None)
+            
+            try:
+                return await call()
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать; пауза общая для всех запросов в этот чат
+                logger.warning("Rate limited for %s, waiting %s seconds", chat_id, e.retry_after)
+                self._cooldown[chat_id] = loop.time() + e.retry_after
+                if attempt == self.retry_count:
+                    raise
+            except _RETRYABLE_ERRORS as e:
+                logger.warning("%s for %s on attempt %d: %s", type(e).__name__, chat_id, attempt + 1, e)
+                if attempt == self.retry_count:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
     
     async def send_message_safe(
         self,
@@ -43,114 +130,109 @@ class SafeTelegramClient:
             tuple[bool, Optional[Message], Optional[str]]: (success, message, error_description)
         """
         
-        for attempt in range(self.retry_count + 1):
-            try:
-                message = await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode,
-                    disable_notification=disable_notification,
-                    **kwargs
-                )
-                
-                logger.info(f"Message sent successfully to {chat_id} on attempt {attempt + 1}")
-                return True, message, None
-                
-            except TelegramRetryAfter as e:
-                # Telegram просит подождать
-                retry_after = e.retry_after
-                logger.warning(f"Rate limited for {chat_id}, waiting {retry_after} seconds")
-                
-                if attempt < self.retry_count:
-                    await asyncio.sleep(retry_after)
-                    continue
-                else:
-                    return False, None, f"Rate limited: {retry_after}s"
-                    
-            except TelegramNetworkError as e:
-                # Сетевая ошибка - повторяем попытку
-                logger.warning(f"Network error for {chat_id} on attempt {attempt + 1}: {e}")
-                
-                if attempt < self.retry_count:
-                    await asyncio.sleep(self.retry_delay * (attempt + 1))  # Экспоненциальная задержка
-                    continue
-                else:
-                    return False, None, f"Network error: {str(e)}"
-                    
-            except TelegramServerError as e:
-                # Ошибка сервера Telegram - повторяем попытку
-                logger.warning(f"Server error for {chat_id} on attempt {attempt + 1}: {e}")
-                
-                if attempt < self.retry_count:
-                    await asyncio.sleep(self.retry_delay * (attempt + 1))
-                    continue
-                else:
-                    return False, None, f"Server error: {str(e)}"
-                    
-            except TelegramUnauthorizedError as e:
-                # Бот заблокирован - не повторяем
-                logger.error(f"Bot unauthorized for {chat_id}: {e}")
-                return False, None, f"Unauthorized: {str(e)}"
-                
-            except TelegramForbiddenError as e:
-                # Бот заблокирован пользователем - не повторяем
-                logger.warning(f"Bot blocked by user {chat_id}: {e}")
-                return False, None, f"Blocked by user: {str(e)}"
-                
-            except TelegramBadRequest as e:
-                # Неправильный запрос - не повторяем
-                logger.error(f"Bad request for {chat_id}: {e}")
-                return False, None, f"Bad request: {str(e)}"
-                
-            except Exception as e:
-                # Прочие ошибки
-                logger.error(f"Unexpected error for {chat_id} on attempt {attempt + 1}: {e}")
-                
-                if attempt < self.retry_count:
-                    await asyncio.sleep(self.retry_delay * (attempt + 1))
-                    continue
-                else:
-                    return False, None, f"Unexpected error: {str(e)}"
+        if _blocked_chats.get(chat_id):
+            return False, None, "Blocked by user (cached)"
         
-        return False, None, "Max retry count exceeded"
+        try:
+            message = await self._call_with_retry(chat_id, lambda: self.bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode,
+                disable_notification=disable_notification,
+                **kwargs
+            ))
+            
+        except TelegramRetryAfter as e:
+            return False, None, f"Rate limited: {e.retry_after}s"
+            
+        except TelegramNetworkError as e:
+            return False, None, f"Network error: {str(e)}"
+            
+        except TelegramServerError as e:
+            return False, None, f"Server error: {str(e)}"
+            
+        except TelegramUnauthorizedError as e:
+            # Бот заблокирован - не повторяем
+            logger.error("Bot unauthorized for %s: %s", chat_id, e)
+            return False, None, f"Unauthorized: {str(e)}"
+            
+        except TelegramForbiddenError as e:
+            # Бот заблокирован пользователем - не повторяем
+            logger.warning("Bot blocked by user %s: %s", chat_id, e)
+            _blocked_chats.set(chat_id, True)
+            return False, None, f"Blocked by user: {str(e)}"
+            
+        except TelegramBadRequest as e:
+            # Неправильный запрос - не повторяем
+            logger.error("Bad request for %s: %s", chat_id, e)
+            return False, None, f"Bad request: {str(e)}"
+            
+        except Exception as e:
+            # Прочие ошибки
+            logger.error("Unexpected error for %s: %s", chat_id, e)
+            return False, None, f"Unexpected error: {str(e)}"
+        
+        logger.info("Message sent successfully to %s", chat_id)
+        return True, message, None
     
-    async def send_messages_batch(
+    async def send_messages_iter(
         self,
         messages: list[Dict[str, Any]],
         max_concurrent: int = 5
-    ) -> Dict[Union[int, str], tuple[bool, Optional[str]]]:
+    ) -> AsyncIterator[tuple[Union[int, str], bool, Optional[str]]]:
         """
-        Отправка сообщений пачками с ограничением на количество одновременных запросов
+        Отправка сообщений пачками с выдачей результатов по мере готовности
+        Скорость ограничивается token bucket (TELEGRAM_GLOBAL_RPS на процесс и 1/с на групповой чат),
+        semaphore ограничивает только число одновременных запросов
         
         Args:
             messages: Список словарей с параметрами для send_message_safe
             max_concurrent: Максимальное количество одновременных запросов
             
-        Returns:
-            Dict[chat_id, (success, error_description)]
+        Yields:
+            (chat_id, success, error_description) в порядке завершения отправки
         """
         
         semaphore = asyncio.Semaphore(max_concurrent)
-        results = {}
         
         async def send_single(message_data: Dict[str, Any]):
-            async with semaphore:
-                chat_id = message_data.get('chat_id')
-                
-                success, msg, error = await self.send_message_safe(**message_data)
-                results[chat_id] = (success, error)
-                
-                # Небольшая задержка между запросами для предотвращения rate limiting
-                await asyncio.sleep(0.1)
-        
-        # Создаем задачи для всех сообщений
-        tasks = [send_single(msg_data) for msg_data in messages]
-        
-        # Выполняем все задачи
-        await asyncio.gather(*tasks, return_exceptions=True)
+            chat_id = message_data.get('chat_id')
+            
+            # Ограничитель оборачивает каждую отправку, а не весь цикл
+            if isinstance(chat_id, int) and chat_id < 0:
+                await _group_chat_limiters[chat_id].acquire()
+            async with self.global_limiter, semaphore:
+                try:
+                    success, msg, error = await self.send_message_safe(**message_data)
+                except Exception as e:
+                    success, error = False, f"Unexpected error: {str(e)}"
+            return chat_id, success, error
         
-        return results
+        tasks = [asyncio.ensure_future(send_single(msg_data)) for msg_data in messages]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Потребитель прервал итерацию - оставшиеся отправки отменяются
+            for task in tasks:
+                task.cancel()
+    
+    async def send_messages_batch(
+        self,
+        messages: list[Dict[str, Any]],
+        max_concurrent: int = 5
+    ) -> Dict[Union[int, str], tuple[bool, Optional[str]]]:
+        """
+        Отправка сообщений пачками (см. send_messages_iter)
+            
+        Returns:
+            Dict[chat_id, (success, error_description)]
+        """
+        return {
+            chat_id: (success, error)
+            async for chat_id, success, error in self.send_messages_iter(messages, max_concurrent)
+        }
     
     async def edit_message_safe(
         self,
@@ -167,50 +249,107 @@ class SafeTelegramClient:
             tuple[bool, Optional[str]]: (success, error_description)
         """
         
-        for attempt in range(self.retry_count + 1):
-            try:
-                await self.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode
-                )
-                
-                logger.info(f"Message edited successfully in {chat_id}")
+        try:
+            await self._call_with_retry(chat_id, lambda: self.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode
+            ))
+            
+        except TelegramBadRequest as e:
+            error_text = (e.message or "").lower()
+            if _NOT_MODIFIED in error_text:
+                # Сообщение не изменилось - это не ошибка
                 return True, None
+            elif _NOT_FOUND in error_text:
+                # Сообщение не найдено - не повторяем
+                return False, f"Message not found: {str(e)}"
+            else:
+                logger.error("Bad request editing message in %s: %s", chat_id, e)
+                return False, f"Bad request: {str(e)}"
                 
-            except TelegramBadRequest as e:
-                if "message is not modified" in str(e).lower():
-                    # Сообщение не изменилось - это не ошибка
-                    return True, None
-                elif "message to edit not found" in str(e).lower():
-                    # Сообщение не найдено - не повторяем
-                    return False, f"Message not found: {str(e)}"
-                else:
-                    logger.error(f"Bad request editing message in {chat_id}: {e}")
-                    return False, f"Bad request: {str(e)}"
-                    
-            except (TelegramNetworkError, TelegramServerError) as e:
-                logger.warning(f"Network/Server error editing message in {chat_id} on attempt {attempt + 1}: {e}")
+        except TelegramRetryAfter as e:
+            return False, f"Rate limited: {e.retry_after}s"
                 
-                if attempt < self.retry_count:
-                    await asyncio.sleep(self.retry_delay * (attempt + 1))
-                    continue
-                else:
-                    return False, f"Network/Server error: {str(e)}"
-                    
-            except Exception as e:
-                logger.error(f"Unexpected error editing message in {chat_id}: {e}")
-                return False, f"Unexpected error: {str(e)}"
+        except _RETRYABLE_ERRORS as e:
+            return False, f"Network/Server error: {str(e)}"
+                
+        except Exception as e:
+            logger.error("Unexpected error editing message in %s: %s", chat_id, e)
+            return False, f"Unexpected error: {str(e)}"
         
-        return False, "Max retry count exceeded"
+        logger.info("Message edited successfully in %s", chat_id)
+        return True, None
+
+
+def create_safe_telegram_client(bot: Bot, config: Optional[Config] = None) -> SafeTelegramClient:
+    """
+    Безопасный Telegram клиент для бота
+    Бот (и его HTTP-сессия) в процессе один, поэтому клиент создается один раз
+    и запоминается на экземпляре Bot; сервисы уведомлений получают его отсюда
+    """
+    client = getattr(bot, '_safe_client', None)
+    if client is None:
+        client = SafeTelegramClient(bot, config or get_config())
+        bot._safe_client = client
+    return client
 
 
-def create_safe_telegram_client(bot: Bot, config: Config) -> SafeTelegramClient:
-    """Фабричная функция для создания безопасного Telegram клиента"""
-    return SafeTelegramClient(bot, config)
+class PooledAiohttpSession(AiohttpSession):
+    """
+    AiohttpSession с собственным TCPConnector: лимит на хост, keep-alive и кэш DNS
+    Публичный конструктор AiohttpSession настраивает только общий limit, поэтому
+    HTTP-сессия создается здесь, в переопределенном create_session.
+    Прокси не поддерживается: бот ходит в api.telegram.org напрямую
+    """
+    
+    def __init__(
+        self,
+        limit: int,
+        limit_per_host: int,
+        keepalive_timeout: float,
+        ttl_dns_cache: int = 300,
+        **kwargs: Any
+    ):
+        super().__init__(limit=limit, **kwargs)
+        self.connector_options = {
+            'limit': limit,
+            'limit_per_host': limit_per_host,
+            'keepalive_timeout': keepalive_timeout,
+            'ttl_dns_cache': ttl_dns_cache,
+        }
+        self._pooled_session: Optional[aiohttp.ClientSession] = None
+    
+    async def create_session(self) -> aiohttp.ClientSession:
+        if self._pooled_session is None or self._pooled_session.closed:
+            connector = aiohttp.TCPConnector(
+                **self.connector_options,
+                # Тот же набор корневых сертификатов, что использует aiogram
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+            )
+            self._pooled_session = aiohttp.ClientSession(
+                connector=connector,
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram.__version__}"},
+            )
+        return self._pooled_session
+    
+    async def close(self) -> None:
+        if self._pooled_session is not None and not self._pooled_session.closed:
+            await self._pooled_session.close()
+        await super().close()
 
 
-# Функция create_aiohttp_session удалена, так как AiohttpSession 
-# от aiogram имеет ограниченные возможности настройки 
\ No newline at end of file
+def create_bot_session(config: Config) -> PooledAiohttpSession:
+    """
+    HTTP-сессия бота с настроенным пулом соединений
+    Одна сессия на весь процесс: TLS-рукопожатие с api.telegram.org переиспользуется
+    между запросами, DNS кэшируется
+    """
+    return PooledAiohttpSession(
+        limit=config.AIOHTTP_POOL_SIZE,
+        limit_per_host=config.AIOHTTP_LIMIT_PER_HOST,
+        keepalive_timeout=config.AIOHTTP_KEEPALIVE_TIMEOUT,
+        timeout=config.AIOHTTP_TIMEOUT,
+    )
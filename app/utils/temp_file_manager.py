@@ -1,20 +1,37 @@
+import asyncio
+import heapq
 import os
-import uuid
+import secrets
 import time
-import threading
 import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+
+def _remove_if_exists(file_path: str) -> bool:
+    """Удалить файл; False - если его уже нет (без отдельной проверки os.path.exists)"""
+    try:
+        os.remove(file_path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
 class TempFileManager:
-    """Менеджер временных файлов с короткими идентификаторами для callback_data"""
+    """
+    Менеджер временных файлов с короткими идентификаторами для callback_data
+    Все методы вызываются из event loop, поэтому блокировки не нужны.
+    Истекшие файлы удаляет фоновая задача run(): она спит до ближайшего срока из кучи.
+    Экземпляр создается в main() и передается в обработчики через workflow data диспетчера
+    """
     
     def __init__(self):
         self._files: Dict[str, Dict] = {}
-        self._cleanup_thread = None
-        self._lock = threading.Lock()
-        self._start_cleanup_thread()
+        # (срок, file_id) - записи удаленных раньше срока файлов пропускаются при извлечении
+        self._heap: List[Tuple[float, str]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
     
     def store_file(self, file_path: str, ttl_minutes: int = 30) -> str:
         """
@@ -27,20 +44,26 @@ class TempFileManager:
         Returns:
             str: Короткий идентификатор для callback_data
         """
-        file_id = str(uuid.uuid4())[:8]  # 8 символов достаточно
+        # 6 случайных байт = 8 символов base64url (2^48 вариантов), сразу из os.urandom
+        file_id = secrets.token_urlsafe(6)
+        while file_id in self._files:
+            file_id = secrets.token_urlsafe(6)
         expiry_time = time.time() + (ttl_minutes * 60)
         
-        with self._lock:
-            self._files[file_id] = {
-                'path': file_path,
-                'expiry': expiry_time,
-                'created': time.time()
-            }
+        self._files[file_id] = {
+            'path': file_path,
+            'expiry': expiry_time,
+            'created': time.time()
+        }
+        heapq.heappush(self._heap, (expiry_time, file_id))
+        # Новый срок раньше ожидаемого - будим задачу очистки, чтобы она пересчитала таймаут
+        if self._wake is not None and self._heap[0][1] == file_id:
+            self._wake.set()
         
-        logger.info(f"Stored temporary file: {file_id} -> {file_path}")
+        logger.info("Stored temporary file: %s -> %s", file_id, file_path)
         return file_id
     
-    def get_file_path(self, file_id: str) -> Optional[str]:
+    async def get_file_path(self, file_id: str) -> Optional[str]:
         """
         Получает путь к файлу по идентификатору
         
@@ -50,21 +73,20 @@ class TempFileManager:
         Returns:
             Optional[str]: Путь к файлу или None если не найден/истек
         """
-        with self._lock:
-            file_info = self._files.get(file_id)
-            
-            if not file_info:
-                return None
-            
-            # Проверяем срок действия
-            if time.time() > file_info['expiry']:
-                # Удаляем файл и запись
-                self._cleanup_file(file_id, file_info)
-                return None
-            
-            return file_info['path']
+        file_info = self._files.get(file_id)
+        
+        if not file_info:
+            return None
+        
+        # Проверяем срок действия
+        if time.time() > file_info['expiry']:
+            # Удаляем файл и запись
+            await self._cleanup_file(file_id, file_info)
+            return None
+        
+        return file_info['path']
     
-    def remove_file(self, file_id: str) -> bool:
+    async def remove_file(self, file_id: str) -> bool:
         """
         Удаляет файл и его запись
         
@@ -74,56 +96,70 @@ class TempFileManager:
         Returns:
             bool: True если файл был удален
         """
-        with self._lock:
-            file_info = self._files.get(file_id)
-            if file_info:
-                self._cleanup_file(file_id, file_info)
-                return True
-            return False
+        file_info = self._files.get(file_id)
+        if file_info:
+            await self._cleanup_file(file_id, file_info)
+            return True
+        return False
     
-    def _cleanup_file(self, file_id: str, file_info: Dict):
-        """Очищает файл и его запись (должен вызываться под блокировкой)"""
+    async def _cleanup_file(self, file_id: str, file_info: Dict):
+        """Очищает файл и его запись; удаление файла выполняется в потоке, не блокируя event loop"""
+        # Запись убирается сразу, чтобы параллельный вызов не удалял файл повторно
+        self._files.pop(file_id, None)
+        file_path = file_info['path']
         try:
-            file_path = file_info['path']
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Removed temporary file: {file_path}")
+            if await asyncio.to_thread(_remove_if_exists, file_path):
+                logger.info("Removed temporary file: %s", file_path)
         except Exception as e:
-            logger.error(f"Error removing file {file_info['path']}: {e}")
-        finally:
-            self._files.pop(file_id, None)
+            logger.error("Error removing file %s: %s", file_path, e)
     
-    def _start_cleanup_thread(self):
-        """Запускает фоновый поток для очистки истекших файлов"""
-        def cleanup_worker():
-            while True:
-                try:
-                    time.sleep(300)  # Проверяем каждые 5 минут
-                    self._cleanup_expired_files()
-                except Exception as e:
-                    logger.error(f"Error in cleanup worker: {e}")
-        
-        self._cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-        self._cleanup_thread.start()
-        logger.info("Started temp file cleanup thread")
+    def start(self):
+        """Запустить фоновую очистку истекших файлов (вызывается из работающего event loop)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+            logger.info("Started temp file cleanup task")
+    
+    async def aclose(self):
+        """Остановить фоновую очистку и дождаться завершения задачи"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
     
-    def _cleanup_expired_files(self):
-        """Очищает истекшие файлы"""
+    async def run(self):
+        """Удалять файлы точно в срок: ожидание до ближайшего истечения или до нового файла"""
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                timeout = self._heap[0][0] - time.time() if self._heap else None
+                if timeout is None or timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wake.clear()
+                await self._cleanup_expired_files()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in cleanup task: %s", e)
+    
+    async def _cleanup_expired_files(self):
+        """Очищает истекшие файлы (извлекает из кучи только записи с наступившим сроком)"""
         current_time = time.time()
-        expired_files = []
-        
-        with self._lock:
-            for file_id, file_info in list(self._files.items()):
-                if current_time > file_info['expiry']:
-                    expired_files.append((file_id, file_info))
+        cleaned = 0
         
-        for file_id, file_info in expired_files:
-            with self._lock:
-                if file_id in self._files:  # Двойная проверка
-                    self._cleanup_file(file_id, file_info)
+        while self._heap and self._heap[0][0] <= current_time:
+            expiry_time, file_id = heapq.heappop(self._heap)
+            file_info = self._files.get(file_id)
+            # Файл уже удален вручную или по истечении при обращении
+            if file_info is None or file_info['expiry'] != expiry_time:
+                continue
+            await self._cleanup_file(file_id, file_info)
+            cleaned += 1
         
-        if expired_files:
-            logger.info(f"Cleaned up {len(expired_files)} expired temporary files")
-
-# Глобальный экземпляр менеджера
-temp_file_manager = TempFileManager() 
\ No newline at end of file
+        if cleaned:
+            logger.info("Cleaned up %d expired temporary files", cleaned)
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """Простой in-process кэш с временем жизни записей"""
+
+    def __init__(self, ttl_seconds: float, maxsize: int = 10000):
+        """
+        Args:
+            ttl_seconds: Время жизни записи в секундах
+            maxsize: Максимальное количество записей (при переполнении кэш очищается)
+        """
+        self.ttl = ttl_seconds
+        self.maxsize = maxsize
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        # Счётчик сбросов: загрузка, во время которой был delete/clear, не сохраняется
+        self._generation = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Получить значение или default, если записи нет или она устарела"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if time.monotonic() >= expires_at:
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        """Сохранить значение"""
+        if len(self._data) >= self.maxsize and key not in self._data:
+            self._data.clear()
+        ttl = self.ttl if ttl_seconds is None else ttl_seconds
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Получить значение, при промахе загрузить через loader
+        Одновременные промахи по одному ключу ждут одну загрузку (без лавины запросов в БД).
+        None не кэшируется, как и значение, загрузка которого пересеклась со сбросом кэша
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        # Замок удаляется, только когда его больше никто не ждёт: иначе следующий
+        # вызов создал бы новый замок и повторил загрузку параллельно ожидающим
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                value = self.get(key)
+                if value is None:
+                    generation = self._generation
+                    value = await loader()
+                    if value is not None and generation == self._generation:
+                        self.set(key, value)
+                return value
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    def delete(self, key: Hashable) -> None:
+        """Удалить запись"""
+        self._generation += 1
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Очистить кэш"""
+        self._generation += 1
+        self._data.clear()
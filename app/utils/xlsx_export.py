@@ -0,0 +1,65 @@
+"""
+Потоковая запись XLSX через xlsxwriter
+constant_memory: каждая строка сбрасывается во временный файл сразу после записи,
+поэтому строки листа пишутся строго по порядку
+"""
+import re
+from io import BytesIO
+from typing import Any, BinaryIO, Iterable, Optional, Sequence, Set, Union
+
+import xlsxwriter
+
+# Символы, запрещенные Excel в названии листа
+_INVALID_SHEET_CHARS_RE = re.compile(r'[\[\]:*?/\\]')
+_MAX_SHEET_TITLE = 31
+
+
+class XlsxExport:
+    """Книга Excel с заранее созданными форматами: жирный заголовок и заливки пустых полей"""
+
+    def __init__(self, output: Optional[Union[str, BinaryIO]] = None):
+        """
+        Args:
+            output: Путь к файлу или файловый объект; по умолчанию - BytesIO в памяти
+        """
+        self.output = output if output is not None else BytesIO()
+        self.workbook = xlsxwriter.Workbook(self.output, {'constant_memory': True})
+        # Форматы создаются один раз на книгу
+        self.header_format = self.workbook.add_format({'bold': True})
+        self.missing_required_format = self.workbook.add_format({'bg_color': '#FFCCCC', 'pattern': 1})
+        self.missing_optional_format = self.workbook.add_format({'bg_color': '#FFFFCC', 'pattern': 1})
+        # Дата и время пишутся числом Excel с форматом ячейки, без строкового форматирования в Python
+        self.datetime_format = self.workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+        self._titles: Set[str] = set()
+
+    def add_sheet(self, title: str, columns: Sequence[str]):
+        """Новый лист со строкой заголовка; данные начинаются со строки 1"""
+        worksheet = self.workbook.add_worksheet(self._unique_title(title))
+        worksheet.write_row(0, 0, columns, self.header_format)
+        return worksheet
+
+    def add_table(self, title: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]):
+        """Лист из заголовка и строк-кортежей в порядке columns"""
+        worksheet = self.add_sheet(title, columns)
+        for row_index, row in enumerate(rows, start=1):
+            worksheet.write_row(row_index, 0, row)
+        return worksheet
+
+    def close(self) -> Union[str, BinaryIO]:
+        """Завершить книгу и вернуть output (файловый объект - перемотанным к началу)"""
+        self.workbook.close()
+        if not isinstance(self.output, str):
+            self.output.seek(0)
+        return self.output
+
+    def _unique_title(self, title: str) -> str:
+        """Название листа по правилам Excel: до 31 символа, без []:*?/\\, уникальное без учета регистра"""
+        base = _INVALID_SHEET_CHARS_RE.sub('_', title)[:_MAX_SHEET_TITLE]
+        candidate = base
+        counter = 1
+        while candidate.lower() in self._titles:
+            suffix = f" ({counter})"
+            candidate = base[:_MAX_SHEET_TITLE - len(suffix)] + suffix
+            counter += 1
+        self._titles.add(candidate.lower())
+        return candidate
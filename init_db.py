@@ -1,12 +1,13 @@
 import asyncio
-import json
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from app.models.models import Base, Product
-from app.config import Config
+from app.config import get_config
+from app.database import create_missing_tables
 
 async def init_db():
     """Инициализация базы данных"""
-    config = Config()
+    config = get_config()
     
     # Создаем движок базы данных
     engine = create_async_engine(
@@ -14,9 +15,9 @@ async def init_db():
         echo=False
     )
     
-    # Создаем все таблицы
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # Создаем недостающие таблицы
+    if not config.DB_SKIP_CREATE_ALL:
+        await create_missing_tables(engine, Base.metadata)
     
     # Создаем фабрику сессий
     async_session = async_sessionmaker(engine, expire_on_commit=False)
@@ -24,8 +25,7 @@ async def init_db():
     # Добавляем тестовые товары
     async with async_session() as session:
         # Проверяем, есть ли уже товары
-        products = await session.execute("SELECT COUNT(*) FROM products")
-        count = products.scalar()
+        count = await session.scalar(select(func.count()).select_from(Product))
         
         if count == 0:
             # Худи
@@ -35,7 +35,7 @@ async def init_db():
                 price=2500.0,
                 image_url="https://example.com/hoodie.jpg",
                 is_available=True,
-                size_quantities=json.dumps({"S": 5, "M": 10, "L": 8, "XL": 6}),
+                size_quantities={"S": 5, "M": 10, "L": 8, "XL": 6},
                 color="Черный"
             )
             session.add(hoodie)
@@ -47,7 +47,7 @@ async def init_db():
                 price=2000.0,
                 image_url="https://example.com/sweatshirt.jpg",
                 is_available=True,
-                size_quantities=json.dumps({"S": 3, "M": 7, "L": 5, "XL": 4}),
+                size_quantities={"S": 3, "M": 7, "L": 5, "XL": 4},
                 color="Серый"
             )
             session.add(sweatshirt)
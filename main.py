@@ -1,21 +1,28 @@
 import asyncio
+import atexit
 import logging
 import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
 from typing import NoReturn
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession, AsyncEngine
 from contextlib import asynccontextmanager
 from aiogram3_di import setup_di
 
-from app.config import Config
+from app.config import Config, get_config
+from app.database import create_missing_tables, get_async_engine, get_session_factory, is_memory_sqlite
 from app.middlewares.database import DatabaseMiddleware, set_database_middleware
 from app.middlewares.group_membership import GroupMembershipMiddleware
 from app.scheduler import setup_scheduler, shutdown_scheduler
-# Импорт create_aiohttp_session удален из-за проблем совместимости
+from app.utils.telegram_client import create_bot_session
+from app.utils.temp_file_manager import TempFileManager
+from app.utils.event_loop import install_event_loop_policy
 from app.catalog.catalog_router import router as catalog_router
 from app.handlers.main_menu import router as main_menu_router
 from app.handlers.simple_admin import router as admin_router
@@ -29,37 +36,83 @@ from app.handlers.events_management import router as events_management_router
 from app.orders.main_router import orders_router
 from app.models.models import Base
 from app.filters.chat_type import PrivateChatOnly
+from app.utils.lazy_load_detector import install_lazy_load_detector
 
 logger = logging.getLogger(__name__)
 
+class RawQueueHandler(QueueHandler):
+    """
+    QueueHandler, который кладет запись в очередь без форматирования
+    Стандартный prepare() подставляет args в сообщение и рендерит трейсбек в вызывающем потоке;
+    здесь это делают обработчики QueueListener. Очередь in-process, поэтому запись не нужно
+    готовить к сериализации. В args стоит передавать значения, а не ORM-объекты:
+    они будут прочитаны позже и из другого потока
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
 def setup_logging() -> None:
-    """Настройка логирования"""
+    """
+    Настройка логирования
+    Форматирование и запись в файл и консоль выполняет QueueListener в отдельном потоке:
+    event loop только кладет сырые записи в очередь и не ждет диска
+    """
     os.makedirs('logs', exist_ok=True)
     
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [
+        logging.FileHandler('logs/bot.log'),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Дописываем оставшиеся в очереди записи при завершении процесса
+    atexit.register(listener.stop)
+    
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/bot.log'),
-            logging.StreamHandler()
-        ]
+        handlers=[RawQueueHandler(log_queue)]
     )
 
-async def setup_database(config: Config) -> tuple[async_sessionmaker[AsyncSession], create_async_engine]:
+async def warm_up_pool(engine: AsyncEngine, connections: int) -> None:
+    """Заранее открыть соединения пула, чтобы первые запросы не ждали подключения"""
+    if connections <= 0:
+        return
+    
+    async def _ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    
+    # Каждая задача берёт собственное соединение из пула, поэтому параллельный запуск безопасен
+    await asyncio.gather(*(_ping() for _ in range(connections)))
+    logger.info(f"Database pool warmed up: {connections} connections")
+
+async def setup_database(config: Config) -> tuple[async_sessionmaker[AsyncSession], AsyncEngine]:
     """Настройка базы данных"""
     try:
-        engine = create_async_engine(
-            config.DATABASE_URL,
-            echo=False,
-            pool_pre_ping=True  # Проверка соединения перед использованием
-        )
+        # Вне продакшена сообщаем о каждой ленивой загрузке связи (потенциальный N+1)
+        if config.ENVIRONMENT != "production":
+            install_lazy_load_detector(raise_on_lazy_load=config.DB_LAZY_LOAD_RAISE)
+        
+        # Общий движок процесса - тот же пул, что у сервисов и скриптов, импортирующих app.database
+        engine = get_async_engine()
         
-        # Создаем таблицы в базе данных
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+        # Создаем недостающие таблицы в базе данных
+        if not config.DB_SKIP_CREATE_ALL:
+            created = await create_missing_tables(engine, Base.metadata)
+            if created:
+                logger.info(f"Created {created} missing database tables")
         
-        # Создаем фабрику сессий
-        async_session = async_sessionmaker(engine, expire_on_commit=False)
+        if not is_memory_sqlite(config.DATABASE_URL):
+            await warm_up_pool(engine, min(config.DB_POOL_WARMUP, config.DB_POOL_SIZE))
+        
+        # Фабрика сессий поверх того же движка
+        async_session = get_session_factory()
         
         return async_session, engine
     except Exception as e:
@@ -82,16 +135,15 @@ def setup_routers(dp: Dispatcher) -> None:
         main_menu_router,  # Главное меню ПОСЛЕДНИМ - чтобы заглушки не перехватывали события
     ]
     
-    # ИСПРАВЛЕНО: Добавляем фильтр для работы только в личных чатах
+    # Работаем только в личных чатах: фильтр на уровне диспетчера проверяется
+    # один раз до обхода вложенных роутеров
     private_chat_filter = PrivateChatOnly()
+    dp.message.filter(private_chat_filter)
+    dp.callback_query.filter(private_chat_filter)
     
     for router in routers:
-        # Применяем фильтр ко всем обработчикам роутера
-        router.message.filter(private_chat_filter)
-        router.callback_query.filter(private_chat_filter)
-        
         dp.include_router(router)
-        logger.info(f"✅ Router registered with private chat filter: {router.name}")
+        logger.info(f"✅ Router registered: {router.name}")
 
 def setup_middlewares(dp: Dispatcher, async_session: async_sessionmaker, config: Config, bot: Bot) -> None:
     """Настройка middleware"""
@@ -109,7 +161,7 @@ def setup_middlewares(dp: Dispatcher, async_session: async_sessionmaker, config:
     dp.callback_query.middleware(database_middleware)
     dp.callback_query.middleware(GroupMembershipMiddleware(config.GROUP_ID))
 
-async def cleanup(bot: Bot, engine: create_async_engine) -> None:
+async def cleanup(bot: Bot, engine: AsyncEngine) -> None:
     """Очистка ресурсов при завершении"""
     try:
         logger.info("Stopping scheduler...")
@@ -132,7 +184,7 @@ async def main() -> NoReturn:
         logger.info("Starting bot...")
         
         # Загружаем конфигурацию
-        config = Config()
+        config = get_config()
         
         # Проверяем наличие необходимых переменных окружения
         if not config.BOT_TOKEN:
@@ -147,8 +199,10 @@ async def main() -> NoReturn:
         async_session, engine = await setup_database(config)
         
         # Создаем бота и диспетчер с улучшенными настройками
+        # (сессия закрывается в cleanup через bot.session.close())
         bot = Bot(
             token=config.BOT_TOKEN,
+            session=create_bot_session(config),
             default=DefaultBotProperties(parse_mode=ParseMode.HTML)
         )
         storage = MemoryStorage()
@@ -166,6 +220,12 @@ async def main() -> NoReturn:
         # Запускаем планировщик уведомлений
         await setup_scheduler(async_session, bot)
         
+        # Фоновая очистка временных файлов импорта; менеджер доступен обработчикам как temp_file_manager
+        temp_file_manager = TempFileManager()
+        dp["temp_file_manager"] = temp_file_manager
+        temp_file_manager.start()
+        dp.shutdown.register(temp_file_manager.aclose)
+        
         # Запускаем бота
         logger.info(f"🚀 Bot started! Will only respond in PRIVATE chats, not in groups")
         logger.info(f"📊 All routers registered with private chat filter")
@@ -184,6 +244,7 @@ async def main() -> NoReturn:
         sys.exit(1)
 
 if __name__ == "__main__":
+    install_event_loop_policy()
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
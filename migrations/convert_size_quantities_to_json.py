@@ -0,0 +1,49 @@
+"""
+Миграция колонки products.size_quantities из TEXT в JSON
+В PostgreSQL тип колонки меняется на jsonb (строки вида '{"S": 5}' и '10' приводятся к JSON).
+В SQLite JSON хранится текстом, существующие значения читаются без изменений
+"""
+import asyncio
+import os
+import sys
+
+# Добавляем путь к корню проекта
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.config import get_config
+from app.utils.event_loop import install_event_loop_policy
+
+async def convert_size_quantities_to_json():
+    """Переводит products.size_quantities на тип JSON"""
+    config = get_config()
+
+    engine = create_async_engine(config.DATABASE_URL)
+
+    try:
+        if engine.dialect.name != "postgresql":
+            print(f"ℹ️ {engine.dialect.name}: изменение типа колонки не требуется")
+            return
+
+        async with engine.begin() as conn:
+            # Пустые строки в старых данных - это отсутствие остатков
+            await conn.execute(text(
+                "UPDATE products SET size_quantities = NULL WHERE size_quantities = ''"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE products ALTER COLUMN size_quantities TYPE jsonb "
+                "USING size_quantities::jsonb"
+            ))
+
+        print("✅ Колонка products.size_quantities переведена на jsonb")
+
+    except Exception as e:
+        print(f"❌ Ошибка при миграции: {e}")
+        raise
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    install_event_loop_policy()
+    asyncio.run(convert_size_quantities_to_json())
@@ -3,25 +3,32 @@
 Создает таблицы auto_event_settings и admin_notification_preferences
 """
 import asyncio
+import logging
 import os
 import sys
 
 # Добавляем путь к корню проекта
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
 from app.models.models import Base, AutoEventSettings, AdminNotificationPreferences
-from app.config import Config
+from app.config import get_config
+from app.core.base import dialect_insert
+from app.utils.event_loop import install_event_loop_policy
 
 async def create_auto_events_tables():
     """Создаёт таблицы для новой системы автоматических событий"""
-    config = Config()
+    config = get_config()
+    
+    # SQL пишется в лог только по запросу (SQL_DEBUG=1), через логгер sqlalchemy.engine
+    if os.environ.get("SQL_DEBUG"):
+        logging.basicConfig()
+        logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
     
     # Создаём async engine
     engine = create_async_engine(
         config.DATABASE_URL,
-        echo=True
+        echo=False
     )
     
     try:
@@ -32,10 +39,8 @@ async def create_auto_events_tables():
             
         print("✅ Таблицы auto_event_settings и admin_notification_preferences созданы успешно!")
         
-        # Создаём сессию для заполнения начальными данными
-        async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-        
-        async with async_session() as session:
+        # Заполняем начальными данными через Core, без ORM-объектов и unit of work
+        async with engine.begin() as conn:
             # Создаём базовые настройки для автоматических событий
             default_events = [
                 {
@@ -67,14 +72,13 @@ async def create_auto_events_tables():
                 }
             ]
             
-            for event_data in default_events:
-                # Проверяем, нет ли уже такого события
-                existing = await session.get(AutoEventSettings, event_data['event_type'])
-                if not existing:
-                    event = AutoEventSettings(**event_data)
-                    session.add(event)
+            # Один INSERT; уже существующие события пропускаются по уникальному event_type
+            await conn.execute(
+                dialect_insert(conn, AutoEventSettings.__table__)
+                .values(default_events)
+                .on_conflict_do_nothing(index_elements=['event_type'])
+            )
             
-            await session.commit()
             print("✅ Начальные настройки автоматических событий созданы!")
             
     except Exception as e:
@@ -84,4 +88,5 @@ async def create_auto_events_tables():
         await engine.dispose()
 
 if __name__ == "__main__":
+    install_event_loop_policy()
     asyncio.run(create_auto_events_tables()) 
\ No newline at end of file
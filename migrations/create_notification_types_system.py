@@ -10,94 +10,119 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.models.models import Base, NotificationType, StatusTransition, OrderStatus
+from app.core.base import dialect_insert
 from app.database import get_async_engine
-from sqlalchemy import text
+from app.utils.event_loop import install_event_loop_policy
+from sqlalchemy import String, exists, func, literal, select, text, true, union_all
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Типы уведомлений: code, name, description
+NOTIFICATION_TYPES = [
+    ('order_created', 'Заказ создан', 'Уведомление о создании нового заказа'),
+    ('order_taken', 'Заказ взят в работу', 'Уведомление о взятии заказа в работу'),
+    ('order_ready', 'Заказ готов к выдаче', 'Уведомление о готовности заказа к выдаче'),
+    ('order_completed', 'Заказ выполнен', 'Уведомление о выполнении заказа'),
+    ('order_cancelled', 'Заказ отменен', 'Уведомление об отмене заказа'),
+    ('order_cancelled_by_user', 'Заказ отменен пользователем', 'Уведомление об отмене заказа пользователем')
+]
+
+# Параметры INSERT для типов уведомлений, собираются один раз при импорте
+NOTIFICATION_TYPE_ROWS = [
+    {'code': code, 'name': name, 'description': description, 'is_active': True}
+    for code, name, description in NOTIFICATION_TYPES
+]
+
+# Переходы между статусами
+STATUS_TRANSITIONS = [
+    # from_status, to_status, notification_type
+    (None, 'new', 'order_created'),  # Создание заказа
+    ('new', 'processing', 'order_taken'),  # Взятие в работу
+    ('processing', 'ready_for_pickup', 'order_ready'),  # Готов к выдаче
+    ('ready_for_pickup', 'delivered', 'order_completed'),  # Выполнен
+    ('new', 'cancelled', 'order_cancelled'),  # Отменен из нового
+    ('processing', 'cancelled', 'order_cancelled'),  # Отменен из обработки
+    ('new', 'cancelled', 'order_cancelled_by_user'),  # Отменен пользователем
+]
+
 async def create_notification_system():
     """Создать систему типов уведомлений"""
     try:
         engine = get_async_engine()
         
         async with engine.begin() as conn:
-            # Создаем таблицы
-            await conn.run_sync(NotificationType.__table__.create, checkfirst=True)
-            await conn.run_sync(StatusTransition.__table__.create, checkfirst=True)
+            if conn.dialect.name == "postgresql":
+                # Разовая идемпотентная загрузка: не ждем fsync при коммите (только в этой транзакции)
+                await conn.execute(text("SET LOCAL synchronous_commit = OFF"))
             
-            print("✅ Таблицы notification_types и status_transitions созданы успешно!")
-            
-            # Заполняем типы уведомлений
-            notifications_data = [
-                ('order_created', 'Заказ создан', 'Уведомление о создании нового заказа'),
-                ('order_taken', 'Заказ взят в работу', 'Уведомление о взятии заказа в работу'),
-                ('order_ready', 'Заказ готов к выдаче', 'Уведомление о готовности заказа к выдаче'),
-                ('order_completed', 'Заказ выполнен', 'Уведомление о выполнении заказа'),
-                ('order_cancelled', 'Заказ отменен', 'Уведомление об отмене заказа'),
-                ('order_cancelled_by_user', 'Заказ отменен пользователем', 'Уведомление об отмене заказа пользователем')
-            ]
-            
-            # Вставляем типы уведомлений
-            for code, name, description in notifications_data:
-                await conn.execute(
-                    text("""
-                        INSERT INTO notification_types (code, name, description, is_active, created_at)
-                        VALUES (:code, :name, :description, :is_active, CURRENT_TIMESTAMP)
-                        ON CONFLICT (code) DO NOTHING
-                    """),
-                    {
-                        'code': code,
-                        'name': name, 
-                        'description': description,
-                        'is_active': True
-                    }
-                )
+            # Создаем таблицы одним create_all (в порядке зависимостей, только отсутствующие)
+            await conn.run_sync(
+                Base.metadata.create_all,
+                tables=[NotificationType.__table__, StatusTransition.__table__],
+                checkfirst=True
+            )
             
-            print("✅ Типы уведомлений добавлены успешно!")
+            print("✅ Таблицы notification_types и status_transitions созданы успешно!")
             
-            # Создаем переходы между статусами
-            # Сначала получаем ID статусов и типов уведомлений
-            result = await conn.execute(text("SELECT id, code FROM order_statuses"))
-            statuses = {row[1]: row[0] for row in result}
+            # Заполняем типы уведомлений одним многострочным INSERT ... ON CONFLICT DO NOTHING
+            result = await conn.execute(
+                dialect_insert(conn, NotificationType.__table__)
+                .values(NOTIFICATION_TYPE_ROWS)
+                .on_conflict_do_nothing(index_elements=['code'])
+            )
             
-            result = await conn.execute(text("SELECT id, code FROM notification_types"))
-            notifications = {row[1]: row[0] for row in result}
+            print(f"✅ Типы уведомлений добавлены успешно! Новых: {result.rowcount}")
             
-            # Определяем переходы
-            transitions = [
-                # from_status, to_status, notification_type
-                (None, 'new', 'order_created'),  # Создание заказа
-                ('new', 'processing', 'order_taken'),  # Взятие в работу
-                ('processing', 'ready_for_pickup', 'order_ready'),  # Готов к выдаче
-                ('ready_for_pickup', 'delivered', 'order_completed'),  # Выполнен
-                ('new', 'cancelled', 'order_cancelled'),  # Отменен из нового
-                ('processing', 'cancelled', 'order_cancelled'),  # Отменен из обработки
-                ('new', 'cancelled', 'order_cancelled_by_user'),  # Отменен пользователем
-            ]
+            # Коды переводятся в id прямо в БД: INSERT ... SELECT из таблицы переходов с JOIN
+            # на статусы и типы уведомлений. Переходы с неизвестным статусом или типом отбрасывает JOIN.
+            # UNION ALL литералов вместо VALUES - SQLite не поддерживает имена колонок у VALUES.
+            # Повторы в списке схлопываются еще в Python (dict.fromkeys сохраняет порядок)
+            codes = union_all(*(
+                select(
+                    literal(from_status, String).label('from_code'),
+                    literal(to_status, String).label('to_code'),
+                    literal(notification_type, String).label('notification_code')
+                )
+                for from_status, to_status, notification_type in dict.fromkeys(STATUS_TRANSITIONS)
+            )).subquery('t')
+            statuses = OrderStatus.__table__
+            from_statuses = statuses.alias('s_from')
+            to_statuses = statuses.alias('s_to')
+            notification_types = NotificationType.__table__.alias('nt')
+            existing = StatusTransition.__table__.alias('st')
             
-            # Вставляем переходы
-            for from_status, to_status, notification_type in transitions:
-                from_status_id = statuses.get(from_status) if from_status else None
-                to_status_id = statuses.get(to_status)
-                notification_type_id = notifications.get(notification_type)
-                
-                if to_status_id and notification_type_id:
-                    await conn.execute(
-                        text("""
-                            INSERT INTO status_transitions (from_status_id, to_status_id, notification_type_id, is_active, created_at)
-                            VALUES (:from_status_id, :to_status_id, :notification_type_id, :is_active, CURRENT_TIMESTAMP)
-                            ON CONFLICT DO NOTHING
-                        """),
-                        {
-                            'from_status_id': from_status_id,
-                            'to_status_id': to_status_id,
-                            'notification_type_id': notification_type_id,
-                            'is_active': True
-                        }
-                    )
+            transitions_select = (
+                select(
+                    from_statuses.c.id,
+                    to_statuses.c.id,
+                    notification_types.c.id,
+                    true(),
+                    func.current_timestamp()
+                )
+                .select_from(
+                    codes
+                    .outerjoin(from_statuses, from_statuses.c.code == codes.c.from_code)
+                    .join(to_statuses, to_statuses.c.code == codes.c.to_code)
+                    .join(notification_types, notification_types.c.code == codes.c.notification_code)
+                )
+                # У status_transitions нет уникального ключа (а from_status_id может быть NULL),
+                # поэтому ON CONFLICT не срабатывает - уже созданные переходы отсекает NOT EXISTS
+                .where(~exists().where(
+                    existing.c.from_status_id.is_not_distinct_from(from_statuses.c.id),
+                    existing.c.to_status_id == to_statuses.c.id,
+                    existing.c.notification_type_id == notification_types.c.id
+                ))
+            )
+            result = await conn.execute(
+                dialect_insert(conn, StatusTransition.__table__)
+                .from_select(
+                    ['from_status_id', 'to_status_id', 'notification_type_id', 'is_active', 'created_at'],
+                    transitions_select
+                )
+            )
             
-            print("✅ Переходы статусов настроены успешно!")
+            print(f"✅ Переходы статусов настроены успешно! Новых: {result.rowcount}")
             print("🎉 Система уведомлений полностью настроена!")
             
     except Exception as e:
@@ -105,5 +130,13 @@ async def create_notification_system():
         logger.error(f"Migration error: {e}")
         raise
 
+async def main():
+    """Запуск как скрипта: общий движок закрывается после миграции"""
+    try:
+        await create_notification_system()
+    finally:
+        await get_async_engine().dispose()
+
 if __name__ == "__main__":
-    asyncio.run(create_notification_system()) 
\ No newline at end of file
+    install_event_loop_policy()
+    asyncio.run(main()) 
\ No newline at end of file
@@ -1,13 +1,13 @@
 import asyncio
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
-from app.config import Config
+from sqlalchemy import text
+from app.core.base import dialect_insert
+from app.database import get_async_engine
 from app.models.models import TPointsActivity
+from app.utils.event_loop import install_event_loop_policy
 
 async def create_tpoints_activities():
     """Создать T-Points активности в базе данных"""
-    config = Config()
-    engine = create_async_engine(config.DATABASE_URL)
-    async_session = async_sessionmaker(engine, expire_on_commit=False)
+    engine = get_async_engine()
     
     # Список всех активностей
     activities_data = [
@@ -43,33 +43,34 @@ async def create_tpoints_activities():
         ("anniversary_bonus", 100, "Юбилейный бонус (100 T-Points за каждый год работы)"),
     ]
     
-    async with async_session() as session:
+    async with engine.begin() as conn:
         print("Создание T-Points активностей...")
         
-        for name, points, description in activities_data:
-            # Проверяем, существует ли уже такая активность
-            from sqlalchemy import select
-            query = select(TPointsActivity).where(TPointsActivity.name == name)
-            result = await session.execute(query)
-            existing = result.scalar_one_or_none()
-            
-            if existing:
-                print(f"⚠️  Активность '{name}' уже существует, пропускаем")
-                continue
-            
-            activity = TPointsActivity(
-                name=name,
-                points=points,
-                description=description,
-                is_active=True
-            )
-            session.add(activity)
-            print(f"✅ Создана активность: {description} - {points} T-Points")
+        if conn.dialect.name == "postgresql":
+            # Разовая идемпотентная загрузка: не ждем fsync при коммите (только в этой транзакции)
+            await conn.execute(text("SET LOCAL synchronous_commit = OFF"))
+        rows = [
+            {'name': name, 'points': points, 'description': description, 'is_active': True}
+            for name, points, description in activities_data
+        ]
+        # Один INSERT на все активности; уже существующие пропускаются по уникальному name
+        result = await conn.execute(
+            dialect_insert(conn, TPointsActivity.__table__)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=['name'])
+        )
         
-        await session.commit()
+        # Итог вместо построчного вывода: сколько добавлено, сколько уже было
+        print(f"✅ Создано активностей: {result.rowcount}, уже существовало: {len(rows) - result.rowcount}")
         print("\n🎉 Все T-Points активности созданы!")
-    
-    await engine.dispose()
+
+async def main():
+    """Запуск как скрипта: общий движок закрывается после миграции"""
+    try:
+        await create_tpoints_activities()
+    finally:
+        await get_async_engine().dispose()
 
 if __name__ == "__main__":
-    asyncio.run(create_tpoints_activities()) 
\ No newline at end of file
+    install_event_loop_policy()
+    asyncio.run(main()) 
\ No newline at end of file
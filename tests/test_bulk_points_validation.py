@@ -0,0 +1,46 @@
+"""Проверка строк массовой операции с T-Points до обращения к БД"""
+import asyncio
+
+import pytest
+
+from app.services.transaction_service import TransactionService
+
+
+@pytest.mark.parametrize('raw, expected', [
+    (5, 5),
+    ('5', 5),
+    (' 7 ', 7),
+    (3.0, 3),
+    ('1e3', 1000),
+    (-3, -3),
+    (2.5, None),
+    ('2.5', None),
+    ('abc', None),
+    ('', None),
+    (True, None),
+    (float('nan'), None),
+    (float('inf'), None),
+])
+def test_parse_points(raw, expected):
+    assert TransactionService._parse_points(raw) == expected
+
+
+@pytest.mark.parametrize('operation, error', [
+    ({'user_id': 1, 'points': 2.5, 'description': 'Бонус', 'operation': 'add'},
+     "Строка 1: Количество T-Points должно быть целым числом '2.5'"),
+    ({'user_id': 1, 'points': -5, 'description': 'Бонус', 'operation': 'add'},
+     "Строка 1: Некорректное количество T-Points '-5'"),
+    ({'user_id': 1, 'points': 0, 'description': 'Бонус', 'operation': 'remove'},
+     "Строка 1: Некорректное количество T-Points '0'"),
+    ({'user_id': 1, 'points': 5, 'description': '   ', 'operation': 'add'},
+     "Строка 1: Отсутствуют обязательные поля"),
+    ({'user_id': None, 'points': 5, 'description': 'Бонус', 'operation': 'add'},
+     "Строка 1: Отсутствуют обязательные поля"),
+    ({'user_id': 1, 'points': 5, 'description': 'Бонус', 'operation': 'move'},
+     "Строка 1: Неизвестная операция 'move'"),
+])
+def test_bulk_points_operation_rejects_invalid_rows(operation, error):
+    # Отклонённые строки не доходят до БД: сессия не нужна
+    service = TransactionService(session=None)
+    result = asyncio.run(service.bulk_points_operation([operation]))
+    assert result == {"success": 0, "failed": 1, "errors": [error]}
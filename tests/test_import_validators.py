@@ -0,0 +1,238 @@
+"""
+Проверка листов импорта (T-Points и пользователи) целыми колонками
+Ожидаемые значения совпадают с построчной проверкой до перехода на pandas
+(iterrows + int(float(x)) / datetime.strptime); осознанные отличия вынесены в отдельные тесты
+"""
+from datetime import date
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from app.services.user_manager_service import UserManagerService
+
+
+SHEET = 'Сотрудники'
+TPOINTS_COLUMNS = ('telegram_id', 'activity_name', 'points_to_add', 'reason')
+USERS_COLUMNS = ('telegram_id', 'fullname', 'birth_date', 'hire_date', 'department', 'is_active', 'tpoints')
+
+
+def make_sheet(columns, *rows):
+    """DataFrame в том виде, в каком его отдает _read_data_sheets: пустые ячейки - NaN"""
+    df = pd.DataFrame.from_records(list(rows), columns=list(columns))
+    return df.mask(df.eq('')).dropna(how='all')
+
+
+@pytest.fixture
+def service():
+    service = UserManagerService(session=None)
+    service._activity_index = {
+        'обучение': SimpleNamespace(id=7, name='Обучение', points=50, is_active=True),
+    }
+    return service
+
+
+def parse_tpoints(service, *rows):
+    errors = []
+    operations = service._parse_tpoints_sheet(make_sheet(TPOINTS_COLUMNS, *rows), SHEET, errors)
+    return operations, errors
+
+
+def parse_users(service, *rows):
+    errors = []
+    parsed = service._parse_users_sheet(make_sheet(USERS_COLUMNS, *rows), errors)
+    return parsed, errors
+
+
+def error_rows(errors):
+    """Номера строк из сообщений об ошибках ('Строка N ...')"""
+    return [int(error.split()[1]) for error in errors]
+
+
+class TestTPointsSheet:
+    def test_plain_row(self, service):
+        operations, errors = parse_tpoints(service, [111, '', 10, 'Бонус'])
+        assert operations == [(111, 10, 'Бонус', None, None)]
+        assert errors == []
+
+    def test_activity_autofills_points_and_reason(self, service):
+        operations, errors = parse_tpoints(service, [112, 'Обучение', '', ''])
+        assert operations == [(112, 50, 'Начисление за: Обучение', 'Обучение', 7)]
+        assert errors == []
+
+    def test_activity_lookup_ignores_case_and_spaces(self, service):
+        operations, errors = parse_tpoints(service, [113, ' обучение ', 5, 'Своя причина'])
+        assert operations == [(113, 5, 'Своя причина', 'обучение', 7)]
+        assert errors == []
+
+    @pytest.mark.parametrize('raw, expected', [
+        (2.7, 2),
+        ('2.7', 2),
+        (-3.5, -3),
+        (-4, -4),
+    ])
+    def test_fractional_and_negative_points_truncate_toward_zero(self, service, raw, expected):
+        # Как int(float(x)) в построчной проверке
+        operations, errors = parse_tpoints(service, [114, '', raw, 'Причина'])
+        assert operations == [(114, expected, 'Причина', None, None)]
+        assert errors == []
+
+    @pytest.mark.parametrize('raw', ['', 0, 0.0])
+    def test_blank_or_zero_points_are_skipped(self, service, raw):
+        operations, errors = parse_tpoints(service, [116, '', raw, 'Причина'])
+        assert operations == []
+        assert errors == []
+
+    def test_missing_reason_is_rejected(self, service):
+        operations, errors = parse_tpoints(service, [118, '', 10, '   '])
+        assert operations == []
+        assert errors == [f"Строка 1 в {SHEET}: нет причины"]
+
+    def test_unknown_activity_is_rejected(self, service):
+        operations, errors = parse_tpoints(service, [119, 'Неизвестная', 10, 'Причина'])
+        assert operations == []
+        assert errors == [f"Строка 1 в {SHEET}: Активность 'Неизвестная' не найдена"]
+
+    @pytest.mark.parametrize('row', [
+        [120, '', 'abc', 'Причина'],
+        ['abc', '', 10, 'Причина'],
+        ['', '', 10, 'Причина'],
+    ])
+    def test_invalid_values_are_rejected(self, service, row):
+        operations, errors = parse_tpoints(service, row)
+        assert operations == []
+        assert error_rows(errors) == [1]
+
+    def test_duplicate_rows_are_kept(self, service):
+        operations, errors = parse_tpoints(
+            service,
+            [111, '', 10, 'Бонус'],
+            [111, '', 10, 'Бонус'],
+        )
+        assert operations == [(111, 10, 'Бонус', None, None)] * 2
+        assert errors == []
+
+    # Осознанные отличия от построчной проверки
+
+    def test_template_row_without_id_and_points_is_skipped(self, service):
+        # Раньше int(NaN) давал ошибку на каждой хвостовой строке шаблона
+        operations, errors = parse_tpoints(service, ['', '', '', 'Заготовка'])
+        assert operations == []
+        assert errors == []
+
+    def test_points_truncated_to_zero_are_skipped(self, service):
+        # Раньше 0.5 проходила проверку на 0 до усечения и превращалась в операцию на 0 баллов,
+        # которая затем отклонялась при начислении
+        operations, errors = parse_tpoints(service, [117, '', 0.5, 'Причина'])
+        assert operations == []
+        assert errors == []
+
+    def test_blank_rows_are_dropped_without_renumbering(self, service):
+        # Раньше полностью пустая строка давала ошибку int(NaN); номера строк не изменились
+        operations, errors = parse_tpoints(
+            service,
+            [111, '', 10, 'Бонус'],
+            ['', '', '', ''],
+            [118, '', 10, ''],
+        )
+        assert operations == [(111, 10, 'Бонус', None, None)]
+        assert errors == [f"Строка 3 в {SHEET}: нет причины"]
+
+    def test_fractional_telegram_id_is_rejected(self, service):
+        # Раньше int() усекал ID и баллы могли уйти другому пользователю
+        operations, errors = parse_tpoints(service, [111.5, '', 10, 'Бонус'])
+        assert operations == []
+        assert errors == [f"Строка 1 в {SHEET}: некорректный telegram_id"]
+
+
+class TestUsersSheet:
+    def test_full_row(self, service):
+        parsed, errors = parse_users(service, [201, 'Иван Иванов', '1990-05-01', '2020-01-15', 'IT', True, 100])
+        assert parsed == [{
+            'telegram_id': 201,
+            'fullname': 'Иван Иванов',
+            'birth_date': '1990-05-01',
+            'birth_date_value': date(1990, 5, 1),
+            'hire_date': '2020-01-15',
+            'hire_date_value': date(2020, 1, 15),
+            'department': 'IT',
+            'is_active': True,
+            'tpoints': 100,
+        }]
+        assert errors == []
+
+    def test_optional_cells_may_be_blank(self, service):
+        parsed, errors = parse_users(service, [202, 'Петр', '', '', 'HR', '', ''])
+        assert errors == []
+        [row] = parsed
+        assert row['birth_date'] == '' and row['hire_date'] == ''
+        assert row['is_active'] is True
+        assert row['tpoints'] is None
+
+    @pytest.mark.parametrize('raw, expected', [(0, False), (False, False), (1, True), (True, True)])
+    def test_is_active(self, service, raw, expected):
+        parsed, errors = parse_users(service, [203, 'Анна', '', '', '', raw, ''])
+        assert errors == []
+        assert parsed[0]['is_active'] is expected
+
+    @pytest.mark.parametrize('raw, expected', [(10.9, 10), (-5, -5), (7, 7)])
+    def test_tpoints_truncate_toward_zero(self, service, raw, expected):
+        # Как int(row['tpoints']) в построчной проверке
+        parsed, errors = parse_users(service, [204, 'Олег', '', '', '', True, raw])
+        assert errors == []
+        assert parsed[0]['tpoints'] == expected
+
+    def test_blank_fullname_is_rejected(self, service):
+        parsed, errors = parse_users(service, [205, '   ', '1990-01-01', '', '', True, ''])
+        assert parsed == []
+        assert errors == ["Строка 1: fullname обязательно"]
+
+    def test_bad_birth_date_is_rejected(self, service):
+        parsed, errors = parse_users(service, [206, 'Анна', '01.02.1990', '', '', True, ''])
+        assert parsed == []
+        assert errors == ["Строка 1: неверный формат birth_date (нужен YYYY-MM-DD)"]
+
+    def test_bad_hire_date_is_rejected(self, service):
+        parsed, errors = parse_users(service, [207, 'Анна', '1990-02-01', '2020/01/01', '', True, ''])
+        assert parsed == []
+        assert errors == ["Строка 1: неверный формат hire_date"]
+
+    def test_first_failed_check_wins(self, service):
+        # Порядок проверок прежний: telegram_id, fullname, birth_date, hire_date
+        parsed, errors = parse_users(
+            service,
+            ['abc', '', 'bad', 'bad', '', True, ''],
+            [208, '', 'bad', 'bad', '', True, ''],
+            [209, 'Анна', 'bad', 'bad', '', True, ''],
+        )
+        assert parsed == []
+        assert errors == [
+            "Строка 1: некорректный telegram_id",
+            "Строка 2: fullname обязательно",
+            "Строка 3: неверный формат birth_date (нужен YYYY-MM-DD)",
+        ]
+
+    def test_duplicate_rows_are_kept(self, service):
+        row = [201, 'Иван Иванов', '1990-05-01', '', 'IT', True, '']
+        parsed, errors = parse_users(service, row, row)
+        assert errors == []
+        assert [r['telegram_id'] for r in parsed] == [201, 201]
+
+    # Осознанные отличия от построчной проверки
+
+    def test_blank_cells_are_empty_not_nan(self, service):
+        # Раньше str(NaN) превращал пустой отдел в строку 'nan'
+        parsed, errors = parse_users(service, [210, 'Петр', '', '', '', True, ''])
+        assert errors == []
+        assert parsed[0]['department'] == ''
+
+    def test_missing_fullname_is_rejected(self, service):
+        # Раньше пустая ячейка давала ФИО 'nan'
+        parsed, errors = parse_users(service, [211, '', '', '', '', True, ''])
+        assert parsed == []
+        assert errors == ["Строка 1: fullname обязательно"]
+
+    def test_fractional_telegram_id_is_rejected(self, service):
+        parsed, errors = parse_users(service, [212.5, 'Петр', '', '', '', True, ''])
+        assert parsed == []
+        assert errors == ["Строка 1: некорректный telegram_id"]
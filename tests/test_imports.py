@@ -0,0 +1,28 @@
+"""
+Smoke-тест импорта: каждый модуль пакета app должен импортироваться без ошибок
+Ловит ошибки уровня модуля (неопределённые имена в аннотациях, битые импорты),
+из-за которых бот не запускается вовсе
+"""
+import importlib
+from pathlib import Path
+
+import pytest
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Список строится по файлам, а не через pkgutil.walk_packages: тот молча пропускает
+# содержимое пакетов, чей __init__ не импортировался
+APP_MODULES = sorted(
+    '.'.join(path.relative_to(ROOT).with_suffix('').parts).removesuffix('.__init__')
+    for path in (ROOT / 'app').rglob('*.py')
+)
+
+
+@pytest.mark.parametrize('module_name', APP_MODULES)
+def test_module_imports(module_name):
+    importlib.import_module(module_name)
+
+
+def test_main_imports():
+    importlib.import_module('main')
@@ -0,0 +1,90 @@
+"""Тесты in-process кэша TTLCache"""
+import asyncio
+
+from app.utils.ttl_cache import TTLCache
+
+
+def test_get_or_load_skips_value_loaded_across_delete():
+    cache = TTLCache(ttl_seconds=60)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow_loader():
+            await release.wait()
+            return 'admin'
+
+        task = asyncio.create_task(cache.get_or_load(1, slow_loader))
+        await asyncio.sleep(0)
+        # Роль изменилась и кэш сброшен, пока загрузка старого значения ещё шла
+        cache.delete(1)
+        release.set()
+        return await task
+
+    assert asyncio.run(scenario()) == 'admin'
+    assert cache.get(1) is None
+
+
+def test_get_or_load_caches_value():
+    cache = TTLCache(ttl_seconds=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return 'user'
+
+    async def scenario():
+        return [await cache.get_or_load(1, loader) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == ['user'] * 3
+    assert len(calls) == 1
+
+
+def test_get_or_load_never_runs_loaders_in_parallel():
+    cache = TTLCache(ttl_seconds=60)
+    active = []
+    peak = []
+
+    async def scenario():
+        async def loader():
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0)
+            active.pop()
+            # None не кэшируется: каждый ожидающий загружает сам, но строго по очереди
+            return None
+
+        tasks = [asyncio.create_task(cache.get_or_load(1, loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        # Вызов, пришедший, пока предыдущие ещё ждут замок, встаёт в ту же очередь
+        tasks.append(asyncio.create_task(cache.get_or_load(1, loader)))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert len(peak) == 4
+    assert max(peak) == 1
+    assert not cache._locks and not cache._waiters
+
+def test_get_or_load_loads_once_for_concurrent_misses():
+    cache = TTLCache(ttl_seconds=60)
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return 'user'
+
+        tasks = [asyncio.create_task(cache.get_or_load(1, loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(cache.get_or_load(1, loader)))
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(scenario()) == ['user'] * 4
+    assert len(calls) == 1
+    assert not cache._locks and not cache._waiters